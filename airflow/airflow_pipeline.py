@@ -756,6 +756,10 @@ def setup_tables() -> None:
     # Compile a list of queries to execute
     queries = {
         "drop_tables": {
+            "drop_extraction_context_table"         : "DROP TABLE IF EXISTS extraction_context;",
+            "drop_evaluation_job_tasks_table"       : "DROP TABLE IF EXISTS evaluation_job_tasks;",
+            "drop_evaluation_jobs_table"            : "DROP TABLE IF EXISTS evaluation_jobs;",
+            "drop_revoked_tokens_table"             : "DROP TABLE IF EXISTS revoked_tokens;",
             "drop_analytics_table"                  : "DROP TABLE IF EXISTS analytics;",
             "drop_annotation_table"                 : "DROP TABLE IF EXISTS gaia_annotations;",
             "drop_features_table"                   : "DROP TABLE IF EXISTS gaia_features;",
@@ -878,9 +882,67 @@ def setup_tables() -> None:
                     time_stamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                     extraction_service varchar(50) DEFAULT NULL,
                     marked_correct int(11) DEFAULT NULL,
+                    from_cache TINYINT(1) NOT NULL DEFAULT 0,
+                    job_id INT DEFAULT NULL,
+                    INDEX (time_stamp),
+                    UNIQUE KEY job_task (job_id, task_id),
                     FOREIGN KEY (user_id) REFERENCES users(user_id),
                     FOREIGN KEY (task_id) REFERENCES gaia_features(task_id)
                 );
+            """,
+            "create_extraction_context_table": """
+                CREATE TABLE IF NOT EXISTS extraction_context(
+                    task_id VARCHAR(255) NOT NULL,
+                    service VARCHAR(50) NOT NULL,
+                    content MEDIUMTEXT NOT NULL,
+                    content_tokens INT NOT NULL,
+                    pages JSON NOT NULL,
+                    total_tokens INT NOT NULL,
+                    built_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (task_id, service)
+                );
+            """,
+            "create_evaluation_jobs_table": """
+                CREATE TABLE IF NOT EXISTS evaluation_jobs(
+                    job_id INT PRIMARY KEY AUTO_INCREMENT,
+                    user_id INT NOT NULL,
+                    service VARCHAR(50) NOT NULL,
+                    model VARCHAR(100) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                    total_tasks INT NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    INDEX (status),
+                    FOREIGN KEY (user_id) REFERENCES users(user_id)
+                );
+            """,
+            "create_evaluation_job_tasks_table": """
+                CREATE TABLE IF NOT EXISTS evaluation_job_tasks(
+                    job_id INT NOT NULL,
+                    task_id VARCHAR(255) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                    attempts INT NOT NULL DEFAULT 0,
+                    lease_owner VARCHAR(255) DEFAULT NULL,
+                    lease_expires_at DATETIME DEFAULT NULL,
+                    correct TINYINT(1) DEFAULT NULL,
+                    error TEXT DEFAULT NULL,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (job_id, task_id),
+                    INDEX (status, lease_expires_at),
+                    INDEX (lease_owner),
+                    FOREIGN KEY (job_id) REFERENCES evaluation_jobs(job_id),
+                    FOREIGN KEY (task_id) REFERENCES gaia_features(task_id)
+                );
+            """,
+            "create_revoked_tokens_table": """
+                CREATE TABLE IF NOT EXISTS revoked_tokens(
+                    jti VARCHAR(64) PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    expires_at DATETIME NOT NULL,
+                    revoked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    INDEX (expires_at),
+                    FOREIGN KEY (user_id) REFERENCES users(user_id)
+                );
             """
         }
     }
@@ -0,0 +1,182 @@
+import os
+import time
+import asyncio
+import logging
+from dotenv import load_dotenv
+from typing import Any, Optional
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Custom libraries
+from metrics import admission_queue_seconds, admission_rejected, admission_queue_depth
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# Requests served at once and requests allowed to wait, per route class
+ADMISSION_GPT_CONCURRENCY = int(os.getenv('ADMISSION_GPT_CONCURRENCY', 16))
+ADMISSION_GPT_QUEUE = int(os.getenv('ADMISSION_GPT_QUEUE', 32))
+ADMISSION_DEFAULT_CONCURRENCY = int(os.getenv('ADMISSION_DEFAULT_CONCURRENCY', 64))
+ADMISSION_SLOW_CONCURRENCY = int(os.getenv('ADMISSION_SLOW_CONCURRENCY', 8))
+ADMISSION_SLOW_QUEUE = int(os.getenv('ADMISSION_SLOW_QUEUE', 16))
+ADMISSION_DEFAULT_CONCURRENCY = int(os.getenv('ADMISSION_DEFAULT_CONCURRENCY', 64))
+ADMISSION_DEFAULT_QUEUE = int(os.getenv('ADMISSION_DEFAULT_QUEUE', 128))
+
+# Seconds a request may wait for a slot, and the Retry-After sent when it is shed
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 5))
+
+# Routes calling GPT, limited separately so they cannot starve the cheap reads
+GPT_ROUTES = ("/querygpt",)
+
+# Long database work (the /analytics export, job bookkeeping, flushing the
+# analytics writer), limited separately for the same reason
+SLOW_ROUTES = ("/analytics", "/jobs", "/feedback", "/markcorrect")
+
+# Probes and scrapes are always let through
+EXEMPT_ROUTES = ("/health", "/metrics")
+
+
+class AdmissionClass:
+    '''A concurrency limit with a bounded wait queue'''
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int) -> None:
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    async def admit(self, timeout: float) -> bool:
+        '''Wait for a slot, False if the queue is full or the wait timed out'''
+
+        queued_at = time.perf_counter()
+
+        # A free slot is taken at once, without yielding to the event loop
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+
+        else:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                admission_rejected.inc(route_class = self.name, reason = "queue_full")
+                return False
+
+            self.waiting += 1
+            admission_queue_depth.inc(route_class = self.name)
+            try:
+
+                # The deadline cancels the acquire itself, so a permit granted as it expires is never leaked
+                async with asyncio.timeout(timeout):
+                    await self._semaphore.acquire()
+            except TimeoutError:
+                self.rejected += 1
+                admission_rejected.inc(route_class = self.name, reason = "timeout")
+                return False
+            finally:
+                self.waiting -= 1
+                admission_queue_depth.dec(route_class = self.name)
+
+        admission_queue_seconds.observe(time.perf_counter() - queued_at, route_class = self.name)
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'max_concurrency'   : self.max_concurrency,
+            'max_queue'         : self.max_queue,
+            'queue_depth'       : self.waiting,
+            'in_flight'         : self.in_flight,
+            'admitted'          : self.admitted,
+            'rejected'          : self.rejected
+        }
+
+
+admission_classes = {
+    'gpt'       : AdmissionClass("gpt", ADMISSION_GPT_CONCURRENCY, ADMISSION_GPT_QUEUE),
+    'slow'      : AdmissionClass("slow", ADMISSION_SLOW_CONCURRENCY, ADMISSION_SLOW_QUEUE),
+    'default'   : AdmissionClass("default", ADMISSION_DEFAULT_CONCURRENCY, ADMISSION_DEFAULT_QUEUE)
+}
+
+
+def route_class(path: str) -> Optional[AdmissionClass]:
+    '''Admission class of a request path, None for exempt routes'''
+
+    if path in EXEMPT_ROUTES:
+        return None
+    if path.startswith(GPT_ROUTES):
+        return admission_classes['gpt']
+    if path.startswith(SLOW_ROUTES):
+        return admission_classes['slow']
+    return admission_classes['default']
+
+
+class AdmissionMiddleware:
+    '''Admit every HTTP request through the limit of its route class.
+
+    This is a plain ASGI middleware so that the permit is released in a
+    finally around the whole downstream call, response body included.
+    A client disconnecting before or while the body is sent never leaks
+    a slot, which a body_iterator wrapper cannot guarantee.
+    '''
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        admission_class = route_class(scope['path']) if scope['type'] == "http" else None
+        if admission_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await admission_class.admit(ADMISSION_QUEUE_TIMEOUT):
+            logger.warning(f"INTERNAL - {scope['path']} shed, the {admission_class.name} queue is full")
+            response = JSONResponse(
+                status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers     = {'Retry-After': str(ADMISSION_RETRY_AFTER)},
+                content     = {
+                    'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                    'type'      : "string",
+                    'message'   : "The service is busy. Please retry later."
+                }
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission_class.release()
+
+
+def admission_stats() -> dict[str, Any]:
+    return {name: admission_class.stats() for name, admission_class in admission_classes.items()}
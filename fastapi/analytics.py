@@ -0,0 +1,429 @@
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import threading
+from collections import deque
+from dotenv import load_dotenv
+from typing import Any, Optional
+from mysql.connector.errors import DataError, IntegrityError
+
+# Custom libraries
+from database import get_connection
+from repository import DatabaseUnavailable
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+
+# Rows per multi-row INSERT, and the longest a row waits before being written
+ANALYTICS_FLUSH_ROWS = int(os.getenv('ANALYTICS_FLUSH_ROWS', 50))
+ANALYTICS_FLUSH_MS = int(os.getenv('ANALYTICS_FLUSH_MS', 500))
+
+# Rows held in memory, beyond that (or when the database is down) rows go to the spill file
+ANALYTICS_BUFFER_ROWS = int(os.getenv('ANALYTICS_BUFFER_ROWS', 5000))
+ANALYTICS_SPILL_FILE = os.getenv('ANALYTICS_SPILL_FILE', "analytics_spill.jsonl")
+
+# Seconds to wait before replaying the spill file again after a failed replay
+ANALYTICS_REPLAY_SECONDS = float(os.getenv('ANALYTICS_REPLAY_SECONDS', 30))
+
+# Errors caused by the row itself rather than the database, retrying such a row never helps
+ROW_ERRORS = (IntegrityError, DataError)
+
+# Columns added to the analytics table after the Airflow pipeline first created it
+ANALYTICS_MIGRATIONS = {
+    'from_cache'    : "TINYINT(1) NOT NULL DEFAULT 0",
+    'job_id'        : "INT DEFAULT NULL"
+}
+
+# Indexes added after the Airflow pipeline first created the table
+ANALYTICS_INDEXES = {
+    'job_task'      : "UNIQUE KEY job_task (job_id, task_id)"
+}
+
+# Set once the analytics table is known to have every column
+_migrated = False
+
+
+def migrate_analytics() -> bool:
+    '''Add the columns missing from an analytics table created by an older pipeline'''
+
+    global _migrated
+
+    try:
+        with get_connection() as conn:
+            if conn is None:
+                raise DatabaseUnavailable()
+
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT column_name FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = 'analytics'"
+                )
+                columns = {column.lower() for (column,) in cursor.fetchall()}
+
+                # The pipeline creates the table with every column
+                if not columns:
+                    return False
+
+                for column, definition in ANALYTICS_MIGRATIONS.items():
+                    if column not in columns:
+                        logger.info(f"SQL - migrate_analytics() - Adding the {column} column to analytics")
+                        cursor.execute(f"ALTER TABLE analytics ADD COLUMN {column} {definition}")
+
+                cursor.execute(
+                    "SELECT DISTINCT index_name FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = 'analytics'"
+                )
+                indexes = {index.lower() for (index,) in cursor.fetchall()}
+
+                for index, definition in ANALYTICS_INDEXES.items():
+                    if index not in indexes:
+                        logger.info(f"SQL - migrate_analytics() - Adding the {index} index to analytics")
+                        cursor.execute(f"ALTER TABLE analytics ADD {definition}")
+                conn.commit()
+
+    except Exception as exception:
+        logger.error("Error: migrate_analytics() could not check the analytics table")
+        logger.error(exception)
+        return False
+
+    _migrated = True
+    return True
+
+
+def insert_rows(rows: list[dict[str, Any]]) -> None:
+    '''Save analytics rows with one executemany() per set of columns, raises on failure.
+
+    A job task's row is unique on (job_id, task_id), writing it again is a no-op.
+    '''
+
+    # Rows carry every column, so an older table is migrated before the first write
+    if not _migrated:
+        migrate_analytics()
+
+    # Rows with the same columns are inserted together
+    groups: dict[tuple[str, ...], list[tuple]] = {}
+    for row in rows:
+        groups.setdefault(tuple(row.keys()), []).append(tuple(row.values()))
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor() as cursor:
+            for columns, values in groups.items():
+                logger.info(f"SQL - Running a bulk INSERT statement for {len(values)} rows")
+                query = (
+                    f"INSERT INTO analytics ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                    "ON DUPLICATE KEY UPDATE id = id"
+                )
+                cursor.executemany(query, values)
+            conn.commit()
+            logger.info("SQL - Bulk INSERT statement complete")
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AnalyticsWriter:
+    '''Write-behind queue for the analytics table.
+
+    Requests only append their row to a buffer. A background thread
+    writes the buffer with multi-row INSERTs every flush_rows rows or
+    flush_ms milliseconds, whichever comes first. Rows that cannot be
+    written, or that overflow the buffer, are appended to a JSONL spill
+    file and replayed once the database accepts writes again. Rows the
+    database rejects on their own (a constraint or data error) are moved
+    to a dead-letter file instead of being replayed forever.
+
+    Each process spills to its own files, named after spill_file with
+    the process id added, so uvicorn workers sharing the setting never
+    rename or remove each other's files. The files of processes that
+    have exited are taken over and replayed when the writer starts.
+    '''
+
+    def __init__(self, flush_rows: int, flush_ms: int, max_rows: int, spill_file: str) -> None:
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_ms / 1000
+        self.max_rows = max_rows
+        self.spill_file = spill_file
+        self._rows: deque[dict[str, Any]] = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_replay = 0.0
+        self.written = 0
+        self.flushes = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.dead_lettered = 0
+        self.failed_flushes = 0
+
+    def _process_path(self, suffix: str = "") -> str:
+        root, extension = os.path.splitext(self.spill_file)
+        return f"{root}.{os.getpid()}{suffix}{extension}"
+
+    @property
+    def spill_path(self) -> str:
+        return self._process_path()
+
+    @property
+    def replay_path(self) -> str:
+        return f"{self.spill_path}.replay"
+
+    @property
+    def dead_letter_path(self) -> str:
+        return self._process_path(".dead")
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target = self._run, name = "analytics-writer", daemon = True)
+                self._thread.start()
+
+    def enqueue(self, row: dict[str, Any]) -> None:
+        '''Queue a row for writing, never blocks on the database'''
+
+        self.enqueue_many([row])
+
+    def enqueue_many(self, rows: list[dict[str, Any]]) -> None:
+        '''Queue rows for writing under a single lock, the ones past max_rows are spilled'''
+
+        if not rows:
+            return
+
+        self.start()
+        with self._lock:
+            room = max(0, self.max_rows - len(self._rows))
+            self._rows.extend(rows[:room])
+            pending = len(self._rows)
+
+        if room < len(rows):
+            self._spill(rows[room:])
+        if pending >= self.flush_rows:
+            self._wakeup.set()
+
+    def _run(self) -> None:
+        self._adopt_orphans()
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def _take(self) -> list[dict[str, Any]]:
+        with self._lock:
+            rows = list(self._rows)
+            self._rows.clear()
+        return rows
+
+    def flush(self) -> None:
+        '''Write every buffered row, then replay the spill file'''
+
+        with self._flush_lock:
+            rows = self._take()
+            written = 0
+
+            try:
+                for start in range(0, len(rows), self.flush_rows):
+                    chunk = rows[start:start + self.flush_rows]
+                    insert_rows(chunk)
+                    written += len(chunk)
+
+            except Exception as exception:
+                self.failed_flushes += 1
+                logger.error(f"Error: AnalyticsWriter could not write {len(rows) - written} row(s), spilling them to disk")
+                logger.error(exception)
+                self._spill(rows[written:])
+                self._next_replay = time.monotonic() + ANALYTICS_REPLAY_SECONDS
+                return
+
+            finally:
+                self.written += written
+
+            if rows:
+                self.flushes += 1
+            self._replay()
+
+    def _append(self, path: str, rows: list[dict[str, Any]]) -> None:
+        '''Append rows to a JSONL file, the lines are built before taking the file lock'''
+
+        lines = "".join(json.dumps(row, default = str) + "\n" for row in rows)
+        with self._file_lock:
+            with open(path, 'a') as file:
+                file.write(lines)
+
+    def _spill(self, rows: list[dict[str, Any]], count: bool = True) -> None:
+        self._append(self.spill_path, rows)
+        if count:
+            self.spilled += len(rows)
+
+    def _dead_letter(self, rows: list[dict[str, Any]]) -> None:
+        self._append(self.dead_letter_path, rows)
+        self.dead_lettered += len(rows)
+        logger.error(f"Error: AnalyticsWriter moved {len(rows)} rejected row(s) to {self.dead_letter_path}")
+
+    def _adopt_orphans(self) -> None:
+        '''Append the spill files of processes that exited to this process's spill file'''
+
+        directory, name = os.path.split(self.spill_file)
+        root, extension = os.path.splitext(name)
+        pattern = re.compile(rf"{re.escape(root)}\.(\d+){re.escape(extension)}(\.replay|\.adopted)?")
+
+        try:
+            names = os.listdir(directory or ".")
+        except OSError:
+            return
+
+        for candidate in names:
+            match = pattern.fullmatch(candidate)
+            if match is not None:
+                pid = int(match.group(1))
+                if pid == os.getpid() or process_alive(pid):
+                    continue
+
+            # The shared file written before spill files were per process is adopted too
+            elif candidate != name:
+                continue
+
+            # Renaming first means only one process adopts each file
+            adopted = f"{self.spill_path}.adopted"
+            try:
+                os.replace(os.path.join(directory, candidate), adopted)
+            except FileNotFoundError:
+                continue
+
+            with self._file_lock:
+                with open(adopted, 'r') as source, open(self.spill_path, 'a') as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(adopted)
+            logger.info(f"INTERNAL - Took over the analytics spill file {candidate}")
+
+    def _replay(self) -> None:
+        '''Write the spilled rows back, keeping the unwritten ones if the database still fails'''
+
+        with self._file_lock:
+            if time.monotonic() < self._next_replay or not os.path.exists(self.spill_path):
+                return
+            os.replace(self.spill_path, self.replay_path)
+
+        rows = []
+        broken = []
+        with open(self.replay_path, 'r') as file:
+            for line in file:
+                if line.strip():
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        broken.append({'line': line.rstrip("\n")})
+
+        written = 0
+        rejected = []
+        try:
+            while written < len(rows):
+                chunk = rows[written:written + self.flush_rows]
+                try:
+                    insert_rows(chunk)
+                    written += len(chunk)
+
+                # One bad row fails its whole chunk, so the chunk is retried row by row
+                except ROW_ERRORS:
+                    for row in chunk:
+                        try:
+                            insert_rows([row])
+                        except ROW_ERRORS as exception:
+                            logger.error(f"Error: AnalyticsWriter could not replay a row : {exception}")
+                            rejected.append(row)
+                        written += 1
+
+        except Exception as exception:
+            logger.error(f"Error: AnalyticsWriter could not replay {len(rows) - written} spilled row(s)")
+            logger.error(exception)
+            self._next_replay = time.monotonic() + ANALYTICS_REPLAY_SECONDS
+            self._spill(rows[written:], count = False)
+
+        finally:
+            if rejected or broken:
+                self._dead_letter(rejected + broken)
+            self.replayed += written - len(rejected)
+            os.remove(self.replay_path)
+
+        if written == len(rows):
+            logger.info(f"INTERNAL - Replayed {written - len(rejected)} spilled analytics row(s)")
+
+    def close(self) -> None:
+        '''Stop the background thread and write what is left'''
+
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'buffered'          : len(self._rows),
+            'written'           : self.written,
+            'flushes'           : self.flushes,
+            'failed_flushes'    : self.failed_flushes,
+            'spilled'           : self.spilled,
+            'replayed'          : self.replayed,
+            'dead_lettered'     : self.dead_lettered
+        }
+
+
+analytics_writer = AnalyticsWriter(ANALYTICS_FLUSH_ROWS, ANALYTICS_FLUSH_MS, ANALYTICS_BUFFER_ROWS, ANALYTICS_SPILL_FILE)
+
+
+def update_analytics(data: dict) -> None:
+    '''Queue GPT-4's response and some other data to be saved to the database.
+
+    The row is written behind the request and a failed write is spilled
+    and replayed, so there is nothing to report. Call insert_rows() when
+    the row must be in the database before moving on.
+    '''
+
+    analytics_writer.enqueue(data)
+
+
+async def async_update_analytics(data: dict) -> None:
+    '''Async variant of update_analytics(), the row is written in the background'''
+
+    analytics_writer.enqueue(data)
+
+
+async def async_insert_analytics(rows: list[dict[str, Any]]) -> None:
+    '''Queue many analytics rows at once, they are written together in the background'''
+
+    analytics_writer.enqueue_many(rows)
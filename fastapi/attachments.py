@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+from typing import Optional, Any
+from collections import OrderedDict
+from google.cloud import storage
+from google.oauth2 import service_account
+from concurrent.futures import ThreadPoolExecutor
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# Number of parallel downloads used by the startup prefetch
+ATTACHMENT_SYNC_WORKERS = int(os.getenv('ATTACHMENT_SYNC_WORKERS', 8))
+
+# Disk budget of the local attachment cache
+ATTACHMENT_CACHE_MAX_BYTES = int(os.getenv('ATTACHMENT_CACHE_MAX_MB', 1024)) * 1024 * 1024
+
+# Files used within this many seconds are never evicted (they may still be read)
+ATTACHMENT_EVICTION_GRACE = float(os.getenv('ATTACHMENT_EVICTION_GRACE', 60))
+
+# Name of the manifest recording which blob version each local file came from
+MANIFEST_FILE = ".manifest.json"
+
+
+class AttachmentCache:
+    '''Size-capped local cache of the GAIA attachments stored on GCS.
+
+    Requests call fetch() for the one file they need. A missing file is
+    downloaded on demand, and concurrent fetches of the same file wait on
+    a single download. Once the cache grows past max_bytes the least
+    recently used files are deleted. The optional startup prefetch fills
+    the cache in parallel and stops when the budget is reached.
+    '''
+
+    def __init__(self, max_bytes: int = ATTACHMENT_CACHE_MAX_BYTES) -> None:
+        self.download_dir = os.path.join(os.getcwd(), os.getenv('DOWNLOAD_DIR', "downloads"))
+        self.prefix = os.getenv("GCP_FILES_PATH", "")
+        self.manifest_path = os.path.join(self.download_dir, MANIFEST_FILE)
+        self.max_bytes = max_bytes
+
+        self._bucket = None
+        self._lock = threading.Lock()
+        self._file_locks: dict[str, threading.Lock] = {}
+        self.manifest: dict[str, dict[str, Any]] = self._load_manifest()
+
+        # Files ordered from least to most recently used
+        self._lru: OrderedDict[str, int] = OrderedDict(
+            (file_name, entry.get('size') or 0)
+            for file_name, entry in sorted(self.manifest.items(), key = lambda item: item[1].get('last_used', 0))
+        )
+        self._bytes = sum(self._lru.values())
+
+        # Cache counters
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        # Progress of the startup prefetch, reported by the readiness endpoint
+        self.state = "idle"
+        self.total = 0
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def _load_manifest(self) -> dict[str, dict[str, Any]]:
+        try:
+            with open(self.manifest_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self) -> None:
+        '''Write the manifest atomically'''
+
+        with self._lock:
+            snapshot = {file_name: dict(entry) for file_name, entry in self.manifest.items()}
+
+        os.makedirs(self.download_dir, exist_ok=True)
+        temp_path = f"{self.manifest_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(temp_path, self.manifest_path)
+
+    def bucket(self) -> storage.Bucket:
+        '''GCS bucket handle, created once'''
+
+        if self._bucket is None:
+            creds_file_path = os.path.join(os.getcwd(), os.getenv("GCS_CREDENTIALS_FILE"))
+            creds = service_account.Credentials.from_service_account_file(creds_file_path)
+            client = storage.Client(credentials = creds)
+            self._bucket = client.bucket(os.getenv("BUCKET_NAME"))
+        return self._bucket
+
+    def local_path(self, file_name: str) -> str:
+        return os.path.join(self.download_dir, file_name)
+
+    def _file_lock(self, file_name: str) -> threading.Lock:
+        with self._lock:
+            return self._file_locks.setdefault(file_name, threading.Lock())
+
+    def is_current(self, file_name: str, blob: Optional[storage.Blob] = None) -> bool:
+        '''True if the local copy exists and matches the blob (or the manifest when no blob is given)'''
+
+        entry = self.manifest.get(file_name)
+        if entry is None or not os.path.exists(self.local_path(file_name)):
+            return False
+        if blob is None:
+            return True
+        return entry.get('generation') == blob.generation and entry.get('md5_hash') == blob.md5_hash
+
+    def _touch(self, file_name: str) -> None:
+        '''Mark a file as the most recently used'''
+
+        with self._lock:
+            entry = self.manifest.get(file_name)
+            if entry is not None:
+                entry['last_used'] = time.time()
+            if file_name in self._lru:
+                self._lru.move_to_end(file_name)
+
+    def _download_locked(self, blob: storage.Blob) -> None:
+        '''Download a blob and record it in the manifest (caller holds the file lock)'''
+
+        file_name = os.path.basename(blob.name)
+        os.makedirs(self.download_dir, exist_ok=True)
+        temp_path = f"{self.local_path(file_name)}.part"
+        blob.download_to_filename(temp_path)
+        os.replace(temp_path, self.local_path(file_name))
+
+        size = os.path.getsize(self.local_path(file_name))
+        with self._lock:
+            self._bytes -= self._lru.pop(file_name, 0)
+            self._lru[file_name] = size
+            self._bytes += size
+            self.manifest[file_name] = {
+                'generation'    : blob.generation,
+                'md5_hash'      : blob.md5_hash,
+                'size'          : size,
+                'last_used'     : time.time()
+            }
+
+        logger.info(f"INTERNAL - Downloaded {file_name} from GCP")
+
+    def download(self, blob: storage.Blob) -> bool:
+        '''Download one blob unless the local copy is already current, returns True if it downloaded'''
+
+        file_name = os.path.basename(blob.name)
+        with self._file_lock(file_name):
+            if self.is_current(file_name, blob):
+                return False
+            self._download_locked(blob)
+            return True
+
+    def has_room(self) -> bool:
+        return self._bytes < self.max_bytes
+
+    def evict(self) -> int:
+        '''Delete least recently used files until the cache fits its budget, returns the number deleted'''
+
+        evicted = 0
+        cutoff = time.time() - ATTACHMENT_EVICTION_GRACE
+
+        with self._lock:
+            for file_name in list(self._lru):
+                if self._bytes <= self.max_bytes:
+                    break
+
+                # Files still in use are kept, even if that leaves the cache over budget
+                if self.manifest.get(file_name, {}).get('last_used', 0) > cutoff:
+                    continue
+
+                # Never wait on a file that is being downloaded
+                file_lock = self._file_locks.setdefault(file_name, threading.Lock())
+                if not file_lock.acquire(blocking = False):
+                    continue
+                try:
+                    try:
+                        os.remove(self.local_path(file_name))
+                    except FileNotFoundError:
+                        pass
+                    self._bytes -= self._lru.pop(file_name)
+                    self.manifest.pop(file_name, None)
+                    self.evictions += 1
+                    evicted += 1
+                finally:
+                    file_lock.release()
+
+        if evicted:
+            logger.info(f"INTERNAL - Evicted {evicted} attachment(s) from the local cache")
+        return evicted
+
+    def _prefetch_one(self, blob: storage.Blob) -> None:
+        try:
+            file_name = os.path.basename(blob.name)
+            if not self.is_current(file_name, blob) and not self.has_room():
+                with self._lock:
+                    self.skipped += 1
+                return
+
+            downloaded = self.download(blob)
+            with self._lock:
+                if downloaded:
+                    self.downloaded += 1
+                else:
+                    self.skipped += 1
+        except Exception as exception:
+            with self._lock:
+                self.failed += 1
+            logger.error(f"Error: AttachmentCache could not download {blob.name}")
+            logger.error(exception)
+
+    def run(self) -> None:
+        '''Prefetch the attachments under GCP_FILES_PATH until the cache is full (runs in a background thread)'''
+
+        logger.info("INTERNAL - GCP attachment prefetch started")
+        self.state = "running"
+        self.started_at = time.time()
+
+        try:
+            blobs = [blob for blob in self.bucket().list_blobs(prefix = self.prefix) if os.path.basename(blob.name)]
+            self.total = len(blobs)
+
+            with ThreadPoolExecutor(max_workers = ATTACHMENT_SYNC_WORKERS) as executor:
+                list(executor.map(self._prefetch_one, blobs))
+
+            self._save_manifest()
+            self.state = "complete" if self.failed == 0 else "degraded"
+            logger.info(f"INTERNAL - GCP attachment prefetch finished : {self.downloaded} downloaded, {self.skipped} skipped, {self.failed} failed")
+
+        except Exception as exception:
+            self.state = "failed"
+            logger.error("Error: AttachmentCache.run() encountered an error")
+            logger.error(exception)
+
+        finally:
+            self.finished_at = time.time()
+
+    def fetch(self, file_name: str) -> bool:
+        '''Make sure one attachment is on disk, returns False if it could not be fetched'''
+
+        if self.is_current(file_name):
+            self._touch(file_name)
+            with self._lock:
+                self.hits += 1
+            return True
+
+        try:
+            # Concurrent requests for the same file wait here for one download
+            with self._file_lock(file_name):
+                if self.is_current(file_name):
+                    self._touch(file_name)
+                    with self._lock:
+                        self.coalesced += 1
+                    return True
+
+                with self._lock:
+                    self.misses += 1
+
+                blob = self.bucket().get_blob(f"{self.prefix.rstrip('/')}/{file_name}" if self.prefix else file_name)
+                if blob is None:
+                    logger.error(f"INTERNAL - Attachment {file_name} was not found on GCP")
+                    return False
+
+                self._download_locked(blob)
+
+            self.evict()
+            self._save_manifest()
+            return True
+
+        except Exception as exception:
+            logger.error(f"Error: AttachmentCache.fetch() could not download {file_name}")
+            logger.error(exception)
+            return False
+
+    def stats(self) -> dict[str, Any]:
+        '''Snapshot of the cache counters'''
+
+        with self._lock:
+            return {
+                'files'         : len(self._lru),
+                'bytes'         : self._bytes,
+                'max_bytes'     : self.max_bytes,
+                'hits'          : self.hits,
+                'misses'        : self.misses,
+                'coalesced'     : self.coalesced,
+                'evictions'     : self.evictions
+            }
+
+    def status(self) -> dict[str, Any]:
+        '''Progress of the startup prefetch'''
+
+        return {
+            'state'         : self.state,
+            'total'         : self.total,
+            'downloaded'    : self.downloaded,
+            'skipped'       : self.skipped,
+            'failed'        : self.failed,
+            'started_at'    : self.started_at,
+            'finished_at'   : self.finished_at,
+            'cache'         : self.stats()
+        }
+
+
+attachment_cache = AttachmentCache()
+
+
+def start_attachment_prefetch() -> threading.Thread:
+    '''Start the attachment prefetch in a background thread'''
+
+    thread = threading.Thread(target = attachment_cache.run, name = "attachment-prefetch", daemon = True)
+    thread.start()
+    return thread
@@ -0,0 +1,201 @@
+import os
+import jwt
+import time
+import asyncio
+import hashlib
+import logging
+import datetime
+import threading
+from dotenv import load_dotenv
+from collections import OrderedDict
+from typing import Optional, Any
+from starlette.concurrency import run_in_threadpool
+
+# Custom libraries
+from helpers import SECRET_KEY
+from database import get_connection
+from repository import DatabaseUnavailable
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# Verified tokens kept in memory
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 10000))
+
+# Seconds between two background reloads of the revoked tokens
+REVOCATION_REFRESH_SECONDS = float(os.getenv('REVOCATION_REFRESH_SECONDS', 30))
+
+
+def token_expiry(claims: dict[str, Any]) -> float:
+    '''Expiry of a token as a UNIX timestamp, from its "expiration" claim'''
+
+    return datetime.datetime.fromisoformat(claims['expiration']).timestamp()
+
+
+def token_id(token: str, claims: dict[str, Any]) -> str:
+    '''The jti claim, or a digest of the token for tokens issued without one'''
+
+    return claims.get('jti') or hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenVerifier:
+    '''Verify JWTs in memory.
+
+    Decoded claims are kept in an LRU until their token expires, so a
+    token is only decoded once. Revoked tokens are held in a deny-list
+    reloaded in the background from the revoked_tokens table, so no
+    request waits on the database to be authenticated.
+    '''
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._verified: OrderedDict[str, tuple[dict[str, Any], float]] = OrderedDict()
+        self._revoked: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.revocations_loaded_at: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def _decode(self, token: str) -> Optional[tuple[dict[str, Any], float]]:
+        try:
+            claims = jwt.decode(token, SECRET_KEY, algorithms = ["HS256"])
+            return claims, token_expiry(claims)
+        except Exception as exception:
+            logger.error("Error: TokenVerifier could not decode a token")
+            logger.error(exception)
+            return None
+
+    def verify(self, token: str) -> Optional[dict[str, Any]]:
+        '''Claims of a valid token, None if it is malformed, expired or revoked'''
+
+        now = time.time()
+        with self._lock:
+            entry = self._verified.get(token)
+            if entry is not None:
+                self._verified.move_to_end(token)
+                self.hits += 1
+
+        if entry is None:
+            entry = self._decode(token)
+            if entry is None:
+                with self._lock:
+                    self.rejected += 1
+                return None
+
+            with self._lock:
+                self.misses += 1
+                self._verified[token] = entry
+                while len(self._verified) > self.max_size:
+                    self._verified.popitem(last = False)
+
+        claims, expires_at = entry
+        if now >= expires_at or token_id(token, claims) in self._revoked:
+            with self._lock:
+                self._verified.pop(token, None)
+                self.rejected += 1
+            return None
+
+        return claims
+
+    def revoke(self, token: str, claims: dict[str, Any]) -> None:
+        '''Deny a token in this process and record it for the other workers'''
+
+        jti, expires_at = token_id(token, claims), token_expiry(claims)
+
+        with get_connection() as conn:
+            if conn is None:
+                raise DatabaseUnavailable()
+
+            with conn.cursor() as cursor:
+                logger.info(f"SQL - revoke() - Revoking a token of user {claims['user_id']}")
+                cursor.execute(
+                    "INSERT IGNORE INTO revoked_tokens (jti, user_id, expires_at) VALUES (%s, %s, %s)",
+                    (jti, claims['user_id'], datetime.datetime.fromtimestamp(expires_at, datetime.timezone.utc).replace(tzinfo = None))
+                )
+                conn.commit()
+
+        with self._lock:
+            self._revoked[jti] = expires_at
+            self._verified.pop(token, None)
+
+    def refresh_revocations(self) -> bool:
+        '''Merge the revoked tokens of every worker into the deny-list and drop the expired ones.
+
+        The deny-list is only ever added to and pruned by expiry, never
+        replaced, so a jti revoked in this process while the SELECT runs
+        is not lost. Tokens are never un-revoked, so nothing else is removed.
+        '''
+
+        try:
+            with get_connection() as conn:
+                if conn is None:
+                    raise DatabaseUnavailable()
+
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT jti, expires_at FROM revoked_tokens WHERE expires_at > UTC_TIMESTAMP()")
+                    rows = cursor.fetchall()
+
+        except Exception as exception:
+            logger.error("Error: TokenVerifier could not load the revoked tokens")
+            logger.error(exception)
+            return False
+
+        revoked = {
+            jti: expires_at.replace(tzinfo = datetime.timezone.utc).timestamp()
+            for jti, expires_at in rows
+        }
+        now = time.time()
+        with self._lock:
+            self._revoked.update(revoked)
+            for jti in [jti for jti, expires_at in self._revoked.items() if expires_at <= now]:
+                del self._revoked[jti]
+        self.revocations_loaded_at = now
+        return True
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'cached_tokens'         : len(self._verified),
+            'revoked_tokens'        : len(self._revoked),
+            'revocations_loaded_at' : self.revocations_loaded_at,
+            'hits'                  : self.hits,
+            'misses'                : self.misses,
+            'rejected'              : self.rejected
+        }
+
+
+token_verifier = TokenVerifier(AUTH_CACHE_SIZE)
+
+
+def token_claims(token: str) -> Optional[dict[str, Any]]:
+    '''Claims of a verified token, served from the in-memory cache'''
+
+    return token_verifier.verify(token)
+
+
+async def refresh_revocations_periodically() -> None:
+    '''Background task reloading the deny-list every REVOCATION_REFRESH_SECONDS'''
+
+    while True:
+        await asyncio.sleep(REVOCATION_REFRESH_SECONDS)
+        await run_in_threadpool(token_verifier.refresh_revocations)
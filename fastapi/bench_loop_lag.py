@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+# Event-loop lag under DB-heavy traffic on the async routes.
+# Needs the MySQL database from .env (the GAIA and analytics tables):
+#
+#   python bench_loop_lag.py --requests 500 --concurrency 50
+#   python bench_loop_lag.py --requests 500 --concurrency 50 --blocking
+#
+# The app runs in this process behind httpx's ASGI transport, and a probe
+# coroutine measures how late its 10 ms sleeps wake up while the requests
+# run. --blocking also runs one query per request with the blocking
+# mysql.connector driver on the event loop, as the async routes used to,
+# so the two runs can be compared.
+
+parser = argparse.ArgumentParser(description = "Measure event-loop lag under concurrent DB-backed requests")
+parser.add_argument('--requests', type = int, default = 500, help = "number of requests")
+parser.add_argument('--concurrency', type = int, default = 50, help = "requests in flight at once")
+parser.add_argument('--path', default = "/analytics", help = "authenticated GET route to call")
+parser.add_argument('--probe-ms', type = float, default = 10, help = "probe sleep interval in milliseconds")
+parser.add_argument('--blocking', action = "store_true", help = "also run a blocking query on the event loop per request")
+
+# Query run on the event loop by --blocking, shaped like the old prompt lookup
+BLOCKING_QUERY = "SELECT task_id, question, level, final_answer, file_name FROM gaia_features LIMIT 100"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summary(name: str, values: list[float]) -> str:
+    if not values:
+        return f"{name:<18} no samples"
+    return (
+        f"{name:<18} p50 {statistics.median(values) * 1000:8.2f} ms   "
+        f"p99 {percentile(values, 0.99) * 1000:8.2f} ms   "
+        f"max {max(values) * 1000:8.2f} ms"
+    )
+
+
+async def probe(interval: float, lags: list[float], stop: asyncio.Event) -> None:
+    '''Sleep interval seconds in a loop and record how late each wake-up is'''
+
+    while not stop.is_set():
+        started_at = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - started_at - interval))
+
+
+def blocking_query() -> None:
+    from database import get_connection
+
+    with get_connection() as conn:
+        if conn is not None:
+            cursor = conn.cursor()
+            cursor.execute(BLOCKING_QUERY)
+            cursor.fetchall()
+            cursor.close()
+
+
+async def run(args: argparse.Namespace) -> int:
+    import httpx
+    import main
+    from helpers import create_jwt_token
+
+    if args.blocking:
+        @main.app.middleware("http")
+        async def blocking_database_call(request, call_next):
+            blocking_query()
+            return await call_next(request)
+
+    token = create_jwt_token({'user_id': 0, 'email': "bench@localhost"})['token']
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app = main.app)
+        async with httpx.AsyncClient(transport = transport, base_url = "http://bench", timeout = None) as client:
+
+            async def one_call() -> None:
+                async with semaphore:
+                    started_at = time.perf_counter()
+                    response = await client.get(args.path, headers = {'Authorization': f"Bearer {token}"})
+                    latencies.append(time.perf_counter() - started_at)
+
+                    # The routes report errors like a missing database in the JSON body
+                    code = response.status_code
+                    if response.headers.get('content-type', "").startswith("application/json"):
+                        body = response.json()
+                        if isinstance(body, dict) and isinstance(body.get('status'), int):
+                            code = body['status']
+                    statuses[code] = statuses.get(code, 0) + 1
+
+            lags: list[float] = []
+            stop = asyncio.Event()
+            prober = asyncio.create_task(probe(args.probe_ms / 1000, lags, stop))
+
+            started_at = time.perf_counter()
+            await asyncio.gather(*[one_call() for _ in range(args.requests)])
+            elapsed = time.perf_counter() - started_at
+
+            stop.set()
+            await prober
+
+    mode = "with a blocking query on the loop" if args.blocking else "async driver only"
+    print(f"{args.requests} GET {args.path}, {args.concurrency} at once, {mode}")
+    print(f"{'throughput':<18} {args.requests / elapsed:8.1f} req/s   status codes {statuses}")
+    print(summary("request latency", latencies))
+    print(summary("event-loop lag", lags))
+    return 0 if set(statuses) == {200} else 1
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('OPENAI_API', "bench")
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from dotenv import load_dotenv
+from typing import Optional, Any
+from collections import OrderedDict
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+
+# Helper function to build a stable cache key
+def fingerprint(*parts: Any) -> str:
+    '''Hash any JSON serializable values into a stable cache key'''
+
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Digests of files already hashed: path -> (mtime_ns, size, sha256)
+_digest_memo: OrderedDict[str, tuple[int, int, str]] = OrderedDict()
+_digest_lock = threading.Lock()
+DIGEST_MEMO_SIZE = 4096
+
+
+def file_digest(path: str) -> str:
+    '''sha256 of a file, only re-hashed when its mtime or size changes'''
+
+    stat = os.stat(path)
+    with _digest_lock:
+        entry = _digest_memo.get(path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            _digest_memo.move_to_end(path)
+            return entry[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    value = digest.hexdigest()
+
+    with _digest_lock:
+        _digest_memo[path] = (stat.st_mtime_ns, stat.st_size, value)
+        _digest_memo.move_to_end(path)
+        while len(_digest_memo) > DIGEST_MEMO_SIZE:
+            _digest_memo.popitem(last=False)
+    return value
+
+
+class TieredCache:
+    '''Two tier cache: an in-memory LRU in front of an SQLite file on disk.
+
+    Values are bytes. Entries older than ttl seconds are dropped (0 disables
+    expiry), and each tier evicts least recently used entries once it grows
+    past its byte budget.
+    '''
+
+    def __init__(
+            self,
+            name: str,
+            directory: str,
+            ttl: float = 0,
+            memory_max_bytes: int = 64 * 1024 * 1024,
+            disk_max_bytes: int = 1024 * 1024 * 1024
+    ) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+
+        # Memory tier: key -> (value, created_at)
+        self._memory: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Disk tier
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.sqlite3")
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries(
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries(accessed_at)")
+        self._db.commit()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def _remember(self, key: str, value: bytes, created_at: float) -> None:
+        '''Put an entry in the memory tier (caller holds the lock)'''
+
+        if len(value) > self.memory_max_bytes:
+            return
+
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous[0])
+
+        self._memory[key] = (value, created_at)
+        self._memory_bytes += len(value)
+
+        while self._memory_bytes > self.memory_max_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def get(self, key: str) -> Optional[bytes]:
+        '''Look up a key in memory, then on disk'''
+
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+
+                del self._memory[key]
+                self._memory_bytes -= len(value)
+
+            row = self._db.execute(
+                "SELECT value, created_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, created_at = row
+            if self._expired(created_at, now):
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.commit()
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, value, created_at)
+            self.disk_hits += 1
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        '''Store a value in both tiers'''
+
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now, now)
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+            except sqlite3.Error as error:
+                logger.error(f"CACHE - {self.name} - Failed to write to disk : {error}")
+
+    def delete(self, key: str) -> None:
+        '''Drop a key from both tiers'''
+
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry is not None:
+                self._memory_bytes -= len(entry[0])
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _evict_disk(self, now: float) -> None:
+        '''Drop expired entries, then the least recently used ones until under budget (caller holds the lock)'''
+
+        if self.ttl > 0:
+            self._db.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl,))
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return
+
+        rows = self._db.execute("SELECT key, size FROM entries ORDER BY accessed_at ASC").fetchall()
+        for key, size in rows:
+            if total <= self.disk_max_bytes:
+                break
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def get_json(self, key: str) -> Optional[Any]:
+        value = self.get(key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, key: str, value: Any) -> None:
+        self.set(key, json.dumps(value).encode('utf-8'))
+
+    def stats(self) -> dict[str, Any]:
+        '''Snapshot of the cache counters'''
+
+        with self._lock:
+            disk_entries, disk_bytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+
+            return {
+                'memory_entries'    : len(self._memory),
+                'memory_bytes'      : self._memory_bytes,
+                'disk_entries'      : disk_entries,
+                'disk_bytes'        : disk_bytes,
+                'memory_hits'       : self.memory_hits,
+                'disk_hits'         : self.disk_hits,
+                'misses'            : self.misses,
+                'evictions'         : self.evictions
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+# Directory holding the on-disk tier of every cache
+CACHE_DIR = os.getenv('CACHE_DIR', ".cache")
+
+# Opt-in cache of GPT completions keyed by the prompt fingerprint
+completion_cache: Optional[TieredCache] = None
+
+if os.getenv('GPT_CACHE_ENABLED', "false").lower() == "true":
+    completion_cache = TieredCache(
+        name                = "completions",
+        directory           = CACHE_DIR,
+        ttl                 = float(os.getenv('GPT_CACHE_TTL', 7 * 24 * 3600)),
+        memory_max_bytes    = int(os.getenv('GPT_CACHE_MEMORY_MB', 32)) * 1024 * 1024,
+        disk_max_bytes      = int(os.getenv('GPT_CACHE_DISK_MB', 512)) * 1024 * 1024
+    )
+
+
+def completion_key(messages: list[dict[str, Any]], model: str, temperature: float, seed: Optional[int]) -> str:
+    '''Cache key for a ChatCompletion request'''
+
+    return fingerprint(messages, model, temperature, seed)
+
+
+# Text extracted from txt/py/docx/xlsx/csv/jsonld attachments, keyed by file content
+parse_cache: Optional[TieredCache] = None
+
+if os.getenv('PARSE_CACHE_ENABLED', "true").lower() == "true":
+    parse_cache = TieredCache(
+        name                = "parsed_attachments",
+        directory           = CACHE_DIR,
+        memory_max_bytes    = int(os.getenv('PARSE_CACHE_MEMORY_MB', 64)) * 1024 * 1024,
+        disk_max_bytes      = int(os.getenv('PARSE_CACHE_DISK_MB', 1024)) * 1024 * 1024
+    )
+
+
+# Whisper transcriptions keyed by the audio content and the model name
+transcription_cache: Optional[TieredCache] = None
+
+if os.getenv('TRANSCRIPTION_CACHE_ENABLED', "true").lower() == "true":
+    transcription_cache = TieredCache(
+        name                = "transcriptions",
+        directory           = CACHE_DIR,
+        memory_max_bytes    = int(os.getenv('TRANSCRIPTION_CACHE_MEMORY_MB', 8)) * 1024 * 1024,
+        disk_max_bytes      = int(os.getenv('TRANSCRIPTION_CACHE_DISK_MB', 256)) * 1024 * 1024
+    )
@@ -0,0 +1,207 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from dotenv import load_dotenv
+from typing import Optional, Any, NamedTuple
+from starlette.concurrency import run_in_threadpool
+
+# Custom libraries
+from repository import GaiaTask, get_task, fetch_task, load_all_tasks
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# Seconds between two background refreshes of the catalog
+CATALOG_REFRESH_SECONDS = float(os.getenv('CATALOG_REFRESH_SECONDS', 900))
+
+# Shortest time between two reloads asked for through /catalog/refresh
+CATALOG_MIN_REFRESH_SECONDS = float(os.getenv('CATALOG_MIN_REFRESH_SECONDS', 60))
+
+
+def file_extension(file_name: Optional[str]) -> str:
+    '''Lowercase extension of an attachment, empty when the task has none'''
+
+    if not file_name:
+        return ""
+    return os.path.splitext(file_name)[1].lower()
+
+
+class CatalogSnapshot(NamedTuple):
+    '''One loaded copy of the catalog, never modified once built'''
+
+    tasks: dict[str, GaiaTask]
+    by_dataset: dict[str, list[str]]
+    by_level: dict[int, list[str]]
+    by_extension: dict[str, list[str]]
+    loaded_at: Optional[float]
+
+
+EMPTY_SNAPSHOT = CatalogSnapshot({}, {}, {}, {}, None)
+
+
+class PromptCatalog:
+    '''Read-only copy of gaia_features and gaia_annotations held in memory.
+
+    Tasks are keyed by task_id and indexed by dataset_type, level and the
+    extension of their attachment. A refresh builds a new snapshot holding
+    the tasks and every index, and swaps it in with a single assignment.
+    Readers take the snapshot reference once, so they never mix the
+    indexes of one load with the tasks of another. The previous snapshot
+    keeps being served if the database cannot be reached.
+    '''
+
+    def __init__(self) -> None:
+        self._snapshot = EMPTY_SNAPSHOT
+        self._refresh_lock = threading.Lock()
+        self._refresh_started_at: Optional[float] = None
+        self._refresh_ok = False
+        self.refreshes = 0
+        self.failed_refreshes = 0
+
+    @property
+    def loaded_at(self) -> Optional[float]:
+        return self._snapshot.loaded_at
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def load(self, tasks: list[GaiaTask]) -> None:
+        '''Replace the catalog contents'''
+
+        by_task: dict[str, GaiaTask] = {}
+        by_dataset: dict[str, list[str]] = {}
+        by_level: dict[int, list[str]] = {}
+        by_extension: dict[str, list[str]] = {}
+
+        for task in tasks:
+            by_task[task.task_id] = task
+            by_dataset.setdefault(task.dataset_type, []).append(task.task_id)
+            by_level.setdefault(task.level, []).append(task.task_id)
+            by_extension.setdefault(file_extension(task.file_name), []).append(task.task_id)
+
+        self._snapshot = CatalogSnapshot(by_task, by_dataset, by_level, by_extension, time.time())
+
+    def refresh(self, min_interval: float = 0) -> bool:
+        '''Reload the catalog from the database, keeping the old copy on failure.
+
+        A refresh starting less than min_interval seconds after the previous
+        one is skipped and reports how that one went, so a burst of callers
+        reloads the catalog at most once per interval.
+        '''
+
+        with self._refresh_lock:
+            if self._refresh_started_at is not None and time.monotonic() - self._refresh_started_at < min_interval:
+                return self._refresh_ok
+
+            self._refresh_started_at = time.monotonic()
+            try:
+                tasks = load_all_tasks()
+            except Exception as exception:
+                self.failed_refreshes += 1
+                self._refresh_ok = False
+                logger.error("Error: PromptCatalog.refresh() could not load the tasks")
+                logger.error(exception)
+                return False
+
+            self.load(tasks)
+            self.refreshes += 1
+            self._refresh_ok = True
+            logger.info(f"INTERNAL - Prompt catalog loaded with {len(tasks)} tasks")
+            return True
+
+    def get(self, task_id: str) -> Optional[GaiaTask]:
+        return self._snapshot.tasks.get(task_id)
+
+    def query(
+            self,
+            dataset_type: Optional[str] = None,
+            level: Optional[int] = None,
+            extension: Optional[str] = None,
+            limit: Optional[int] = None
+    ) -> list[GaiaTask]:
+        '''Tasks matching every given filter, in load order'''
+
+        snapshot = self._snapshot
+        tasks = snapshot.tasks
+        candidates = None
+
+        for index, value in (
+            (snapshot.by_dataset, dataset_type),
+            (snapshot.by_level, level),
+            (snapshot.by_extension, None if extension is None else extension.lower())
+        ):
+            if value is None:
+                continue
+            ids = index.get(value, [])
+            if candidates is None:
+                candidates = ids
+            else:
+                allowed = set(ids)
+                candidates = [task_id for task_id in candidates if task_id in allowed]
+
+        if candidates is None:
+            candidates = list(tasks)
+
+        matches = [tasks[task_id] for task_id in candidates]
+        return matches if limit is None else matches[:limit]
+
+    def stats(self) -> dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            'tasks'             : len(snapshot.tasks),
+            'loaded_at'         : snapshot.loaded_at,
+            'refreshes'         : self.refreshes,
+            'failed_refreshes'  : self.failed_refreshes
+        }
+
+
+prompt_catalog = PromptCatalog()
+
+
+def lookup_task(task_id: str) -> Optional[GaiaTask]:
+    '''Look a task up in the catalog, falling back to the database'''
+
+    task = prompt_catalog.get(task_id)
+    if task is None:
+        task = get_task(task_id)
+    return task
+
+
+async def async_lookup_task(task_id: str) -> Optional[GaiaTask]:
+    '''Async variant of lookup_task()'''
+
+    task = prompt_catalog.get(task_id)
+    if task is None:
+        task = await fetch_task(task_id)
+    return task
+
+
+async def refresh_catalog_periodically() -> None:
+    '''Background task refreshing the catalog every CATALOG_REFRESH_SECONDS'''
+
+    while True:
+        await asyncio.sleep(CATALOG_REFRESH_SECONDS)
+        await run_in_threadpool(prompt_catalog.refresh)
@@ -0,0 +1,265 @@
+import os
+import json
+import logging
+from aiomysql import DictCursor
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from typing import Optional, Any
+from starlette.concurrency import run_in_threadpool
+
+# Custom libraries
+from database import get_connection, async_connection
+from helpers import count_tokens, count_tokens_batch, get_encoding
+from repository import DatabaseUnavailable
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# Context window of models missing from MODEL_CONTEXT_TOKENS, tokens kept
+# free for the answer, and the most tokens of PDF text sent with one question
+GPT_CONTEXT_TOKENS = int(os.getenv('GPT_CONTEXT_TOKENS', 128000))
+GPT_RESPONSE_TOKENS = int(os.getenv('GPT_RESPONSE_TOKENS', 4096))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 16000))
+
+
+def parse_model_windows(value: str) -> dict[str, int]:
+    '''"gpt-4=8192,gpt-4o=128000" -> {'gpt-4': 8192, 'gpt-4o': 128000}'''
+
+    windows = {}
+    for entry in value.split(','):
+        if entry.strip():
+            model, tokens = entry.split('=')
+            windows[model.strip()] = int(tokens)
+    return windows
+
+
+# Context window per model, matched on the longest prefix of the model name
+# (gpt-4o-2024-08-06 uses gpt-4o), extended or overridden by MODEL_CONTEXT_TOKENS
+MODEL_CONTEXT_TOKENS = {
+    'gpt-4o'        : 128000,
+    'gpt-4-turbo'   : 128000,
+    'gpt-4'         : 8192,
+    'gpt-3.5-turbo' : 16385,
+    **parse_model_windows(os.getenv('MODEL_CONTEXT_TOKENS', ""))
+}
+
+# Separator placed between two pages
+PAGE_SEPARATOR = "\n\n"
+
+# Text of every page of a PDF, in page order, for each extraction service.
+# The matching on task_id is the same as the one used by the services.
+PAGE_QUERIES = {
+    "pymupdf": """
+        SELECT page_info.page_id, page_info.text
+        FROM pymupdf_info AS pdf_info
+        JOIN pymupdf_page_info AS page_info ON page_info.pdf_id = pdf_info.pdf_id
+        WHERE pdf_info.file_name = %s
+        ORDER BY page_info.page_id
+    """,
+    "adobe": """
+        SELECT page_id, text
+        FROM adobe_info
+        WHERE pdf_filename LIKE CONCAT('%%', %s, '%%')
+        ORDER BY page_id
+    """,
+    "azure": """
+        SELECT page_id, text
+        FROM azure_info
+        WHERE pdf_filename = %s
+        ORDER BY page_id
+    """
+}
+
+CONTEXT_QUERY = """
+SELECT task_id, service, content, content_tokens, pages, total_tokens
+FROM extraction_context
+WHERE task_id = %s AND service = %s
+"""
+
+SAVE_CONTEXT_QUERY = """
+INSERT INTO extraction_context (task_id, service, content, content_tokens, pages, total_tokens)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    content = VALUES(content),
+    content_tokens = VALUES(content_tokens),
+    pages = VALUES(pages),
+    total_tokens = VALUES(total_tokens)
+"""
+
+
+class ExtractionContext(BaseModel):
+    '''PDF text of a task for one extraction service, whole and per page with token counts'''
+
+    task_id: str
+    service: str
+    content: str
+    content_tokens: int
+    pages: list[dict[str, Any]]
+    total_tokens: int
+
+    @classmethod
+    def from_record(cls, record: dict[str, Any]) -> "ExtractionContext":
+        pages = record['pages']
+        if isinstance(pages, (str, bytes)):
+            pages = json.loads(pages)
+        return cls(**{**record, 'pages': pages})
+
+
+def build_context(task_id: str, service: str) -> Optional[ExtractionContext]:
+    '''Assemble the context from the extraction tables, None if the PDF was not processed'''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor(dictionary = True) as cursor:
+            logger.info(f"SQL - build_context() - Fetching pages of {task_id} for service {service}")
+            cursor.execute(PAGE_QUERIES[service], (task_id,))
+            records = cursor.fetchall()
+            logger.info("SQL - build_context() - SELECT statement complete")
+
+    if not records:
+        return None
+
+    texts = [record['text'] or "" for record in records]
+    tokens = count_tokens_batch(texts)
+    pages = [
+        {'page': record['page_id'], 'text': text, 'tokens': page_tokens}
+        for record, text, page_tokens in zip(records, texts, tokens)
+    ]
+
+    content = PAGE_SEPARATOR.join(texts)
+    return ExtractionContext(
+        task_id         = task_id,
+        service         = service,
+        content         = content,
+        content_tokens  = count_tokens(content),
+        pages           = pages,
+        total_tokens    = sum(tokens)
+    )
+
+
+def save_context(context: ExtractionContext) -> None:
+    '''Store (or replace) a context'''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor() as cursor:
+            logger.info("SQL - save_context() - Running an INSERT statement")
+            cursor.execute(SAVE_CONTEXT_QUERY, (
+                context.task_id,
+                context.service,
+                context.content,
+                context.content_tokens,
+                json.dumps(context.pages),
+                context.total_tokens
+            ))
+            conn.commit()
+            logger.info("SQL - save_context() - INSERT statement complete")
+
+
+def build_and_save_context(task_id: str, service: str) -> Optional[ExtractionContext]:
+    '''Build a context on first use and store it for the next requests'''
+
+    context = build_context(task_id, service)
+    if context is not None:
+        try:
+            save_context(context)
+        except Exception as exception:
+            logger.error(f"Error: save_context() could not store the context of {task_id}")
+            logger.error(exception)
+    return context
+
+
+async def load_context(task_id: str, service: str) -> Optional[ExtractionContext]:
+    '''Read the context of a task with a single primary key lookup, building it on first use'''
+
+    async with async_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        async with conn.cursor(DictCursor) as cursor:
+            logger.info("SQL - load_context() - Running a SELECT statement")
+            await cursor.execute(CONTEXT_QUERY, (task_id, service))
+            record = await cursor.fetchone()
+            logger.info("SQL - load_context() - SELECT statement complete")
+
+    if record is not None:
+        return ExtractionContext.from_record(record)
+
+    logger.info(f"INTERNAL - No stored context for {task_id} ({service}), building it")
+    return await run_in_threadpool(build_and_save_context, task_id, service)
+
+
+def context_window(model: str) -> int:
+    '''Context window of a model, GPT_CONTEXT_TOKENS for unknown models'''
+
+    prefixes = [prefix for prefix in MODEL_CONTEXT_TOKENS if model.startswith(prefix)]
+    if not prefixes:
+        return GPT_CONTEXT_TOKENS
+    return MODEL_CONTEXT_TOKENS[max(prefixes, key = len)]
+
+
+def context_budget(prompt_tokens: int, model: str) -> int:
+    '''Tokens available for PDF text once the prompt and the answer are accounted for'''
+
+    return max(0, min(CONTEXT_TOKEN_BUDGET, context_window(model) - GPT_RESPONSE_TOKENS - prompt_tokens))
+
+
+def pack_context(context: ExtractionContext, budget: int) -> tuple[str, list[int], int]:
+    '''Fill the budget with whole pages in page order.
+
+    Returns the text, the page numbers included and its token count. When
+    the first page alone is over budget it is cut to fit. Nothing is
+    packed when the budget is 0 or the document has no text.
+    '''
+
+    if budget <= 0 or not context.content.strip():
+        return "", [], 0
+
+    # Fast path, the whole document fits
+    if context.content_tokens <= budget:
+        return context.content, [page['page'] for page in context.pages], context.content_tokens
+
+    separator_tokens = count_tokens(PAGE_SEPARATOR)
+    texts: list[str] = []
+    included: list[int] = []
+    used = 0
+
+    for page in context.pages:
+        cost = page['tokens'] + (separator_tokens if texts else 0)
+        if used + cost > budget:
+            break
+        texts.append(page['text'])
+        included.append(page['page'])
+        used += cost
+
+    if not texts and context.pages and budget > 0:
+        first = context.pages[0]
+        encoding = get_encoding()
+        text = encoding.decode(encoding.encode_ordinary(first['text'])[:budget])
+        return text, [first['page']], count_tokens(text)
+
+    return PAGE_SEPARATOR.join(texts), included, used
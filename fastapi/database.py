@@ -0,0 +1,455 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import aiomysql
+import threading
+import mysql.connector
+from dotenv import load_dotenv
+from typing import Optional, Any
+from contextlib import contextmanager, asynccontextmanager
+from mysql.connector import Error
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+
+# Helper function to build the MySQL connection config
+def connection_config() -> dict[str, Any]:
+    '''Build the MySQL connection config from the environment'''
+
+    return {
+        'user'              : os.getenv('DB_USER'),
+        'password'          : os.getenv('DB_PASSWORD'),
+        'host'              : os.getenv('DB_HOST'),
+        'database'          : os.getenv('DB_NAME'),
+        'raise_on_warnings' : True
+    }
+
+
+# Helper function to open a new (unpooled) connection with the MySQL database
+def open_connection(attempts = 3, delay = 2):
+    '''Open a brand new connection with the MySQL database'''
+
+    # Attempt a reconnection routine
+    attempt = 1
+
+    while attempt <= attempts:
+        try:
+            conn = mysql.connector.connect(**connection_config())
+            logger.info("Database - Connection to the database was opened")
+            return conn
+
+        except (Error, IOError) as error:
+            if attempt == attempts:
+                # Ran out of attempts
+                logger.error(f"Database - Failed to connect to database : {error}")
+                return None
+            else:
+                logger.warning(f"Database - Connection failed: {error} - Retrying {attempt}/{attempts} ...")
+
+                # Delay the next attempt
+                time.sleep(delay ** attempt)
+                attempt += 1
+
+    return None
+
+
+class PooledConnection:
+    '''A connection borrowed from the pool. close() hands it back instead of closing it'''
+
+    def __init__(self, pool: "ConnectionPool", conn, created_at: float) -> None:
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+        self._checked_out_at = time.monotonic()
+        self._released = False
+
+    def __getattr__(self, name: str) -> Any:
+        # Everything else (cursor, commit, rollback, ...) goes to the real connection
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._conn, name)
+
+    def is_connected(self) -> bool:
+        '''The pool pings stale connections on checkout, so avoid a second round trip here'''
+        return not self._released
+
+    def close(self) -> None:
+        '''Return the connection to the pool (safe to call more than once)'''
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn, self._created_at, self._checked_out_at)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        # Connection was dropped without being released, recover it and count the leak
+        if not getattr(self, "_released", True):
+            self._pool.record_leak()
+            self.close()
+
+
+# Put on the idle queue when a connection is discarded, so a waiter wakes up and opens a new one
+FREED_SLOT = object()
+
+
+class ConnectionPool:
+    '''Process-wide pool of MySQL connections shared by every request'''
+
+    def __init__(
+            self,
+            size: int = 10,
+            timeout: float = 10,
+            recycle: float = 3600,
+            ping_interval: float = 30,
+            leak_seconds: float = 120
+    ) -> None:
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self.leak_seconds = leak_seconds
+
+        # Idle connections as (connection, created_at, last_used_at), most recently used first
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._freed_slots = 0
+
+        # Counters exposed through stats()
+        self._checkouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._checkout_latency_total = 0.0
+        self._checkout_latency_max = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+        self._leaked = 0
+        self._long_held = 0
+
+    def _discard(self, conn, wake_waiter: bool = False) -> None:
+        '''Close a broken or expired connection and free its slot.
+
+        A connection discarded on release would otherwise have gone back to
+        the idle queue, so wake_waiter puts FREED_SLOT there instead. A
+        request blocked waiting for a connection then opens a new one
+        rather than sleeping until its timeout.
+        '''
+
+        with self._lock:
+            self._created -= 1
+            self._discarded += 1
+            if wake_waiter:
+                self._freed_slots += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+        if wake_waiter:
+            self._idle.put(FREED_SLOT)
+
+    def _take_freed_slot(self) -> None:
+        with self._lock:
+            self._freed_slots -= 1
+
+    def _is_healthy(self, conn, created_at: float, last_used_at: float) -> bool:
+        '''Check an idle connection before handing it out'''
+
+        now = time.monotonic()
+        if now - created_at > self.recycle:
+            return False
+
+        # Only ping connections that have been sitting idle for a while
+        if now - last_used_at > self.ping_interval:
+            try:
+                conn.ping(reconnect = False)
+            except Exception:
+                return False
+        return True
+
+    def acquire(self) -> Optional[PooledConnection]:
+        '''Borrow a connection from the pool, or None if the database is unreachable'''
+
+        start = time.monotonic()
+        wait_time = 0.0
+
+        while True:
+            entry = None
+            should_create = False
+
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._created < self.size:
+                        self._created += 1
+                        should_create = True
+
+            if entry is FREED_SLOT:
+                self._take_freed_slot()
+                continue
+
+            if should_create:
+                conn = open_connection()
+                if conn is None:
+                    with self._lock:
+                        self._created -= 1
+                    return None
+                entry = (conn, time.monotonic(), time.monotonic())
+
+            elif entry is None:
+                # Pool is exhausted, wait for a connection to be released
+                wait_start = time.monotonic()
+                try:
+                    entry = self._idle.get(timeout = self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    logger.error(f"Database - Timed out after {self.timeout}s waiting for a pooled connection")
+                    return None
+                finally:
+                    wait_time += time.monotonic() - wait_start
+
+                # A connection was discarded, loop around to open one in its place
+                if entry is FREED_SLOT:
+                    self._take_freed_slot()
+                    continue
+
+            conn, created_at, last_used_at = entry
+            if should_create or self._is_healthy(conn, created_at, last_used_at):
+                break
+
+            logger.warning("Database - Discarding a stale pooled connection")
+            self._discard(conn)
+
+        latency = time.monotonic() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_time_total += wait_time
+            self._wait_time_max = max(self._wait_time_max, wait_time)
+            self._checkout_latency_total += latency
+            self._checkout_latency_max = max(self._checkout_latency_max, latency)
+
+        return PooledConnection(self, conn, created_at)
+
+    def release(self, conn, created_at: float, checked_out_at: float) -> None:
+        '''Put a connection back into the pool'''
+
+        held_for = time.monotonic() - checked_out_at
+        with self._lock:
+            self._in_use -= 1
+            if held_for > self.leak_seconds:
+                self._long_held += 1
+
+        if held_for > self.leak_seconds:
+            logger.warning(f"Database - Pooled connection was held for {held_for:.1f}s")
+
+        try:
+            # Never hand out a connection with an open transaction
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            self._discard(conn, wake_waiter = True)
+            return
+
+        self._idle.put((conn, created_at, time.monotonic()))
+
+    def record_leak(self) -> None:
+        '''Count a connection that was garbage collected without being released'''
+
+        with self._lock:
+            self._leaked += 1
+        logger.warning("Database - A pooled connection was never released")
+
+    def close(self) -> None:
+        '''Close every idle connection'''
+
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if entry is FREED_SLOT:
+                self._take_freed_slot()
+                continue
+            conn, _, _ = entry
+            self._discard(conn)
+        logger.info("Database - Connection pool was closed")
+
+    def stats(self) -> dict[str, Any]:
+        '''Snapshot of the pool counters'''
+
+        with self._lock:
+            checkouts = self._checkouts or 1
+            return {
+                'size'                      : self.size,
+                'open'                      : self._created,
+                'in_use'                    : self._in_use,
+                'idle'                      : max(0, self._idle.qsize() - self._freed_slots),
+                'checkouts'                 : self._checkouts,
+                'wait_time_avg_ms'          : round(self._wait_time_total / checkouts * 1000, 3),
+                'wait_time_max_ms'          : round(self._wait_time_max * 1000, 3),
+                'checkout_latency_avg_ms'   : round(self._checkout_latency_total / checkouts * 1000, 3),
+                'checkout_latency_max_ms'   : round(self._checkout_latency_max * 1000, 3),
+                'timeouts'                  : self._timeouts,
+                'discarded'                 : self._discarded,
+                'leaked'                    : self._leaked,
+                'held_too_long'             : self._long_held
+            }
+
+
+# Process-wide pool, created on first use
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    '''Return the process-wide connection pool'''
+
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    size            = int(os.getenv('DB_POOL_SIZE', 10)),
+                    timeout         = float(os.getenv('DB_POOL_TIMEOUT', 10)),
+                    recycle         = float(os.getenv('DB_POOL_RECYCLE', 3600)),
+                    ping_interval   = float(os.getenv('DB_POOL_PING_INTERVAL', 30)),
+                    leak_seconds    = float(os.getenv('DB_POOL_LEAK_SECONDS', 120))
+                )
+    return _pool
+
+
+# Helper function connect to the MySQL database
+def create_connection() -> Optional[PooledConnection]:
+    '''Borrow a connection to the MySQL database from the shared pool'''
+
+    return get_pool().acquire()
+
+
+@contextmanager
+def get_connection():
+    '''Borrow a pooled connection and always give it back'''
+
+    conn = create_connection()
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def pool_stats() -> dict[str, Any]:
+    '''Connection pool counters'''
+
+    return get_pool().stats()
+
+
+def close_pool() -> None:
+    '''Close the shared pool on shutdown'''
+
+    if _pool is not None:
+        _pool.close()
+
+
+# ========================== Async database : Begin ==========================
+
+# Process-wide aiomysql pool for the async routes, created on first use
+_async_pool: Optional[aiomysql.Pool] = None
+_async_pool_lock = asyncio.Lock()
+
+
+async def get_async_pool() -> aiomysql.Pool:
+    '''Return the process-wide asyncio connection pool'''
+
+    global _async_pool
+    if _async_pool is None:
+        async with _async_pool_lock:
+            if _async_pool is None:
+                _async_pool = await aiomysql.create_pool(
+                    user            = os.getenv('DB_USER'),
+                    password        = os.getenv('DB_PASSWORD'),
+                    host            = os.getenv('DB_HOST'),
+                    db              = os.getenv('DB_NAME'),
+                    minsize         = int(os.getenv('DB_ASYNC_POOL_MIN_SIZE', 1)),
+                    maxsize         = int(os.getenv('DB_ASYNC_POOL_SIZE', 10)),
+                    pool_recycle    = int(os.getenv('DB_POOL_RECYCLE', 3600)),
+                    connect_timeout = int(os.getenv('DB_POOL_TIMEOUT', 10)),
+                    autocommit      = True
+                )
+                logger.info("Database - Async connection pool was opened")
+    return _async_pool
+
+
+@asynccontextmanager
+async def async_connection():
+    '''Borrow a connection from the asyncio pool, yields None if the database is unreachable'''
+
+    pool = None
+    conn = None
+    try:
+        pool = await get_async_pool()
+        conn = await asyncio.wait_for(pool.acquire(), timeout = float(os.getenv('DB_POOL_TIMEOUT', 10)))
+    except Exception as error:
+        logger.error(f"Database - Failed to acquire an async connection : {error}")
+
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            await pool.release(conn)
+
+
+def async_pool_stats() -> dict[str, Any]:
+    '''Asyncio pool counters'''
+
+    if _async_pool is None:
+        return {'size': 0, 'free': 0}
+
+    return {
+        'size'      : _async_pool.size,
+        'free'      : _async_pool.freesize,
+        'max_size'  : _async_pool.maxsize
+    }
+
+
+async def close_async_pool() -> None:
+    '''Close the asyncio pool on shutdown'''
+
+    global _async_pool
+    if _async_pool is not None:
+        _async_pool.close()
+        await _async_pool.wait_closed()
+        _async_pool = None
+        logger.info("Database - Async connection pool was closed")
+
+# =========================== Async database : End ===========================
@@ -0,0 +1,431 @@
+import os
+import time
+import logging
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from typing import Optional, Any, AsyncIterator
+from starlette.concurrency import run_in_threadpool
+
+# Custom libraries
+from helpers import                 \
+count_tokens,                       \
+count_message_tokens,               \
+generate_restriction,               \
+rectification_helper,               \
+extract_file_content
+
+from gpt_client import              \
+chat_completion,                    \
+chat_completion_stream,             \
+transcribe
+
+from metrics import span
+from executor import run_cpu
+from ratelimit import rate_limiter
+from repository import GaiaTask
+from attachments import attachment_cache
+from images import prepare_image, image_metadata
+from context_store import load_context, context_budget, pack_context
+
+from cache import                   \
+completion_cache,                   \
+completion_key,                     \
+transcription_cache,                \
+fingerprint,                        \
+file_digest
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# Model answering the questions and its sampling settings
+GPT_MODEL = os.getenv('GPT_MODEL', "gpt-4o")
+GPT_TEMPERATURE = 1
+
+# Optional seed for GPT requests, also part of the completion cache key
+GPT_SEED = int(os.getenv('GPT_SEED')) if os.getenv('GPT_SEED') else None
+
+# Model used to transcribe .mp3 attachments, also part of the transcription cache key
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', "whisper-1")
+
+# Price of one prompt token in USD
+COST_PER_TOKEN = 0.000005
+
+SYSTEM_PROMPT = "You are a helpful assistant that obeys the instructions given and provides the correct answers for any questions provided."
+
+
+class PreparedPrompt(BaseModel):
+    '''Everything needed to send a GAIA task to GPT and report on the answer'''
+
+    task: GaiaTask
+    service: str
+    model: str = GPT_MODEL
+    updated_steps: Optional[str] = None
+    full_question: str
+    messages: list[dict[str, Any]]
+    file_content: Optional[str] = None
+    file_truncated: bool = False
+    pages_included: Optional[list[int]] = None
+    image: Optional[dict[str, Any]] = None
+    file_tokens: int = 0
+    token_count: int = 0
+    cost: float = 0.0
+
+    @property
+    def extraction_service(self) -> Optional[str]:
+        '''The service is only recorded for PDF attachments'''
+
+        file_name = self.task.file_name
+        return self.service if file_name is not None and file_name.endswith('.pdf') else None
+
+    def completion_params(self) -> dict[str, Any]:
+        '''GPT request parameters, the seed is only sent when configured'''
+
+        params = {
+            "model"         : self.model,
+            "temperature"   : GPT_TEMPERATURE,
+            "messages"      : self.messages
+        }
+        if GPT_SEED is not None:
+            params["seed"] = GPT_SEED
+        return params
+
+    def cache_key(self) -> str:
+        return completion_key(self.messages, self.model, GPT_TEMPERATURE, GPT_SEED)
+
+
+def is_correct(gpt_response: Optional[str], final_answer: Optional[str]) -> bool:
+    '''Same comparison as the "Compare Responses" button of the validation page'''
+
+    if gpt_response is None or final_answer is None:
+        return False
+    return gpt_response.strip() == final_answer.strip()
+
+
+async def transcribe_audio(file_name: str, file_path: str) -> Optional[str]:
+    '''Whisper transcription of an .mp3 attachment, reused for the same audio and model'''
+
+    transcription_key = None
+    if transcription_cache is not None:
+        audio_digest = await run_in_threadpool(file_digest, file_path)
+        transcription_key = fingerprint(audio_digest, WHISPER_MODEL)
+        cached = await run_in_threadpool(transcription_cache.get, transcription_key)
+        if cached is not None:
+            logger.info("WHISPER - Transcription served from the cache")
+            return cached.decode('utf-8')
+
+    with open(file_path, "rb") as audio_file:
+        audio_bytes = audio_file.read()
+
+    logger.info("WHISPER - Sending a audio transcription request")
+    transcription = await transcribe(
+        model = WHISPER_MODEL,
+        file = (file_name, audio_bytes),
+        response_format = "text"
+    )
+
+    if transcription_key is not None and transcription is not None:
+        await run_in_threadpool(transcription_cache.set, transcription_key, transcription.encode('utf-8'))
+    return transcription
+
+
+async def fetch_attachment(file_name: str) -> bool:
+    '''Download an attachment into the local cache unless it is already there'''
+
+    with span("gcs_fetch"):
+        return await run_in_threadpool(attachment_cache.fetch, file_name)
+
+
+async def build_prompt(
+        task: GaiaTask,
+        service: str,
+        updated_steps: Optional[str] = None,
+        model: str = GPT_MODEL
+) -> PreparedPrompt:
+    '''Build the GPT messages for a task, with its attachment, and count their tokens'''
+
+    restriction = generate_restriction(task.final_answer)
+
+    # If updated_steps is empty, then it's a fresh prompt
+    if (updated_steps is None) or (updated_steps == ''):
+        full_question = f"{task.question} {restriction}".strip()
+    else:
+
+        # Let GPT know the previous response was incorrect
+        rectification = rectification_helper()
+        full_question = f"{rectification} Question: {task.question} Steps: {updated_steps} {restriction}".strip()
+
+    prompt = PreparedPrompt(
+        task            = task,
+        service         = service,
+        model           = model,
+        updated_steps   = updated_steps,
+        full_question   = full_question,
+        messages        = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": full_question}
+        ]
+    )
+
+    file_name = task.file_name
+    file_token_count = None
+
+    # PDFs are served from the precomputed extraction context,
+    # other attachments are fetched into the local cache
+    if file_name is not None and file_name.lower().endswith('.pdf'):
+        with span("context"):
+            context = await load_context(task.task_id, service)
+
+        if context is not None:
+
+            # Fill what is left of the context window with whole pages
+            with span("tokenize"):
+                budget = context_budget(await run_cpu("tokenize", count_message_tokens, prompt.messages), model)
+                prompt.file_content, prompt.pages_included, file_token_count = await run_cpu(
+                    "pack", pack_context, context, budget
+                )
+            prompt.file_truncated = len(prompt.pages_included) < len(context.pages)
+
+            # Leave the file out when none of it fits
+            if prompt.file_content:
+                prompt.messages.append({
+                    "role": "user",
+                    "content": f"Here's the content of the file related to the question: \n\n {prompt.file_content}"
+                })
+            else:
+                prompt.file_content = None
+
+    elif file_name is not None and await fetch_attachment(file_name):
+
+        file_path = attachment_cache.local_path(file_name)
+
+        if file_name.lower().endswith(('.png', '.jpg')):
+
+            # Downscale, recompress and encode the image (cached by content)
+            with span("image"):
+                image = await run_cpu("image", prepare_image, file_path)
+
+            if image is not None:
+                prompt.image = image_metadata(image)
+                file_token_count = image['tokens']
+
+                prompt.messages.append({
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "Here's the image related to the question:"},
+                        {"type": "image_url", "image_url": {"url": f"data:{image['mime']};base64,{image['data']}"}}
+                    ]
+                })
+
+        elif file_name.lower().endswith(('.mp3')):
+
+            try:
+                with span("transcribe"):
+                    prompt.file_content = await transcribe_audio(file_name, file_path)
+
+                if prompt.file_content is not None:
+                    prompt.messages.append({
+                        "role": "user",
+                        "content": f"Here's the transcription of the audio file related to the question: \n {prompt.file_content}"
+                    })
+
+            except Exception as exception:
+                logger.error("Error: WHISPER - build_prompt() encountered an error")
+                logger.error(exception)
+
+        elif file_name.lower().endswith(('.txt', '.xlsx', '.csv', '.jsonld', '.docx', '.py')):
+
+            # Parse the files
+            with span("parse"):
+                prompt.file_content, prompt.file_truncated = await run_cpu("parse", extract_file_content, file_path)
+
+            if prompt.file_content is not None:
+                prompt.messages.append({
+                    "role": "user",
+                    "content": f"Here's the content of the file related to the question: \n\n {prompt.file_content}"
+                })
+
+    # Calculate the tokens and cost
+    with span("tokenize"):
+        if file_token_count is None:
+            file_token_count = 0
+            if prompt.file_content is not None:
+                file_token_count = await run_cpu("tokenize", count_tokens, prompt.file_content)
+        prompt.file_tokens = file_token_count
+        prompt.token_count = await run_cpu("tokenize", count_message_tokens, prompt.messages)
+
+    # Images are billed by their size, not by their encoded bytes
+    if prompt.image is not None:
+        prompt.token_count += file_token_count
+
+    prompt.cost = float('{:.4f}'.format(prompt.token_count * COST_PER_TOKEN))
+    return prompt
+
+
+async def cached_completion(prompt: PreparedPrompt) -> Optional[str]:
+    '''Answer from the completion cache, if enabled'''
+
+    if completion_cache is None:
+        return None
+
+    cached = await run_in_threadpool(completion_cache.get_json, prompt.cache_key())
+    if cached is None:
+        return None
+
+    logger.info("GPT - ChatCompletion served from the cache")
+    return cached['gpt_response']
+
+
+async def remember_completion(prompt: PreparedPrompt, gpt_response: str) -> None:
+    if completion_cache is not None:
+        await run_in_threadpool(completion_cache.set_json, prompt.cache_key(), {'gpt_response': gpt_response})
+
+
+async def complete(prompt: PreparedPrompt) -> tuple[str, bool]:
+    '''GPT's answer to a prompt, and whether it came from the cache'''
+
+    gpt_response = await cached_completion(prompt)
+    if gpt_response is not None:
+        return gpt_response, True
+
+    logger.info("GPT - Sending a ChatCompletion request")
+    with span("gpt"):
+        response = await chat_completion(**prompt.completion_params())
+    logger.info("GPT - ChatCompletion request complete")
+
+    gpt_response = response.choices[0].message.content
+    await remember_completion(prompt, gpt_response)
+    return gpt_response, False
+
+
+async def stream_completion(prompt: PreparedPrompt, result: dict[str, Any]) -> AsyncIterator[str]:
+    '''Yield GPT's answer as it arrives.
+
+    Once the stream is exhausted, result holds the full gpt_response and
+    the from_cache flag.
+    '''
+
+    gpt_response = await cached_completion(prompt)
+    if gpt_response is not None:
+        result.update(gpt_response = gpt_response, from_cache = True)
+        yield gpt_response
+        return
+
+    logger.info("GPT - Sending a streaming ChatCompletion request")
+    parts: list[str] = []
+    with span("gpt_stream"):
+        async for text in chat_completion_stream(**prompt.completion_params()):
+            parts.append(text)
+            yield text
+    logger.info("GPT - Streaming ChatCompletion request complete")
+
+    gpt_response = "".join(parts)
+    result.update(gpt_response = gpt_response, from_cache = False)
+    await remember_completion(prompt, gpt_response)
+
+
+def analytics_row(
+        prompt: PreparedPrompt,
+        user_id: int,
+        gpt_response: str,
+        time_consumed: float,
+        from_cache: bool
+) -> dict[str, Any]:
+    '''Row saved to the analytics table for one answer'''
+
+    row = {
+        "user_id"                   : user_id,
+        "task_id"                   : prompt.task.task_id,
+        "gpt_response"              : gpt_response,
+        "tokens_per_text_prompt"    : prompt.token_count,
+        "tokens_per_attachment"     : prompt.file_tokens,
+        'total_cost'                : prompt.cost,
+        'time_consumed'             : time_consumed,
+        'extraction_service'        : prompt.extraction_service,
+        'from_cache'                : from_cache
+    }
+
+    if (prompt.updated_steps is not None) or (prompt.updated_steps != ''):
+        row["updated_steps"] = prompt.updated_steps
+
+    return row
+
+
+def result_payload(prompt: PreparedPrompt, gpt_response: Optional[str], from_cache: bool) -> dict[str, Any]:
+    '''Answer, evaluation and prompt details returned to the client'''
+
+    task = prompt.task
+    payload = {
+        "task_id"               : task.task_id,
+        "question"              : prompt.full_question,
+        "level"                 : task.level,
+        "final_answer"          : task.final_answer,
+        "file_name"             : task.file_name,
+        "file_content"          : prompt.file_content,
+        "file_truncated"        : prompt.file_truncated,
+        "pages_included"        : prompt.pages_included,
+        "image"                 : prompt.image,
+        "token_count"           : prompt.token_count,
+        "file_tokens"           : prompt.file_tokens,
+        "total_cost"            : prompt.cost,
+        "gpt_response"          : gpt_response,
+        "correct"               : is_correct(gpt_response, task.final_answer),
+        'extraction_service'    : prompt.extraction_service,
+        'from_cache'            : from_cache
+    }
+
+    # Append the annotation (loaded along with the prompt)
+    if task.annotation_steps is not None:
+        payload["annotation_steps"] = task.annotation_steps
+
+    return payload
+
+
+async def evaluate(
+        task: GaiaTask,
+        service: str,
+        user_id: int,
+        updated_steps: Optional[str] = None,
+        model: str = GPT_MODEL
+) -> tuple[dict[str, Any], dict[str, Any]]:
+    '''Build the prompt, ask GPT and return the analytics row and the result payload.
+
+    The prompt is charged to the user's token bucket first, RateLimited
+    is raised when it is empty.
+    '''
+
+    prompt = await build_prompt(task, service, updated_steps, model)
+    rate_limiter.charge(user_id, prompt.token_count)
+    return await answer(prompt, user_id)
+
+
+async def answer(prompt: PreparedPrompt, user_id: int) -> tuple[dict[str, Any], dict[str, Any]]:
+    '''Ask GPT a prepared prompt and return the analytics row and the result payload'''
+
+    start_time = time.time()
+    gpt_response, from_cache = await complete(prompt)
+    time_consumed = float('{:.3f}'.format(time.time() - start_time))
+
+    return (
+        analytics_row(prompt, user_id, gpt_response, time_consumed, from_cache),
+        result_payload(prompt, gpt_response, from_cache)
+    )
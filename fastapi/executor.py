@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from dotenv import load_dotenv
+from typing import Any, Callable, Optional
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+# Custom libraries
+from metrics import cpu_queue_depth, cpu_in_flight, cpu_queue_seconds
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# "thread" shares the in-process caches, "process" sidesteps the GIL for
+# pure-Python work (spreadsheets, docx) at the cost of pickling arguments
+CPU_EXECUTOR = os.getenv('CPU_EXECUTOR', "thread").lower()
+
+# CPU-bound jobs running at the same time, the others wait in the queue
+CPU_WORKERS = int(os.getenv('CPU_WORKERS', min(4, os.cpu_count() or 1)))
+
+
+class CPUExecutor:
+    '''Runs CPU-bound work off the event loop on a fixed number of workers.
+
+    Jobs beyond the worker count wait on a semaphore rather than in the
+    executor's unbounded work queue, so the wait is measured per stage
+    and one large spreadsheet or image only delays other CPU work, never
+    the event loop.
+    '''
+
+    def __init__(self, kind: str, workers: int) -> None:
+        if kind not in ("thread", "process"):
+            raise ValueError(f"CPU_EXECUTOR must be 'thread' or 'process', got {kind!r}")
+
+        self.kind = kind
+        self.workers = workers
+        self._executor: Optional[Executor] = None
+        self._semaphore = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+
+                # Spawned, not forked, so children never inherit the caches' SQLite handles
+                self._executor = ProcessPoolExecutor(self.workers, mp_context = multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix = "cpu")
+            logger.info(f"INTERNAL - CPU executor started with {self.workers} {self.kind} worker(s)")
+        return self._executor
+
+    async def run(self, stage: str, func: Callable[..., Any], *args: Any) -> Any:
+        '''Wait for a free worker, then run func(*args) on it'''
+
+        self.waiting += 1
+        cpu_queue_depth.inc()
+        queued_at = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            cpu_queue_depth.dec()
+
+        cpu_queue_seconds.observe(time.perf_counter() - queued_at, stage = stage)
+        self.in_flight += 1
+        cpu_in_flight.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            cpu_in_flight.dec()
+            self._semaphore.release()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait = False, cancel_futures = True)
+            self._executor = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'workers'       : self.workers,
+            'queue_depth'   : self.waiting,
+            'in_flight'     : self.in_flight,
+            'completed'     : self.completed
+        }
+
+
+cpu_executor = CPUExecutor(CPU_EXECUTOR, CPU_WORKERS)
+
+
+async def run_cpu(stage: str, func: Callable[..., Any], *args: Any) -> Any:
+    '''Run a CPU-bound function on the shared executor'''
+
+    return await cpu_executor.run(stage, func, *args)
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import asyncio
+from typing import Any, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+# Minimal stand-in for the OpenAI API, used to run the app and the tests
+# locally without spending tokens:
+#
+#   fastapi run fake_openai.py --port 9000
+#   OPENAI_BASE_URL = "http://localhost:9000/v1"
+#
+# POST /fake/failures {"statuses": [429, 503], "retry_after": null} makes the
+# next calls fail with those status codes, GET /fake/stats counts the calls
+# and the most calls in flight at once, POST /fake/reset clears both.
+
+# Answer returned to every question, and the simulated upstream latency
+FAKE_OPENAI_REPLY = os.getenv('FAKE_OPENAI_REPLY', "42")
+FAKE_OPENAI_LATENCY = float(os.getenv('FAKE_OPENAI_LATENCY', 0.5))
+
+app = FastAPI()
+
+# Status codes returned by the next calls, and what the server has seen
+failures = {'statuses': [], 'retry_after': None}
+stats = {'requests': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+
+def error_response(status_code: int) -> JSONResponse:
+    headers = {}
+    if failures['retry_after'] is not None:
+        headers['retry-after'] = str(failures['retry_after'])
+    return JSONResponse(
+        status_code = status_code,
+        headers     = headers,
+        content     = {'error': {'message': f"Fake error {status_code}", 'type': "fake_error", 'code': None}}
+    )
+
+
+async def simulate_call() -> Optional[JSONResponse]:
+    '''Wait the simulated latency, then the injected error if one is queued'''
+
+    stats['requests'] += 1
+    stats['in_flight'] += 1
+    stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+    try:
+        await asyncio.sleep(FAKE_OPENAI_LATENCY)
+    finally:
+        stats['in_flight'] -= 1
+
+    if failures['statuses']:
+        return error_response(failures['statuses'].pop(0))
+    return None
+
+
+def completion_chunk(model: str, delta: dict, finish_reason=None) -> str:
+    chunk = {
+        'id'        : "chatcmpl-fake",
+        'object'    : "chat.completion.chunk",
+        'created'   : int(time.time()),
+        'model'     : model,
+        'choices'   : [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get('model', "gpt-4o")
+
+    error = await simulate_call()
+    if error is not None:
+        return error
+
+    if body.get('stream'):
+        async def events():
+            words = FAKE_OPENAI_REPLY.split(' ')
+            for index, word in enumerate(words):
+                yield completion_chunk(model, {'content': word if index == len(words) - 1 else word + ' '})
+                await asyncio.sleep(0.05)
+            yield completion_chunk(model, {}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return JSONResponse({
+        'id'        : "chatcmpl-fake",
+        'object'    : "chat.completion",
+        'created'   : int(time.time()),
+        'model'     : model,
+        'choices'   : [{
+            'index'         : 0,
+            'message'       : {'role': "assistant", 'content': FAKE_OPENAI_REPLY},
+            'finish_reason' : "stop"
+        }],
+        'usage'     : {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+    })
+
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions():
+    error = await simulate_call()
+    if error is not None:
+        return error
+    return PlainTextResponse("This is a fake transcription.")
+
+
+@app.post("/fake/failures")
+async def inject_failures(request: Request):
+    body = await request.json()
+    failures['statuses'] = list(body.get('statuses', []))
+    failures['retry_after'] = body.get('retry_after')
+    return failures
+
+
+@app.get("/fake/stats")
+async def fake_stats() -> dict[str, Any]:
+    return stats
+
+
+@app.post("/fake/reset")
+async def reset():
+    failures.update(statuses = [], retry_after = None)
+    stats.update(requests = 0, in_flight = 0, max_in_flight = 0)
+    return stats
@@ -0,0 +1,252 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import openai
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+from contextlib import asynccontextmanager
+
+# Custom libraries
+from metrics import upstream_errors, upstream_retries
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+
+# Async OpenAI client, retries are handled by call_upstream() below.
+# OPENAI_BASE_URL can point the client at a local fake server for testing.
+openai_client = AsyncOpenAI(
+    api_key         = os.getenv("OPENAI_API"),
+    project         = os.getenv("PROJECT_ID"),
+    organization    = os.getenv("ORGANIZATION_ID"),
+    base_url        = os.getenv("OPENAI_BASE_URL") or None,
+    max_retries     = 0
+)
+
+# Upstream call settings
+MAX_CONCURRENCY     = int(os.getenv('OPENAI_MAX_CONCURRENCY', 8))
+CALL_TIMEOUT        = float(os.getenv('OPENAI_TIMEOUT', 120))
+MAX_RETRIES         = int(os.getenv('OPENAI_MAX_RETRIES', 3))
+BACKOFF_BASE        = float(os.getenv('OPENAI_BACKOFF_BASE', 1))
+BACKOFF_MAX         = float(os.getenv('OPENAI_BACKOFF_MAX', 30))
+
+
+class UpstreamLimiter:
+    '''Caps in-flight OpenAI calls and keeps queue depth and latency counters'''
+
+    def __init__(self, max_concurrency: int) -> None:
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.errors: dict[str, int] = {}
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        '''Hold one of the concurrency slots for the duration of the block'''
+
+        self.waiting += 1
+        queued_at = time.monotonic()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        queue_time = time.monotonic() - queued_at
+        self.queue_time_total += queue_time
+        self.queue_time_max = max(self.queue_time_max, queue_time)
+
+        self.in_flight += 1
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            latency = time.monotonic() - started_at
+            self.in_flight -= 1
+            self.calls += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self._semaphore.release()
+
+    async def run(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        '''Wait for a free slot, then run the call'''
+
+        async with self.slot():
+            return await call()
+
+    def record_error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        upstream_errors.inc(kind = kind)
+
+    def stats(self) -> dict[str, Any]:
+        '''Snapshot of the upstream counters'''
+
+        calls = self.calls or 1
+        return {
+            'max_concurrency'   : self.max_concurrency,
+            'queue_depth'       : self.waiting,
+            'in_flight'         : self.in_flight,
+            'calls'             : self.calls,
+            'retries'           : self.retries,
+            'errors'            : dict(self.errors),
+            'queue_time_avg_ms' : round(self.queue_time_total / calls * 1000, 3),
+            'queue_time_max_ms' : round(self.queue_time_max * 1000, 3),
+            'latency_avg_ms'    : round(self.latency_total / calls * 1000, 3),
+            'latency_max_ms'    : round(self.latency_max * 1000, 3)
+        }
+
+
+limiter = UpstreamLimiter(MAX_CONCURRENCY)
+
+
+def is_retryable(exception: Exception) -> bool:
+    '''Retry on rate limits, server errors, timeouts and dropped connections'''
+
+    if isinstance(exception, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(exception, openai.APIStatusError):
+        return exception.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt: int, exception: Exception) -> float:
+    '''Full-jitter exponential backoff, honouring Retry-After when the server sends one'''
+
+    response = getattr(exception, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (attempt - 1))))
+
+
+def retry_delay(name: str, attempt: int, exception: Exception) -> Optional[float]:
+    '''Record a failed attempt, returns the backoff before the next one or None to give up'''
+
+    kind = type(exception).__name__
+    limiter.record_error(kind)
+
+    if attempt > MAX_RETRIES or not is_retryable(exception):
+        logger.error(f"OPENAI - {name} failed after {attempt} attempt(s) : {exception}")
+        return None
+
+    delay = backoff_delay(attempt, exception)
+    logger.warning(f"OPENAI - {name} failed with {kind}, retrying in {delay:.2f}s ({attempt}/{MAX_RETRIES})")
+    limiter.retries += 1
+    upstream_retries.inc()
+    return delay
+
+
+async def with_retries(name: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    '''Run a call, retrying transient errors with backoff'''
+
+    attempt = 1
+    while True:
+        try:
+            return await call()
+
+        except Exception as exception:
+            delay = retry_delay(name, attempt, exception)
+            if delay is None:
+                raise
+
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+async def call_upstream(name: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    '''Run an OpenAI call under the concurrency cap with retries on transient errors'''
+
+    return await with_retries(name, lambda: limiter.run(call))
+
+
+async def chat_completion(**kwargs) -> Any:
+    '''Send a ChatCompletion request'''
+
+    kwargs.setdefault('timeout', CALL_TIMEOUT)
+    return await call_upstream(
+        "chat.completions.create",
+        lambda: openai_client.chat.completions.create(**kwargs)
+    )
+
+
+async def chat_completion_stream(**kwargs) -> AsyncIterator[str]:
+    '''Send a streaming ChatCompletion request and yield the text as it arrives.
+
+    The concurrency slot is held until the stream ends, but released while
+    waiting to retry. Retries only apply to opening the stream, never once
+    text has been yielded.
+    '''
+
+    kwargs.setdefault('timeout', CALL_TIMEOUT)
+    kwargs['stream'] = True
+
+    name = "chat.completions.create (stream)"
+    attempt = 1
+    while True:
+        async with limiter.slot():
+            try:
+                stream = await openai_client.chat.completions.create(**kwargs)
+
+            except Exception as exception:
+                delay = retry_delay(name, attempt, exception)
+                if delay is None:
+                    raise
+
+            else:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                return
+
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+async def transcribe(**kwargs) -> Any:
+    '''Send an audio transcription request'''
+
+    kwargs.setdefault('timeout', CALL_TIMEOUT)
+    return await call_upstream(
+        "audio.transcriptions.create",
+        lambda: openai_client.audio.transcriptions.create(**kwargs)
+    )
+
+
+def upstream_stats() -> dict[str, Any]:
+    '''OpenAI queue depth, latency and error counters'''
+
+    return limiter.stats()
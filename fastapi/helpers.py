@@ -3,22 +3,23 @@ import csv
 import jwt
 import docx
 import json
+import mmap
 import hmac
-import time
 import hashlib
 import logging
 import openpyxl
+import threading
 import tiktoken
 import datetime
-import mysql.connector
+import uuid
 from dotenv import load_dotenv
-from typing import Literal, Any
-from google.cloud import storage
-from mysql.connector import Error
+from typing import Literal, Any, Optional
+from collections import OrderedDict
 from passlib.context import CryptContext
 from datetime import timezone, timedelta
-from google.oauth2 import service_account
-from fastapi import status, HTTPException
+
+# Custom libraries
+from cache import parse_cache, fingerprint, file_digest
 
 # Load env variables
 load_dotenv()
@@ -54,42 +55,6 @@ password_context = CryptContext(
     deprecated                      = "auto"
 )
 
-# Helper function connect to the MySQL database
-def create_connection(attempts = 3, delay = 2):
-    '''Start a connection with the MySQL database'''
-
-    # Database connection config
-    config = {
-        'user'              : os.getenv('DB_USER'),
-        'password'          : os.getenv('DB_PASSWORD'),
-        'host'              : os.getenv('DB_HOST'),
-        'database'          : os.getenv('DB_NAME'),
-        'raise_on_warnings' : True
-    }
-
-    # Attempt a reconnection routine
-    attempt = 1
-    
-    while attempt <= attempts:
-        try:
-            conn = mysql.connector.connect(**config)
-            logger.info("Database - Connection to the database was opened")
-            return conn
-        
-        except (Error, IOError) as error:
-            if attempt == attempts:
-                # Ran out of attempts
-                logger.error(f"Database - Failed to connect to database : {error}")
-                return None
-            else:
-                logger.warning(f"Database - Connection failed: {error} - Retrying {attempt}/{attempts} ...")
-                
-                # Delay the next attempt
-                time.sleep(delay ** attempt)
-                attempt += 1
-    
-    return None
-
 # Helper function to hash passwords
 def get_password_hash(password: str) -> str:
     '''Helper function to return hashed passwords'''
@@ -121,9 +86,10 @@ def create_jwt_token(data: dict) -> dict[str, Any]:
     # Set token expiration time to 'x' minutes from the current time
     expiration = datetime.datetime.now(timezone.utc) + timedelta(minutes=60)
     
-    # Create the token payload with expiration and provided data
+    # Create the token payload with expiration, a unique id (used to revoke it) and provided data
     token_payload = {
         "expiration": str(expiration), 
+        "jti": uuid.uuid4().hex,
         **data
     }
     
@@ -138,56 +104,6 @@ def create_jwt_token(data: dict) -> dict[str, Any]:
     return token_dict
 
 
-# Function to decode the JWT token and verify its validity
-def decode_jwt_token(token: str):
-    '''Function to decode the JWT token and verify its validity'''
-
-    try:
-        # Decode the JWT token
-        decoded_token = jwt.decode(
-            token, 
-            SECRET_KEY, 
-            algorithms = ["HS256"]
-        )
-        
-        return decoded_token
-    
-    except Exception as exception:
-        logger.error("Error: decode_jwt_token() encountered an error")
-        logger.error(exception)
-        
-        raise HTTPException(
-            status_code = status.HTTP_401_UNAUTHORIZED,
-            detail      = "Token expired",
-            headers     = {"WWW-Authenticate": "Bearer"},
-        )
-    
-# Helper function to check if JWT token is expired
-def validate_token(token: str) -> bool:
-    '''Helper function to check if JWT token is expired'''
-
-    is_expired = True
-    try:
-
-        payload = jwt.decode(
-            token, 
-            SECRET_KEY, 
-            algorithms = ["HS256"]
-        )
-        
-        # Check if token has expired
-        current_time = str(datetime.datetime.now(timezone.utc))
-        if current_time < payload['expiration']:
-            is_expired = False
-        
-    except Exception as exception:
-        logger.error("Error: validate_token() encountered an error")
-        logger.error(exception)
-    
-    finally:
-        return is_expired
-
-
 # Helper function to verify passwords
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     '''Helper function to verify passwords'''
@@ -197,12 +113,97 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return rehashed_pass == hashed_password
 
 
+# Tokenizer for GPT-4o, loaded once (the lifespan warms it up at startup)
+encoding: Optional[tiktoken.Encoding] = None
+
+
+def get_encoding() -> tiktoken.Encoding:
+    '''Return the shared GPT-4o tokenizer'''
+
+    global encoding
+    if encoding is None:
+        encoding = tiktoken.encoding_for_model("gpt-4o")
+    return encoding
+
+# Token counts of large inputs (like PDF contexts) memoized by content hash
+TOKEN_MEMO_MIN_CHARS = int(os.getenv('TOKEN_MEMO_MIN_CHARS', 2048))
+TOKEN_MEMO_SIZE = int(os.getenv('TOKEN_MEMO_SIZE', 1024))
+token_memo: OrderedDict[str, int] = OrderedDict()
+token_memo_lock = threading.Lock()
+
+
+def _memo_key(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _memo_get(key: str) -> Optional[int]:
+    with token_memo_lock:
+        count = token_memo.get(key)
+        if count is not None:
+            token_memo.move_to_end(key)
+        return count
+
+
+def _memo_set(key: str, count: int) -> None:
+    with token_memo_lock:
+        token_memo[key] = count
+        token_memo.move_to_end(key)
+        while len(token_memo) > TOKEN_MEMO_SIZE:
+            token_memo.popitem(last=False)
+
+
 # Helper function to count tokens
 def count_tokens(text: str) -> int:
     '''Helper function to count tokens for the GPT-4o model'''
 
-    encoding = tiktoken.encoding_for_model("gpt-4o")
-    return len(encoding.encode(text))
+    if len(text) < TOKEN_MEMO_MIN_CHARS:
+        return len(get_encoding().encode_ordinary(text))
+
+    key = _memo_key(text)
+    count = _memo_get(key)
+    if count is None:
+        count = len(get_encoding().encode_ordinary(text))
+        _memo_set(key, count)
+    return count
+
+
+# Helper function to count tokens for many texts at once
+def count_tokens_batch(texts: list[str]) -> list[int]:
+    '''Count tokens for a list of texts, encoding all memo misses in one batch'''
+
+    counts: list[Optional[int]] = [None] * len(texts)
+    pending: list[int] = []
+    keys: dict[int, str] = {}
+
+    for index, text in enumerate(texts):
+        if len(text) >= TOKEN_MEMO_MIN_CHARS:
+            keys[index] = _memo_key(text)
+            counts[index] = _memo_get(keys[index])
+        if counts[index] is None:
+            pending.append(index)
+
+    if pending:
+        encoded = get_encoding().encode_ordinary_batch([texts[index] for index in pending])
+        for index, tokens in zip(pending, encoded):
+            counts[index] = len(tokens)
+            if index in keys:
+                _memo_set(keys[index], len(tokens))
+
+    return counts
+
+
+# Helper function to count tokens in a list of chat messages
+def count_message_tokens(messages: list[dict[str, Any]]) -> int:
+    '''Count the tokens of every text part of a list of chat messages in one pass'''
+
+    texts = []
+    for message in messages:
+        if isinstance(message['content'], str):
+            texts.append(message['content'])
+        else:
+            texts.extend(part['text'] for part in message['content'] if part.get('type') == "text")
+
+    return sum(count_tokens_batch(texts))
 
 
 # Helper function to provide rectification strings
@@ -236,13 +237,96 @@ def json_serial(obj):
     return str(obj)
 
 
+# Bump when the output of parse_file_content() changes, so cached text is rebuilt
+EXTRACTOR_VERSION = 3
+
+# Budget for the text extracted from an attachment (0 disables the token budget)
+ATTACHMENT_MAX_BYTES = int(os.getenv('ATTACHMENT_MAX_BYTES', 256 * 1024))
+ATTACHMENT_MAX_TOKENS = int(os.getenv('ATTACHMENT_MAX_TOKENS', 0))
+
+
 # Helper function to extract contents from a file
-def extract_file_content(
-        file_path: str, 
-        extraction_service = None, 
-        task_id = None
-) -> str:
-    """Extract content from various file types."""
+def extract_file_content(file_path: str) -> tuple[Optional[str], bool]:
+    """Extract content from a file, reusing the text parsed for identical files.
+
+    Returns the text and whether it was truncated to the attachment budget.
+    """
+
+    if parse_cache is None:
+        return parse_file_content(file_path)
+
+    try:
+        cache_key = fingerprint(
+            file_digest(file_path),
+            os.path.splitext(file_path)[1].lower(),
+            EXTRACTOR_VERSION,
+            ATTACHMENT_MAX_BYTES,
+            ATTACHMENT_MAX_TOKENS
+        )
+    except OSError as exception:
+        logger.error(f"Error hashing {file_path}: {str(exception)}")
+        return None, False
+
+    cached = parse_cache.get_json(cache_key)
+    if cached is not None:
+        logger.info("INTERNAL - File content served from the parse cache")
+        return cached['content'], cached['truncated']
+
+    content, truncated = parse_file_content(file_path)
+    if content is not None:
+        parse_cache.set_json(cache_key, {'content': content, 'truncated': truncated})
+    return content, truncated
+
+
+# Helper function to join rows into a JSON list of lists within a byte budget
+def _json_rows(rows, max_bytes: int) -> tuple[str, bool]:
+    '''Serialize rows one at a time, stopping before the budget is exceeded'''
+
+    parts = []
+    size = 2
+    for row in rows:
+        row_json = json.dumps([json_serial(value) for value in row])
+        size += len(row_json.encode('utf-8')) + (2 if parts else 0)
+        if size > max_bytes:
+            return "[" + ", ".join(parts) + "]", True
+        parts.append(row_json)
+    return "[" + ", ".join(parts) + "]", False
+
+
+# Helper function to read the start of a text file within a byte budget
+def _read_text(file_path: str, max_bytes: int) -> tuple[str, bool]:
+    '''Memory-map a text file and decode at most max_bytes of it'''
+
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return "", False
+
+        with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+            data = mapped[:max_bytes]
+
+    text = data.decode('utf-8', errors = 'ignore').replace('\r\n', '\n')
+    return text, size > max_bytes
+
+
+# Helper function to cap a text to the token budget
+def _limit_tokens(text: str, max_tokens: int) -> tuple[str, bool]:
+    if max_tokens <= 0 or len(text) <= max_tokens:
+        return text, False
+
+    tokens = get_encoding().encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text, False
+    return get_encoding().decode(tokens[:max_tokens]), True
+
+
+# Helper function to parse contents from a file
+def parse_file_content(file_path: str) -> tuple[Optional[str], bool]:
+    """Parse content from various file types (PDFs are served by context_store).
+
+    Files are read incrementally and parsing stops once ATTACHMENT_MAX_BYTES
+    of text has been produced, so memory stays bounded for large attachments.
+    """
     
     _, file_extension = os.path.splitext(file_path)
     file_extension = file_extension.lower()
@@ -253,221 +337,57 @@ def extract_file_content(
 
         if file_extension in ['.txt', '.py', '.pdb']:
             logger.info("INTERNAL - Processing .txt or similar file")
-            with open(file_path, 'r') as file:
-                return file.read()
-
-        elif file_extension == '.pdf':
-            logger.info("INTERNAL - Processing .pdf file")
-            page_limit = 10
-
-            ############# PyMuPDF extraction service #############
-            
-            if extraction_service == "pymupdf":
-
-                logger.info(f"INTERNAL - extract_file_content() - Fetching page content for {task_id} for service {extraction_service}")
-
-                conn = create_connection()
-                if conn and conn.is_connected():
-                    with conn.cursor(dictionary=True) as cursor:
-
-                        # Fetch page_id and text for the PDF
-                        logger.info(f"INTERNAL - extract_file_content() - Running a SELECT statement")
-                        
-                        page_content_query = """
-                        SELECT page_info.page_id, page_info.text
-                        FROM pymupdf_info AS pdf_info, pymupdf_page_info AS page_info
-                        WHERE pdf_info.pdf_id = page_info.pdf_id AND pdf_info.file_name = %s LIMIT %s;
-                        """
-                        cursor.execute(page_content_query, (task_id, page_limit,))
-                        records = cursor.fetchall()
-
-                        logger.info(f"INTERNAL - extract_file_content() - SELECT statement completed")
-
-                        # Iterate over the response, and produce a text block 
-                        if records is not None:
-                            page_content = ""
-                            page = 0
-                            
-                            for list_item in records:
-                                for _, val in list_item.items():
-                                    page_content = page_content + str(val)
-                                
-                                page += 1
-
-                                # Max number of pages to consider
-                                if page == 10:
-                                    break
-                            
-                            logger.info(f"INTERNAL - extract_file_content() - Fetched page content for {task_id} for service {extraction_service}")
-                            return page_content
-                        
-            ############# Adobe extraction service #############
-
-            elif extraction_service == 'adobe':
-
-                logger.info(f"INTERNAL - extract_file_content() - Fetching page content for {task_id} for service {extraction_service}")
-
-                conn = create_connection()
-                if conn and conn.is_connected():
-                    with conn.cursor(dictionary=True) as cursor:
-
-                        # Fetch page_id and text for the PDF
-                        logger.info(f"INTERNAL - extract_file_content() - Running a SELECT statement")
-                        
-                        page_content_query = f"""
-                        SELECT * 
-                        FROM `adobe_info`
-                        WHERE `pdf_filename` LIKE '%{task_id}%' LIMIT {page_limit};
-                        """
-                        cursor.execute(page_content_query)
-                        records = cursor.fetchall()
-
-                        logger.info(f"INTERNAL - extract_file_content() - SELECT statement completed")
-
-                        # Iterate over the response, and produce a text block 
-                        if records is not None:
-                            page_content = ""
-                            page = 0
-                            
-                            for list_item in records:
-                                for _, val in list_item.items():
-                                    page_content = page_content + str(val)
-                                
-                                page += 1
-
-                                # Max number of pages to consider
-                                if page == 10:
-                                    break
-                            
-                            logger.info(f"INTERNAL - extract_file_content() - Fetched page content for {task_id} for service {extraction_service}")
-                            return page_content
-                        
-            ############# Azure extraction service #############
-
-            else:
-
-                logger.info(f"INTERNAL - extract_file_content() - Fetching page content for {task_id} for service {extraction_service}")
-
-                conn = create_connection()
-                if conn and conn.is_connected():
-                    with conn.cursor(dictionary=True) as cursor:
-
-                        # Fetch page_id and text for the PDF
-                        logger.info(f"INTERNAL - extract_file_content() - Running a SELECT statement")
-                        
-                        page_content_query = """
-                        SELECT * 
-                        FROM `azure_info`
-                        WHERE `pdf_filename` = %s LIMIT %s;
-                        """
-                        cursor.execute(page_content_query, (task_id, page_limit,))
-                        records = cursor.fetchall()
-
-                        logger.info(f"INTERNAL - extract_file_content() - SELECT statement completed")
-
-                        # Iterate over the response, and produce a text block 
-                        if records is not None:
-                            page_content = ""
-                            page = 0
-                            
-                            for list_item in records:
-                                for _, val in list_item.items():
-                                    page_content = page_content + str(val)
-                                
-                                page += 1
-
-                                # Max number of pages to consider
-                                if page == 10:
-                                    break
-                            
-                            logger.info(f"INTERNAL - extract_file_content() - Fetched page content for {task_id} for service {extraction_service}")
-                            return page_content
-
+            content, truncated = _read_text(file_path, ATTACHMENT_MAX_BYTES)
 
         elif file_extension == '.docx':
             logger.info("INTERNAL - Processing .docx file")
             doc = docx.Document(file_path)
-            return ' '.join([paragraph.text for paragraph in doc.paragraphs])
-
-        elif file_extension in ['.xlsx', '.csv']:
-            if file_extension == '.xlsx':
-                logger.info("INTERNAL - Processing .xlsx file")
-                workbook = openpyxl.load_workbook(file_path)
-                sheet = workbook.active
-                data = [[json_serial(cell.value) for cell in row] for row in sheet.iter_rows()]
-            
-            # CSV files
-            else: 
-                logger.info("INTERNAL - Processing .csv file")
-                with open(file_path, 'r') as file:
-                    reader = csv.reader(file)
-                    data = [[json_serial(value) for value in row] for row in reader]
-            return json.dumps(data)
+
+            paragraphs = []
+            size = 0
+            truncated = False
+            for paragraph in doc.paragraphs:
+                size += len(paragraph.text.encode('utf-8')) + 1
+                if size > ATTACHMENT_MAX_BYTES:
+                    truncated = True
+                    break
+                paragraphs.append(paragraph.text)
+            content = ' '.join(paragraphs)
+
+        elif file_extension == '.xlsx':
+            logger.info("INTERNAL - Processing .xlsx file")
+            workbook = openpyxl.load_workbook(file_path, read_only = True)
+            try:
+                content, truncated = _json_rows(workbook.active.iter_rows(values_only = True), ATTACHMENT_MAX_BYTES)
+            finally:
+                workbook.close()
+
+        elif file_extension == '.csv':
+            logger.info("INTERNAL - Processing .csv file")
+            with open(file_path, 'r', newline = '') as file:
+                content, truncated = _json_rows(csv.reader(file), ATTACHMENT_MAX_BYTES)
 
         elif file_extension == '.jsonld':
             logger.info("INTERNAL - Processing .json file")
-            with open(file_path, 'r') as file:
-                return json.load(file)
-
-        else:
-            return None
-
-    except Exception as e:
-        logger.error(f"Error extracting content from {file_path}: {str(e)}")
-        return None
-    
-    logger.info("INTERNAL - File content extraction completed")
-
 
-# Helper function to download files from GCP bucket
-def download_files_from_gcs() -> bool:
-    '''Helper function to download files from GCP bucket'''
+            # Documents over the budget are sent as truncated raw text
+            if os.path.getsize(file_path) > ATTACHMENT_MAX_BYTES:
+                content, truncated = _read_text(file_path, ATTACHMENT_MAX_BYTES)
+            else:
+                with open(file_path, 'r') as file:
+                    content, truncated = json.dumps(json.load(file)), False
 
-    logger.info("INTERNAL - GCP file download request received")
+        else:
+            return None, False
 
-    # Environment variables
-    bucket_name = os.getenv("BUCKET_NAME")
-    gcp_folder_path = os.getenv("GCP_FILES_PATH")
-    creds_file_path = os.path.join(os.getcwd(), os.getenv("GCS_CREDENTIALS_FILE"))
+        content, over_tokens = _limit_tokens(content, ATTACHMENT_MAX_TOKENS)
+        truncated = truncated or over_tokens
 
-    download_status = False
-    
-    try:
+        if truncated:
+            logger.info(f"INTERNAL - {os.path.basename(file_path)} was truncated to the attachment budget")
+        logger.info("INTERNAL - File content extraction completed")
+        return content, truncated
 
-        # Authenticate using the service account file
-        creds = service_account.Credentials.from_service_account_file(creds_file_path)
-        client = storage.Client(credentials = creds)
-        bkt = client.bucket(bucket_name)
-
-        # List all blobs in the folder
-        blobs = bkt.list_blobs(prefix = gcp_folder_path)
-
-        # Iterate through the blobs and download each file
-        for blob in blobs:
-
-            # Extract the file name from the blob's full path
-            file_name = os.path.basename(blob.name)
-            
-            # Skip if it's just the folder itself and not a file
-            if not file_name: 
-                continue
-
-            # Create the download directory if missing
-            if not os.path.exists(os.getenv('DOWNLOAD_DIR')):
-                os.makedirs(os.getenv('DOWNLOAD_DIR'))
-            
-            # File to download and path to save
-            local_file_path = os.path.join(os.getenv('DOWNLOAD_DIR'), file_name)
-
-            # Download the file
-            blob.download_to_filename(local_file_path)
-            logger.info(f"INTERNAL - Downloaded {file_name} from GCP")
-        
-        download_status = True
-        logger.info("INTERNAL - GCP file download completed")
-    
-    except Exception as exception:
-        logger.error("Error: download_files_from_gcs() encountered an error")
-        logger.error(exception)
-    
-    return download_status
\ No newline at end of file
+    except Exception as e:
+        logger.error(f"Error extracting content from {file_path}: {str(e)}")
+        return None, False
@@ -0,0 +1,153 @@
+import io
+import os
+import math
+import base64
+import logging
+from PIL import Image, ImageOps, ExifTags, UnidentifiedImageError
+from dotenv import load_dotenv
+from typing import Any, Optional
+
+# Custom libraries
+from cache import TieredCache, CACHE_DIR, fingerprint, file_digest
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# GPT-4o (high detail) fits images in 2048x2048, then scales the short side down to 768
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 2048))
+IMAGE_MAX_SHORT_SIDE = int(os.getenv('IMAGE_MAX_SHORT_SIDE', 768))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+
+# Token cost of an image: a base cost plus a cost per 512px tile
+IMAGE_BASE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+IMAGE_TILE_SIZE = 512
+
+# Bump when prepare_image() output changes, so cached images are rebuilt
+IMAGE_PIPELINE_VERSION = 2
+
+# Processed images keyed by the source file content and the pipeline settings
+image_cache = TieredCache(
+    name                = "images",
+    directory           = CACHE_DIR,
+    memory_max_bytes    = int(os.getenv('IMAGE_CACHE_MEMORY_MB', 32)) * 1024 * 1024,
+    disk_max_bytes      = int(os.getenv('IMAGE_CACHE_DISK_MB', 512)) * 1024 * 1024
+)
+
+
+def target_size(width: int, height: int) -> tuple[int, int]:
+    '''Largest size the model actually uses for an image of this size'''
+
+    scale = min(1.0, IMAGE_MAX_SIDE / max(width, height))
+    short_side = min(width, height) * scale
+    if short_side > IMAGE_MAX_SHORT_SIDE:
+        scale *= IMAGE_MAX_SHORT_SIDE / short_side
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    '''Tokens billed for an image sent at this size'''
+
+    tiles = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * tiles
+
+
+def _process(file_path: str) -> dict[str, Any]:
+    '''Downscale and recompress an image, keeping the original when it is already smaller'''
+
+    with open(file_path, 'rb') as file:
+        original = file.read()
+
+    with Image.open(io.BytesIO(original)) as source:
+        source_mime = Image.MIME.get(source.format, "application/octet-stream")
+
+        # Photos are often stored sideways with an EXIF orientation, apply it before resizing
+        rotated = source.getexif().get(ExifTags.Base.Orientation, 1) != 1
+        image = ImageOps.exif_transpose(source)
+        width, height = image.size
+        new_width, new_height = target_size(width, height)
+
+        # Transparent and palette images stay PNG, everything else becomes JPEG
+        keep_png = image.mode in ("RGBA", "LA", "P") or "transparency" in image.info
+        resized = image if (new_width, new_height) == (width, height) else image.resize((new_width, new_height), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        if keep_png:
+            resized.save(buffer, format = "PNG", optimize = True)
+            mime = "image/png"
+        else:
+            resized.convert("RGB").save(buffer, format = "JPEG", quality = IMAGE_JPEG_QUALITY, optimize = True)
+            mime = "image/jpeg"
+
+    data = buffer.getvalue()
+    if len(data) >= len(original) and (new_width, new_height) == (width, height) and not rotated:
+        data, mime = original, source_mime
+
+    return {
+        'mime'              : mime,
+        'width'             : new_width,
+        'height'            : new_height,
+        'original_width'    : width,
+        'original_height'   : height,
+        'original_bytes'    : len(original),
+        'bytes'             : len(data),
+        'tokens'            : estimate_image_tokens(new_width, new_height),
+        'data'              : base64.b64encode(data).decode('ascii')
+    }
+
+
+def prepare_image(file_path: str) -> Optional[dict[str, Any]]:
+    '''Processed image for GPT, with its base64 data and metadata, cached by content.
+
+    None when the file is not an image Pillow can decode, the same way
+    unreadable attachments of the other types are left out of the prompt.
+    '''
+
+    cache_key = fingerprint(
+        file_digest(file_path),
+        IMAGE_PIPELINE_VERSION,
+        IMAGE_MAX_SIDE,
+        IMAGE_MAX_SHORT_SIDE,
+        IMAGE_JPEG_QUALITY
+    )
+
+    cached = image_cache.get_json(cache_key)
+    if cached is not None:
+        logger.info("INTERNAL - Image served from the image cache")
+        return cached
+
+    logger.info(f"INTERNAL - Processing image {os.path.basename(file_path)}")
+    try:
+        processed = _process(file_path)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as exception:
+        logger.error(f"Error processing image {file_path}: {str(exception)}")
+        return None
+
+    image_cache.set_json(cache_key, processed)
+    return processed
+
+
+def image_metadata(image: dict[str, Any]) -> dict[str, Any]:
+    '''Everything but the image data, for API responses'''
+
+    return {key: value for key, value in image.items() if key != 'data'}
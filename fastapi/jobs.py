@@ -0,0 +1,290 @@
+import os
+import logging
+from dotenv import load_dotenv
+from typing import Optional, Any
+
+# Custom libraries
+from database import get_connection
+from repository import DatabaseUnavailable
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# Seconds a worker owns a claimed task before another worker may take it over
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 300))
+
+# Attempts per task before it is marked as failed
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+# Job states
+QUEUED, RUNNING, COMPLETED, CANCELLED = "queued", "running", "completed", "cancelled"
+
+# Task states
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+CLAIM_QUERY = f"""
+SELECT jt.job_id, jt.task_id, jt.attempts, j.user_id, j.service, j.model
+FROM evaluation_job_tasks AS jt
+JOIN evaluation_jobs AS j ON j.job_id = jt.job_id
+WHERE j.status IN ('{QUEUED}', '{RUNNING}')
+  AND (jt.status = '{PENDING}' OR (jt.status = '{RUNNING}' AND jt.lease_expires_at < NOW()))
+  AND jt.attempts < {JOB_MAX_ATTEMPTS}
+ORDER BY jt.job_id
+LIMIT %s
+FOR UPDATE OF jt SKIP LOCKED
+"""
+
+# Tasks out of attempts, e.g. their worker crashed during the last one, are never claimed again
+EXHAUSTED_QUERY = f"""
+UPDATE evaluation_job_tasks
+SET status = '{FAILED}', error = 'Gave up after {JOB_MAX_ATTEMPTS} attempts', lease_owner = NULL, lease_expires_at = NULL
+WHERE attempts >= {JOB_MAX_ATTEMPTS}
+  AND (status = '{PENDING}' OR (status = '{RUNNING}' AND lease_expires_at < NOW()))
+"""
+
+# Jobs with nothing left to run
+COMPLETE_JOBS_QUERY = f"""
+UPDATE evaluation_jobs AS j SET j.status = '{COMPLETED}'
+WHERE j.status = '{RUNNING}' AND NOT EXISTS (
+    SELECT 1 FROM evaluation_job_tasks AS jt
+    WHERE jt.job_id = j.job_id AND jt.status IN ('{PENDING}', '{RUNNING}')
+)
+"""
+
+
+def create_job(user_id: int, task_ids: list[str], service: str, model: str) -> int:
+    '''Store a job and its task list, returns the job_id'''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor() as cursor:
+            logger.info(f"SQL - create_job() - Inserting a job with {len(task_ids)} tasks")
+            cursor.execute(
+                "INSERT INTO evaluation_jobs (user_id, service, model, status, total_tasks) VALUES (%s, %s, %s, %s, %s)",
+                (user_id, service, model, QUEUED, len(task_ids))
+            )
+            job_id = cursor.lastrowid
+
+            cursor.executemany(
+                "INSERT INTO evaluation_job_tasks (job_id, task_id) VALUES (%s, %s)",
+                [(job_id, task_id) for task_id in task_ids]
+            )
+            conn.commit()
+            logger.info(f"SQL - create_job() - Job {job_id} created")
+
+    return job_id
+
+
+def get_job(job_id: int) -> Optional[dict[str, Any]]:
+    '''A job with its progress and per-task results, None if it does not exist'''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor(dictionary = True) as cursor:
+            logger.info(f"SQL - get_job() - Fetching job {job_id}")
+            cursor.execute(
+                """
+                SELECT job_id, user_id, service, model, status, total_tasks, created_at, updated_at
+                FROM evaluation_jobs WHERE job_id = %s
+                """,
+                (job_id,)
+            )
+            job = cursor.fetchone()
+            if job is None:
+                return None
+
+            cursor.execute(
+                """
+                SELECT task_id, status, attempts, correct, error, updated_at
+                FROM evaluation_job_tasks WHERE job_id = %s ORDER BY task_id
+                """,
+                (job_id,)
+            )
+            tasks = cursor.fetchall()
+
+    progress = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+    for task in tasks:
+        progress[task['status']] = progress.get(task['status'], 0) + 1
+
+    job['progress'] = progress
+    job['correct'] = sum(1 for task in tasks if task['correct'])
+    job['tasks'] = tasks
+    return job
+
+
+def cancel_job(job_id: int) -> bool:
+    '''Cancel a job, tasks already running finish but nothing new is claimed'''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor() as cursor:
+            logger.info(f"SQL - cancel_job() - Cancelling job {job_id}")
+            cursor.execute(
+                f"UPDATE evaluation_jobs SET status = %s WHERE job_id = %s AND status IN ('{QUEUED}', '{RUNNING}')",
+                (CANCELLED, job_id)
+            )
+            cancelled = cursor.rowcount > 0
+
+            cursor.execute(
+                "UPDATE evaluation_job_tasks SET status = %s WHERE job_id = %s AND status = %s",
+                (CANCELLED, job_id, PENDING)
+            )
+            conn.commit()
+
+    return cancelled
+
+
+def claim_tasks(worker_id: str, limit: int) -> list[dict[str, Any]]:
+    '''Lease up to limit tasks to a worker.
+
+    Pending tasks and tasks whose lease expired (their worker crashed or
+    was redeployed) are locked with SKIP LOCKED, so concurrent workers
+    never claim the same task. Tasks that already used JOB_MAX_ATTEMPTS
+    are marked as failed instead.
+    '''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor(dictionary = True) as cursor:
+            cursor.execute(EXHAUSTED_QUERY)
+            if cursor.rowcount > 0:
+                logger.warning(f"INTERNAL - Marked {cursor.rowcount} task(s) out of attempts as failed")
+                cursor.execute(COMPLETE_JOBS_QUERY)
+            conn.commit()
+
+            cursor.execute(CLAIM_QUERY, (limit,))
+            claimed = cursor.fetchall()
+
+            if claimed:
+                cursor.executemany(
+                    f"""
+                    UPDATE evaluation_job_tasks
+                    SET status = '{RUNNING}', lease_owner = %s, attempts = attempts + 1,
+                        lease_expires_at = DATE_ADD(NOW(), INTERVAL %s SECOND)
+                    WHERE job_id = %s AND task_id = %s
+                    """,
+                    [(worker_id, JOB_LEASE_SECONDS, task['job_id'], task['task_id']) for task in claimed]
+                )
+                cursor.execute(
+                    f"""
+                    UPDATE evaluation_jobs SET status = '{RUNNING}'
+                    WHERE status = '{QUEUED}' AND job_id IN ({', '.join(['%s'] * len(claimed))})
+                    """,
+                    tuple(task['job_id'] for task in claimed)
+                )
+
+            conn.commit()
+
+    if claimed:
+        logger.info(f"INTERNAL - Worker {worker_id} claimed {len(claimed)} task(s)")
+    return claimed
+
+
+def saved_answer(job_id: int, task_id: str) -> Optional[str]:
+    '''GPT's answer already saved for a job task, left by an attempt that crashed before its checkpoint'''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT gpt_response FROM analytics WHERE job_id = %s AND task_id = %s",
+                (job_id, task_id)
+            )
+            row = cursor.fetchone()
+
+    return None if row is None else row[0]
+
+
+def renew_leases(worker_id: str) -> None:
+    '''Extend the leases of every task a worker is still running'''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE evaluation_job_tasks
+                SET lease_expires_at = DATE_ADD(NOW(), INTERVAL %s SECOND)
+                WHERE lease_owner = %s AND status = '{RUNNING}'
+                """,
+                (JOB_LEASE_SECONDS, worker_id)
+            )
+            conn.commit()
+
+
+def finish_task(
+        job_id: int,
+        task_id: str,
+        worker_id: str,
+        attempts: int,
+        correct: Optional[bool] = None,
+        error: Optional[str] = None
+) -> None:
+    '''Checkpoint a task and close its job once no task is left.
+
+    Failed tasks go back to pending until they reach JOB_MAX_ATTEMPTS.
+    Results from a worker that lost its lease are dropped.
+    '''
+
+    if error is None:
+        task_status = DONE
+    else:
+        task_status = FAILED if attempts >= JOB_MAX_ATTEMPTS else PENDING
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE evaluation_job_tasks
+                SET status = %s, correct = %s, error = %s, lease_owner = NULL, lease_expires_at = NULL
+                WHERE job_id = %s AND task_id = %s AND lease_owner = %s AND status = '{RUNNING}'
+                """,
+                (task_status, correct, error, job_id, task_id, worker_id)
+            )
+
+            cursor.execute(
+                f"""
+                UPDATE evaluation_jobs SET status = '{COMPLETED}'
+                WHERE job_id = %s AND status = '{RUNNING}' AND NOT EXISTS (
+                    SELECT 1 FROM evaluation_job_tasks
+                    WHERE job_id = %s AND status IN ('{PENDING}', '{RUNNING}')
+                )
+                """,
+                (job_id, job_id)
+            )
+            conn.commit()
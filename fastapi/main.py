@@ -1,18 +1,22 @@
 import os
+import math
 import time
+import asyncio
 import json
-import base64
 import logging
 import datetime
-import mysql.connector
 from enum import Enum
-from openai import OpenAI
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 from typing import Optional, Any
-from mysql.connector import Error
-from fastapi.responses import JSONResponse
-from fastapi import FastAPI, status, Depends, HTTPException
+from aiomysql import DictCursor, SSDictCursor
+from fastapi.responses import JSONResponse, Response, StreamingResponse, PlainTextResponse
+from starlette.routing import Match
+from starlette.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
+from anyio import to_thread
+from fastapi import FastAPI, Request, status, Depends, HTTPException, Query
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -20,18 +24,164 @@ from fastapi.middleware.cors import CORSMiddleware
 from helpers import         \
 get_password_hash,          \
 verify_password,            \
-count_tokens,               \
-generate_restriction,       \
-rectification_helper,       \
-extract_file_content,       \
-download_files_from_gcs,    \
-create_jwt_token,           \
-decode_jwt_token,           \
-validate_token
+get_encoding,               \
+json_serial,                \
+create_jwt_token
+
+from auth import             \
+token_verifier,              \
+token_claims,                \
+refresh_revocations_periodically
+
+from database import         \
+create_connection,           \
+pool_stats,                  \
+close_pool,                  \
+get_async_pool,              \
+async_connection,            \
+async_pool_stats,            \
+close_async_pool
+
+from gpt_client import       \
+upstream_stats
+
+from repository import       \
+GaiaTask,                    \
+DatabaseUnavailable,         \
+list_tasks
+
+from catalog import          \
+prompt_catalog,              \
+lookup_task,                 \
+async_lookup_task,           \
+refresh_catalog_periodically,\
+CATALOG_MIN_REFRESH_SECONDS
+
+from attachments import      \
+attachment_cache,            \
+start_attachment_prefetch
+
+from images import           \
+image_cache
+
+from analytics import        \
+analytics_writer,            \
+async_update_analytics,      \
+async_insert_analytics,      \
+migrate_analytics
+
+from jobs import             \
+create_job,                  \
+get_job,                     \
+cancel_job
+
+from ratelimit import        \
+rate_limiter,                \
+RateLimited,                 \
+persist_rate_limits_periodically
+
+from executor import         \
+cpu_executor,                \
+run_cpu
+
+from evaluation import       \
+build_prompt,                \
+answer,                      \
+stream_completion,           \
+analytics_row,               \
+result_payload,              \
+evaluate,                    \
+GPT_MODEL
+
+from cache import            \
+completion_cache,            \
+parse_cache,                 \
+transcription_cache
+
+from admission import        \
+AdmissionMiddleware,         \
+admission_stats
+
+from metrics import          \
+span,                        \
+render_metrics,              \
+register_collector,          \
+http_requests,               \
+http_request_seconds,        \
+http_in_flight
 
 # ============================= FastAPI : Begin =============================
+# Threads shared by the sync routes and run_in_threadpool()
+THREADPOOL_SIZE = int(os.getenv('THREADPOOL_SIZE', 40))
+
+# Startup and shutdown tasks
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''Set up shared resources on startup and release them on shutdown'''
+
+    # Size of the threadpool running the sync routes and run_in_threadpool() calls
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+    # Load the tokenizer once instead of on the first request
+    try:
+        await run_in_threadpool(get_encoding)
+    except Exception as exception:
+        logger.warning(f"INTERNAL - Tokenizer could not be loaded at startup : {exception}")
+
+    # Warm up the async database pool (the routes retry lazily if this fails)
+    try:
+        await get_async_pool()
+    except Exception as exception:
+        logger.warning(f"Database - Async connection pool could not be opened at startup : {exception}")
+
+    # Optionally warm the attachment cache, requests fetch their own file on demand
+    if os.getenv('ATTACHMENT_PREFETCH', "false").lower() == "true":
+        start_attachment_prefetch()
+    else:
+        attachment_cache.state = "disabled"
+
+    # Load the GAIA prompt catalog and keep it fresh in the background
+    await run_in_threadpool(prompt_catalog.refresh)
+    catalog_refresher = asyncio.create_task(refresh_catalog_periodically())
+
+    # Add missing analytics columns, then start the writer, replaying rows spilled by a previous run
+    await run_in_threadpool(migrate_analytics)
+    analytics_writer.start()
+
+    # Load the revoked tokens and keep the deny-list fresh in the background
+    await run_in_threadpool(token_verifier.refresh_revocations)
+    revocation_refresher = asyncio.create_task(refresh_revocations_periodically())
+
+    # Restore the per-user rate limits and save them periodically
+    await run_in_threadpool(rate_limiter.load)
+    rate_limit_saver = asyncio.create_task(persist_rate_limits_periodically())
+
+    yield
+
+    catalog_refresher.cancel()
+    revocation_refresher.cancel()
+    rate_limit_saver.cancel()
+    rate_limiter.save()
+
+    # Flush the caches to disk
+    for cache in (completion_cache, parse_cache, transcription_cache, image_cache):
+        if cache is not None:
+            cache.close()
+
+    # Write the queued analytics rows (spilled to disk if the database is down)
+    await run_in_threadpool(analytics_writer.close)
+
+    # Stop the CPU workers
+    cpu_executor.shutdown()
+
+    # Close the pooled database connections
+    await close_async_pool()
+    close_pool()
+
+
 # Initialize FastAPI instance
 app = FastAPI(
+    lifespan = lifespan,
     openapi_tags = [{
         "name": "auth", 
         "description": "Authentication"
@@ -54,7 +204,41 @@ app.swagger_ui_init_oauth = {
     "useBasicAuthenticationWithAccessCodeGrant": True
 }
 
-# Enable CORS
+# Admission control: per route class concurrency limits with a bounded wait queue
+app.add_middleware(AdmissionMiddleware)
+
+
+def route_template(request: Request) -> str:
+    '''Path template of the matched route (/loadprompt/{task_id}), so metric labels stay bounded'''
+
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+# Record the latency and the in-flight requests of every route
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    route = route_template(request)
+    http_in_flight.inc(route = route)
+    start_time = time.perf_counter()
+    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+
+    finally:
+        # Streamed responses are measured up to their first byte
+        http_request_seconds.observe(time.perf_counter() - start_time, route = route, method = request.method)
+        http_requests.inc(route = route, method = request.method, status = status_code)
+        http_in_flight.dec(route = route)
+
+
+# Enable CORS, added last so it wraps the middlewares above and shed 503s carry CORS headers too
 app.add_middleware(
     CORSMiddleware,
     allow_origins       = ["*"],
@@ -62,20 +246,32 @@ app.add_middleware(
     allow_methods       = ["*"],
     allow_headers       = ["*"],
 )
+
+
+# Snapshots of the pools, caches and upstream limiter exported on each scrape
+register_collector("db_pool", pool_stats)
+register_collector("async_db_pool", async_pool_stats)
+register_collector("upstream", upstream_stats)
+register_collector("catalog", prompt_catalog.stats)
+register_collector("auth", token_verifier.stats)
+register_collector("rate_limit", rate_limiter.stats)
+register_collector("admission", admission_stats)
+register_collector("analytics_writer", analytics_writer.stats)
+register_collector("attachment_cache", attachment_cache.stats)
+for cache_name, cache in (
+        ("completion_cache", completion_cache),
+        ("parse_cache", parse_cache),
+        ("transcription_cache", transcription_cache),
+        ("image_cache", image_cache)
+):
+    if cache is not None:
+        register_collector(cache_name, cache.stats)
 # ============================= FastAPI : End ===============================
 
 
 # Load env variables
 load_dotenv()
 
-# Setup OpenAI API key
-openai_client = OpenAI(
-    api_key         = os.getenv("OPENAI_API"),
-    project         = os.getenv("PROJECT_ID"),
-    organization    = os.getenv("ORGANIZATION_ID")
-)
-
-
 # ============================= Logger : Begin =============================
 
 # Initialize logger
@@ -147,41 +343,31 @@ class Feedback(BaseModel):
 class MarkCorrect(BaseModel):
     task_id: str
 
-
-def create_connection(attempts = 3, delay = 2):
-    '''Start a connection with the MySQL database'''
-
-    # Database connection config
-    config = {
-        'user'              : os.getenv('DB_USER'),
-        'password'          : os.getenv('DB_PASSWORD'),
-        'host'              : os.getenv('DB_HOST'),
-        'database'          : os.getenv('DB_NAME'),
-        'raise_on_warnings' : True
-    }
-
-    # Attempt a reconnection routine
-    attempt = 1
-    
-    while attempt <= attempts:
-        try:
-            conn = mysql.connector.connect(**config)
-            logger.info("Database - Connection to the database was opened")
-            return conn
-        
-        except (Error, IOError) as error:
-            if attempt == attempts:
-                # Ran out of attempts
-                logger.error(f"Database - Failed to connect to database : {error}")
-                return None
-            else:
-                logger.warning(f"Database - Connection failed: {error} - Retrying {attempt}/{attempts} ...")
-                
-                # Delay the next attempt
-                time.sleep(delay ** attempt)
-                attempt += 1
-    
-    return None
+class AnalyticsFormat(str, Enum):
+    JSON = "json"
+    NDJSON = "ndjson"
+
+class AnalyticsQuery(BaseModel):
+    after_id: Optional[int] = None
+    limit: Optional[int] = Query(default=None, ge=1)
+    user_id: Optional[int] = None
+    task_id: Optional[str] = None
+    service: Optional[str] = None
+    start_date: Optional[datetime.datetime] = None
+    end_date: Optional[datetime.datetime] = None
+    correct: Optional[bool] = None
+    format: AnalyticsFormat = AnalyticsFormat.JSON
+
+class BatchQuery(BaseModel):
+    task_ids: Optional[list[str]] = None
+    dataset_type: Optional[str] = None
+    level: Optional[int] = None
+    limit: Optional[int] = Field(default=None, ge=1)
+    service: ExtractionService = ExtractionService.PYMUPDF
+    concurrency: Optional[int] = Field(default=None, ge=1)
+
+class JobRequest(BatchQuery):
+    model: Optional[str] = None
 
 
 # Route for FastAPI Health check
@@ -219,68 +405,81 @@ def dbhealth() -> JSONResponse:
         }
         conn.close()
         logger.info("Database - Connection to the database was closed")
+
+    # Connection pool wait times, checkout latency and leak counters
+    response['pool'] = pool_stats()
+    response['async_pool'] = async_pool_stats()
     
     return JSONResponse(content=response)
 
 
-def store_tokens(conn, token: str) -> bool:
-    '''Store the newly generated token in the database'''
+# Route for readiness check
+@app.get("/ready")
+def ready() -> JSONResponse:
+    '''Report the progress of the attachment prefetch and the cache counters'''
 
-    logger.info("INTERNAL - Request to store JWT token to the database received")
-    token_saved = False
+    logger.info("GET - /ready request received")
+    prefetch_status = attachment_cache.status()
+    is_ready = prefetch_status['state'] in ("complete", "degraded", "disabled")
+    status_code = status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE
 
-    try:
-        # Get the user_id from the token and save it to the users table
-        decoded_token = decode_jwt_token(token)
-        logger.info("SQL - Running a UPDATE statement")
+    return JSONResponse(
+        status_code = status_code,
+        content     = {
+            'status'    : status_code,
+            'type'      : "json",
+            'message'   : prefetch_status
+        }
+    )
 
-        with conn.cursor(dictionary=True) as cursor:
-            update_query = "UPDATE `users` SET jwt_token = %s WHERE user_id = %s"
-            
-            cursor.execute(update_query, (str(token), decoded_token['user_id']))
-            conn.commit()
-        
-            logger.info("SQL - UPDATE statement complete")
-            logger.info("INTERNAL - Saved JWT token to the database")
-            token_saved = True
 
-    except Exception as exception:
-        logger.error("Error: store_tokens() encountered an error")
-        logger.error(exception)
+# Route for OpenAI upstream health check
+@app.get("/upstream")
+def upstream() -> JSONResponse:
+    '''Report the OpenAI queue depth, in-flight calls and latency'''
+
+    logger.info("GET - /upstream request received")
+    return JSONResponse({
+        'status'    : status.HTTP_200_OK,
+        'type'      : "json",
+        'message'   : upstream_stats()
+    })
+
+
+# Route for Prometheus metrics
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+    '''Expose the latency histograms, in-flight gauges, upstream errors and pool and cache counters to Prometheus'''
+
+    return PlainTextResponse(render_metrics(), media_type = "text/plain; version=0.0.4")
 
-    finally:
-        return token_saved
-    
 
 # Route for user registration
 @app.post("/register")
-def register(user: UserRegister) -> JSONResponse:
+async def register(user: UserRegister) -> JSONResponse:
     '''Sign up new users to the application'''
 
     logger.info("POST - /register request received")
-    conn = create_connection()
 
-    if conn is None:
-        return JSONResponse({
-            'status': status.HTTP_503_SERVICE_UNAVAILABLE,
-            'type': "string",
-            'message': "Database not found :("
-        })
+    async with async_connection() as conn:
+
+        if conn is None:
+            return JSONResponse({
+                'status': status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type': "string",
+                'message': "Database not found :("
+            })
+
+        async with conn.cursor(DictCursor) as cursor:
 
-    if conn and conn.is_connected():
-        with conn.cursor(dictionary=True) as cursor: 
-            
             try:
-                
+
                 # Check if email already exists
                 logger.info("SQL - Running a SELECT statement")
-                cursor.execute("SELECT * FROM users WHERE email = %s", (user.email,))
+                await cursor.execute("SELECT user_id FROM users WHERE email = %s", (user.email,))
                 logger.info("SQL - SELECT statement complete")
 
-                if cursor.fetchone():
-                    conn.close()
-                    logger.info("Database - Connection to the database was closed")
-                    
+                if await cursor.fetchone():
                     return JSONResponse({
                         'status': status.HTTP_400_BAD_REQUEST,
                         'type': "string",
@@ -288,7 +487,7 @@ def register(user: UserRegister) -> JSONResponse:
                     })
 
                 # Hash the password
-                hashed_password = get_password_hash(user.password)
+                hashed_password = await run_cpu("password_hash", get_password_hash, user.password)
 
                 # Insert the new user in the database
                 logger.info("SQL - Running an INSERT statement")
@@ -296,14 +495,14 @@ def register(user: UserRegister) -> JSONResponse:
                 INSERT INTO users (first_name, last_name, phone, email, password)
                 VALUES (%s, %s, %s, %s, %s)
                 """
-                cursor.execute(query, (
+                await cursor.execute(query, (
                     user.first_name,
                     user.last_name, 
                     user.phone,
                     user.email,
                     hashed_password 
                 ))
-                conn.commit()
+                await conn.commit()
                 logger.info("SQL - INSERT statement complete")
 
                 # Retrieve the ID of the newly registered user
@@ -316,23 +515,12 @@ def register(user: UserRegister) -> JSONResponse:
                     "email"     : user.email
                 })
 
-                token_saved = store_tokens(conn, jwt_token['token'])
-
-                if token_saved:
-                    response = {
-                        "status"      : status.HTTP_200_OK,
-                        'type'        : "string",
-                        "message"     : jwt_token
-                    }
-                
-                else:
-                    response = {
-                    "status"      : status.HTTP_304_NOT_MODIFIED,
+                response = {
+                    "status"      : status.HTTP_200_OK,
                     'type'        : "string",
-                    "message"     : "Failed to save token to database"
+                    "message"     : jwt_token
                 }
 
-
             except Exception as exception:
                 logger.error("Error: register() encountered an error")
                 logger.error(exception)
@@ -342,44 +530,37 @@ def register(user: UserRegister) -> JSONResponse:
                     "message": "New user could not be registered. Something went wrong.",
                 }
 
-            finally:
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-
-        return JSONResponse(content=response)
+    return JSONResponse(content=response)
 
 
 # Route for user login
 @app.post("/login")
-def login(user: UserLogin) -> JSONResponse:
+async def login(user: UserLogin) -> JSONResponse:
     '''Sign in an existing user'''
 
     logger.info("POST - /login request received")
-    conn = create_connection()
 
-    # Check if the database connection is successful
-    if conn is None:
-        return JSONResponse({
-            'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
-            'type'      : "string",
-            'message'   : "Database not found :("
-        })
+    async with async_connection() as conn:
+
+        # Check if the database connection is successful
+        if conn is None:
+            return JSONResponse({
+                'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type'      : "string",
+                'message'   : "Database not found :("
+            })
 
-    if conn and conn.is_connected():
-        with conn.cursor(dictionary=True) as cursor:
+        async with conn.cursor(DictCursor) as cursor:
             try:
                 # Fetch user by email
                 logger.info("SQL - Running a SELECT statement")
-                cursor.execute("SELECT * FROM users WHERE email = %s", (user.email,))
+                await cursor.execute("SELECT user_id, email, password FROM users WHERE email = %s", (user.email,))
                 logger.info("SQL - SELECT statement complete")
 
-                db_user = cursor.fetchone()
+                db_user = await cursor.fetchone()
 
                 # If user not found, return a 404 response
                 if db_user is None:
-                    conn.close()
-                    logger.info("Database - Connection to the database was closed")
-
                     return JSONResponse({
                         'status'    : status.HTTP_404_NOT_FOUND,
                         'type'      : "string",
@@ -387,7 +568,7 @@ def login(user: UserLogin) -> JSONResponse:
                     })
 
                 # Verify password
-                if not verify_password(user.password, db_user['password']):
+                if not await run_cpu("password_hash", verify_password, user.password, db_user['password']):
                     response = {
                         'status'    : status.HTTP_401_UNAUTHORIZED,
                         'type'      : "string",
@@ -401,21 +582,11 @@ def login(user: UserLogin) -> JSONResponse:
                         "email"     : db_user['email']
                     })
 
-                    token_saved = store_tokens(conn, jwt_token['token'])
-
-                    if token_saved:
-                        logger.info(f"User logged in: {db_user['user_id']}")
-                        response = {
-                            "status"      : status.HTTP_200_OK,
-                            'type'        : "string",
-                            "message"     : jwt_token
-                        }
-                    
-                    else:
-                        response = {
-                        "status"      : status.HTTP_304_NOT_MODIFIED,
+                    logger.info(f"User logged in: {db_user['user_id']}")
+                    response = {
+                        "status"      : status.HTTP_200_OK,
                         'type'        : "string",
-                        "message"     : "Failed to save token to database"
+                        "message"     : jwt_token
                     }
 
             except Exception as exception:
@@ -427,56 +598,48 @@ def login(user: UserLogin) -> JSONResponse:
                     "message"   : "User could not be logged in. Something went wrong.",
                 }
 
-            finally:
-                # Close the database connection
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-
-        # Return the JSON response containing the JWT token
-        return JSONResponse(content=response)
+    # Return the JSON response containing the JWT token
+    return JSONResponse(content=response)
 
 
 # Route for password reset
 @app.post("/resetpassword")
-def reset_password(reset_data: PasswordReset) -> JSONResponse:
+async def reset_password(reset_data: PasswordReset) -> JSONResponse:
     '''Allow users to set a new password if correct details are provided'''
 
     logger.info("POST - /resetpassword request received")
-    conn = create_connection()
 
-    if conn is None:
-        return JSONResponse({
-            'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
-            'type'      : "string",
-            'message'   : "Database not found :("
-        })
+    async with async_connection() as conn:
 
-    if conn and conn.is_connected():
-        with conn.cursor(dictionary = True) as cursor:
+        if conn is None:
+            return JSONResponse({
+                'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type'      : "string",
+                'message'   : "Database not found :("
+            })
+
+        async with conn.cursor(DictCursor) as cursor:
             try:
 
                 # Check if user exists and all provided details match
                 logger.info("SQL - Running a SELECT statement")
                 query = """
-                SELECT * FROM users 
+                SELECT user_id FROM users 
                 WHERE first_name = %s 
                 AND last_name = %s 
                 AND phone = %s 
                 AND email = %s
                 """
-                cursor.execute(query, (
+                await cursor.execute(query, (
                     reset_data.first_name, 
                     reset_data.last_name, 
                     reset_data.phone, 
                     reset_data.email
                 ))
                 logger.info("SQL - SELECT statement complete")
-                user = cursor.fetchone()
+                user = await cursor.fetchone()
 
                 if user is None:
-                    conn.close()
-                    logger.info("Database - Connection to the database was closed")
-
                     return JSONResponse({
                         'status'    : status.HTTP_401_UNAUTHORIZED,
                         'type'      : "string",
@@ -484,13 +647,13 @@ def reset_password(reset_data: PasswordReset) -> JSONResponse:
                     })
                     
                 # Hash the new password
-                hashed_password = get_password_hash(reset_data.new_password)
+                hashed_password = await run_cpu("password_hash", get_password_hash, reset_data.new_password)
 
                 # Update the password
                 logger.info("SQL - Running a UPDATE statement")
                 update_query = "UPDATE users SET password = %s WHERE user_id = %s"
-                cursor.execute(update_query, (hashed_password, user['user_id']))
-                conn.commit()
+                await cursor.execute(update_query, (hashed_password, user['user_id']))
+                await conn.commit()
                 logger.info("SQL - UPDATE statement complete")
 
                 logger.info(f"Password reset successful for user ID: {user['user_id']}")
@@ -510,14 +673,10 @@ def reset_password(reset_data: PasswordReset) -> JSONResponse:
                     "message"   : "Password could not be reset. Something went wrong.",
                 }
 
-            finally:
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-
-        return JSONResponse(content=response)
+    return JSONResponse(content=response)
     
 # Token verification wrapper function
-async def verify_token(token: str = Depends(oauth2_scheme)) -> str:
+async def verify_token(request: Request, token: str = Depends(oauth2_scheme)) -> str:
     '''A wrapper to validate the tokens in the request headers'''
 
     if not token:
@@ -531,7 +690,10 @@ async def verify_token(token: str = Depends(oauth2_scheme)) -> str:
             headers      = {"WWW-Authenticate": "Bearer"},
         )
 
-    if validate_token(token):
+    with span("auth"):
+        claims = token_claims(token)
+
+    if claims is None:
         raise HTTPException(
             status_code  = status.HTTP_401_UNAUTHORIZED,
             detail       = {
@@ -541,10 +703,61 @@ async def verify_token(token: str = Depends(oauth2_scheme)) -> str:
             },
             headers      = {"WWW-Authenticate": "Bearer"},
         )
-    
+
+    # Keep the claims for the route, so they are not looked up again
+    request.state.claims = claims
     return token
 
 
+# Claims of the token checked by verify_token
+async def verified_claims(request: Request, token: str = Depends(verify_token)) -> dict[str, Any]:
+    '''The user_id and email of the authenticated user'''
+
+    return request.state.claims
+
+
+# Route for user logout
+@app.post("/logout",
+    response_class  = JSONResponse,
+    responses       = {
+        401: {"description": "Invalid or expired token"},
+        200: {"description": "The token can no longer be used"}
+    }
+)
+def logout(
+    token: str = Depends(verify_token),
+    decoded_token: dict[str, Any] = Depends(verified_claims)
+) -> JSONResponse:
+    '''Revoke the token of the request on every worker'''
+
+    logger.info("POST - /logout request received")
+
+    try:
+        token_verifier.revoke(token, decoded_token)
+        return JSONResponse({
+            'status'    : status.HTTP_200_OK,
+            'type'      : "string",
+            'message'   : "Logged out"
+        })
+
+    except DatabaseUnavailable:
+        return JSONResponse({
+            'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+            'type'      : "string",
+            'message'   : "Database not found :("
+        })
+
+    except Exception as exception:
+        logger.error("Error: logout() encountered an error")
+        logger.error(exception)
+
+    return JSONResponse({
+        'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
+        'type'      : "string",
+        'message'   : "Could not log out. Something went wrong."
+    })
+
+
 # Route for listing prompts
 @app.get("/listprompts",
     response_class  = JSONResponse,
@@ -570,51 +783,36 @@ def list_prompts(
     if prompt.type == PromptType.TEST:
         prompt_type = 'test'
 
-    conn = create_connection()
+    try:
+        # Serve from the in-memory catalog, the database is only a fallback
+        if prompt_catalog.loaded:
+            tasks = prompt_catalog.query(dataset_type=prompt_type, extension=".pdf", limit=prompt.count)
+        else:
+            tasks = list_tasks(prompt_type, prompt.count)
 
-    if conn is None:
+        return JSONResponse({
+            'status'    : status.HTTP_200_OK,
+            'type'      : "json",
+            'message'   : [{'task_id': task.task_id, 'question': task.question} for task in tasks],
+            'length'    : prompt.count
+        })
+
+    except DatabaseUnavailable:
         return JSONResponse({
             'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
             'type'      : "string",
             'message'   : "Database not found :("
         })
 
-    if conn and conn.is_connected():
-        with conn.cursor(dictionary = True) as cursor:
-            try:
-                logger.info("SQL - Running a SELECT statement")
-
-                # Fetch the task_id, question from the table
-                query = f"SELECT `task_id`, `question` FROM `gaia_features` WHERE `dataset_type` = '{prompt_type}' AND `file_name` LIKE '%.pdf' LIMIT {prompt.count}"
-                result = cursor.execute(query)
-                rows = cursor.fetchall()
-
-                response = {
-                    'status'    : status.HTTP_200_OK,
-                    'type'      : "json",
-                    'message'   : rows,
-                    'length'    : prompt.count
-                }
-
-                logger.info("SQL - SELECT statement complete")
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-
-                return JSONResponse(content=response)
-
-            except Exception as exception:
-                logger.error("Error: list_prompts() encountered a SQL error")
-                logger.error(exception)
+    except Exception as exception:
+        logger.error("Error: list_prompts() encountered a SQL error")
+        logger.error(exception)
 
-            finally:
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-    
-        return JSONResponse({
-            'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
-            'type'      : "string",
-            'message'   : "Could not fetch the list of prompts. Something went wrong."
-        })
+    return JSONResponse({
+        'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
+        'type'      : "string",
+        'message'   : "Could not fetch the list of prompts. Something went wrong."
+    })
 
 
 # Route for fetching all details about a prompt
@@ -633,62 +831,39 @@ def loadprompt(
     '''Load all information from the database regarding the given prompt'''
 
     logger.info(f"GET - /loadprompt/{task_id} request received")
-    conn = create_connection()
 
-    if conn is None:
+    try:
+        task = lookup_task(task_id)
+
+        if task is None:
+            return JSONResponse({
+                'status'    : status.HTTP_404_NOT_FOUND,
+                'type'      : "string",
+                'message'   : f"Could not fetch the details for the given task_id (not found) {task_id}"
+            })
+
+        return JSONResponse({
+            'status'    : status.HTTP_200_OK,
+            'type'      : "json",
+            'message'   : task.prompt()
+        })
+
+    except DatabaseUnavailable:
         return JSONResponse({
             'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
             'type'      : "string",
             'message'   : "Database not found :("
         })
 
-    if conn and conn.is_connected():
-        with conn.cursor(dictionary = True) as cursor:
-            try:
-
-                # Fetch the task_id, question, level, final_answer, file_name 
-                logger.info("SQL - Running a SELECT statement")
-                query = """
-                SELECT task_id, question, level, final_answer, file_name 
-                FROM gaia_features
-                WHERE task_id = %s
-                """
-                result = cursor.execute(query, (task_id,))
-                record = cursor.fetchone()
-                logger.info("SQL - SELECT statement complete")
-
-                if record is None:
-                    conn.close()
-                    logger.info("Database - Connection to the database was closed")
-
-                    return JSONResponse({
-                        'status'    : status.HTTP_404_NOT_FOUND,
-                        'type'      : "string",
-                        'message'   : f"Could not fetch the details for the given task_id (not found) {task_id}"
-                    })
-
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-
-                return JSONResponse({
-                    'status'    : status.HTTP_200_OK,
-                    'type'      : "json",
-                    'message'   : record
-                })
-
-            except Exception as exception:
-                logger.error("Error: list_prompts() encountered a SQL error")
-                logger.error(exception)
+    except Exception as exception:
+        logger.error("Error: loadprompt() encountered a SQL error")
+        logger.error(exception)
 
-            finally:
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-    
-        return JSONResponse({
-            'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
-            'type'      : "string",
-            'message'   : "Could not fetch details for the prompt. Something went wrong."
-        })
+    return JSONResponse({
+        'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
+        'type'      : "string",
+        'message'   : "Could not fetch details for the prompt. Something went wrong."
+    })
 
 
 # Route for fetching annotation details for a prompt
@@ -706,116 +881,109 @@ def getannotation(
 ) -> JSONResponse:
     '''Load the annotation from the database regarding the given prompt'''
 
-    logger.info(f"GET - /loadprompt/{task_id} request received")
-    conn = create_connection()
+    logger.info(f"GET - /getannotation/{task_id} request received")
 
-    if conn is None:
+    try:
+        task = lookup_task(task_id)
+
+        if task is None:
+            return JSONResponse({
+                'status'    : status.HTTP_404_NOT_FOUND,
+                'type'      : "string",
+                'message'   : f"Could not fetch the details for the given task_id (not found) {task_id}"
+            })
+
+        if task.steps is None:
+            return JSONResponse({
+                'status'    : status.HTTP_404_NOT_FOUND,
+                'type'      : "string",
+                'message'   : f"Could not fetch the annotation steps for the given task_id (not found) {task_id}"
+            })
+
+        return JSONResponse({
+            'status'    : status.HTTP_200_OK,
+            'type'      : "string",
+            'message'   : task.annotation_steps
+        })
+
+    except DatabaseUnavailable:
         return JSONResponse({
             'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
             'type'      : "string",
             'message'   : "Database not found :("
         })
 
-    if conn and conn.is_connected():
-        with conn.cursor(dictionary = True) as cursor:
-            try:
+    except Exception as exception:
+        logger.error("Error: getannotation() encountered a SQL error")
+        logger.error(exception)
 
-                # Fetch the final_answer for the task_id
-                logger.info("SQL - Running a SELECT statement")
-                query = """SELECT final_answer FROM gaia_features WHERE task_id = %s"""
+    return JSONResponse({
+        'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
+        'type'      : "string",
+        'message'   : "Could not fetch details for the prompt. Something went wrong."
+    })
+    
 
-                result = cursor.execute(query, (task_id,))
-                final_answer = cursor.fetchone()
-                logger.info("SQL - SELECT statement complete")
+# Route for reloading the in-memory prompt catalog
+@app.post("/catalog/refresh",
+    response_class  = JSONResponse,
+    responses       = {
+        401: {"description": "Invalid or expired token"},
+        403: {"description": "Insufficient permissions"},
+        200: {"description": "Reloads the GAIA prompts and annotations from the database"}
+    }
+)
+def refresh_catalog(
+    token: str = Depends(verify_token)
+) -> JSONResponse:
+    '''Reload the in-memory prompt catalog from the database, at most once per CATALOG_MIN_REFRESH_SECONDS'''
 
-                if final_answer is None:
-                    conn.close()
-                    logger.info("Database - Connection to the database was closed")
+    logger.info("POST - /catalog/refresh request received")
 
-                    return JSONResponse({
-                        'status'    : status.HTTP_404_NOT_FOUND,
-                        'type'      : "string",
-                        'message'   : f"Could not fetch the details for the given task_id (not found) {task_id}"
-                    })
-
-                # Fetch the steps for the task_id
-                logger.info("SQL - Running a SELECT statement")
-                query = """SELECT Steps FROM gaia_annotations WHERE task_id = %s"""
-
-                result = cursor.execute(query, (task_id,))
-                prompt_steps = cursor.fetchone()
-                logger.info("SQL - SELECT statement complete")
-
-                if prompt_steps is None:
-                    conn.close()
-                    logger.info("Database - Connection to the database was closed")
-
-                    return JSONResponse({
-                        'status'    : status.HTTP_404_NOT_FOUND,
-                        'type'      : "string",
-                        'message'   : f"Could not fetch the annotation steps for the given task_id (not found) {task_id}"
-                    })
-                
-                filtered_prompt = prompt_steps['Steps'].replace(final_answer['final_answer'], '_')
-
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-
-                return JSONResponse({
-                    'status'    : status.HTTP_200_OK,
-                    'type'      : "string",
-                    'message'   : filtered_prompt
-                })
-
-            except Exception as exception:
-                logger.error("Error: list_prompts() encountered a SQL error")
-                logger.error(exception)
-
-            finally:
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-    
+    if prompt_catalog.refresh(CATALOG_MIN_REFRESH_SECONDS):
         return JSONResponse({
-            'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
-            'type'      : "string",
-            'message'   : "Could not fetch details for the prompt. Something went wrong."
+            'status'    : status.HTTP_200_OK,
+            'type'      : "json",
+            'message'   : prompt_catalog.stats()
         })
-    
 
-def update_analytics(data: dict) -> bool:
-    '''Save GPT-4's response and some other data to the database'''
+    return JSONResponse({
+        'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+        'type'      : "string",
+        'message'   : "Could not reload the prompt catalog, still serving the previous copy"
+    })
 
-    logger.info("INTERNAL - Request to save response data to database received")
-    conn = create_connection()
-    response = False
 
-    if conn and conn.is_connected():
-        with conn.cursor(dictionary = True) as cursor:
-            try:
+# Helper function to map the requested extraction service to its name
+def extraction_service_name(service: ExtractionService) -> str:
+    '''Name of the extraction service used for PDF attachments'''
 
-                # Update the analytics 
-                logger.info("SQL - Running an INSERT statement")
+    if service == ExtractionService.AZURE:
+        return "azure"
+    elif service == ExtractionService.ADOBE:
+        return "adobe"
+    return "pymupdf"
 
-                # Get the columns and the corresponding placeholders
-                columns = ', '.join(data.keys())
-                placeholders = ', '.join(['%s'] * len(data))
 
-                query = f"INSERT INTO analytics ({columns}) VALUES ({placeholders})"
+# Helper function to apply the per-user token bucket
+def rate_limited(user_id: int, tokens: int) -> Optional[JSONResponse]:
+    '''HTTP 429 with Retry-After if the user has run out of prompt tokens, None otherwise'''
 
-                cursor.execute(query, tuple(data.values()))
-                conn.commit()
-                logger.info("SQL - INSERT statement complete")
-                response = True
+    retry_after = rate_limiter.acquire(user_id, tokens)
+    if retry_after <= 0:
+        return None
 
-            except Exception as exception:
-                logger.error("Error: update_analytics() encountered an error")
-                logger.error(exception)
-                
-            finally:
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-    
-    return response
+    retry_after = math.ceil(retry_after)
+    logger.info(f"INTERNAL - User {user_id} rate limited for {retry_after}s")
+    return JSONResponse(
+        status_code = status.HTTP_429_TOO_MANY_REQUESTS,
+        headers     = {'Retry-After': str(retry_after)},
+        content     = {
+            'status'    : status.HTTP_429_TOO_MANY_REQUESTS,
+            'type'      : "string",
+            'message'   : f"Too many prompt tokens sent. Please retry in {retry_after} seconds."
+        }
+    )
 
 
 # Route for querying GPT
@@ -823,207 +991,495 @@ def update_analytics(data: dict) -> bool:
     responses       = {
         401: {"description": "Invalid or expired token"},
         403: {"description": "Insufficient permissions"},
+        429: {"description": "Prompt token quota used up, retry after the Retry-After header"},
         200: {"description": "Returns GPT's response and other required data as a JSON"}
     }
 )
 async def query_gpt(
     query: QueryGPT,
-    token: str = Depends(verify_token)
+    decoded_token: dict[str, Any] = Depends(verified_claims)
 ) -> JSONResponse:
     '''Forward the question to OpenAI GPT4 and evaluate based on GAIA Benchmark'''
 
     logger.info(f"POST - /querygpt/{query.task_id} request received")
-
-    # Set the extraction service
-    if query.service == ExtractionService.AZURE:
-        extraction_service = "azure"
-    elif query.service == ExtractionService.ADOBE:
-        extraction_service = "adobe"
-    else:
-        extraction_service = "pymupdf"
     
     try:
 
         # Get the prompt, apply restriction wherever needed, and send to GPT
-        prompt = loadprompt(query.task_id)
-        prompt = json.loads(prompt.body)
+        with span("task_lookup"):
+            task = await async_lookup_task(query.task_id)
 
-        if prompt and prompt['status'] == status.HTTP_200_OK:
-            
-            # If query.updated_steps is empty, then it's a fresh prompt
-            if (query.updated_steps is None) or (query.updated_steps == ''):
-                
-                restriction = generate_restriction(prompt['message']['final_answer'])
-                full_question = f"{prompt['message']['question']} {restriction}".strip()
+        if task is not None:
+
+            prompt = await build_prompt(task, extraction_service_name(query.service), query.updated_steps)
+
+            # Charge the prompt tokens to the user before spending them on GPT
+            limited = rate_limited(decoded_token['user_id'], prompt.token_count)
+            if limited is not None:
+                return limited
+
+            response_data, result = await answer(prompt, decoded_token['user_id'])
+
+            # Save to analytics table
+            with span("analytics"):
+                await async_update_analytics(response_data)
+            logger.info("INTERNAL - analytics data queued for the database")
+
+            return JSONResponse(content={"status": status.HTTP_200_OK, **result})
+
+    except Exception as exception:
+        logger.error("Error: querygpt() encountered an error")
+        logger.error(exception)
+
+    return JSONResponse({
+        'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
+        'type'      : "string",
+        'message'   : "Could not send prompt to GPT. Something went wrong."
+    })
+
+
+# Helper function to format a server-sent event
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=json_serial)}\n\n"
+
+
+# Helper function to save the analytics row once a stream has been sent
+async def save_streamed_analytics(state: dict[str, Any]) -> None:
+    if state.get('row') is None:
+        return
+
+    with span("analytics"):
+        await async_update_analytics(state['row'])
+    logger.info("INTERNAL - analytics data queued for the database")
+
+
+# Route for querying GPT with a streamed answer
+@app.post("/querygpt/stream",
+    responses       = {
+        401: {"description": "Invalid or expired token"},
+        403: {"description": "Insufficient permissions"},
+        429: {"description": "Prompt token quota used up, retry after the Retry-After header"},
+        200: {"description": "Streams GPT's response as server-sent events, followed by a metadata event"}
+    }
+)
+async def query_gpt_stream(
+    query: QueryGPT,
+    decoded_token: dict[str, Any] = Depends(verified_claims)
+) -> Response:
+    '''Same as /querygpt, but GPT's answer is streamed as it is generated.
+
+    "token" events carry the text as it arrives, then one "metadata" event
+    carries the same fields as /querygpt (or an "error" event if GPT
+    failed). The analytics row is saved after the stream is closed.
+    '''
+
+    logger.info(f"POST - /querygpt/stream/{query.task_id} request received")
+
+    try:
+        with span("task_lookup"):
+            task = await async_lookup_task(query.task_id)
+
+        if task is not None:
+            prompt = await build_prompt(task, extraction_service_name(query.service), query.updated_steps)
+
+            limited = rate_limited(decoded_token['user_id'], prompt.token_count)
+            if limited is not None:
+                return limited
+
+            state: dict[str, Any] = {}
+
+            async def events():
+                result: dict[str, Any] = {}
+                start_time = time.time()
+
+                try:
+                    async for text in stream_completion(prompt, result):
+                        yield sse_event("token", {'text': text})
+
+                except Exception as exception:
+                    logger.error("Error: querygpt/stream encountered an error while streaming")
+                    logger.error(exception)
+                    yield sse_event("error", {
+                        'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        'type'      : "string",
+                        'message'   : "Could not send prompt to GPT. Something went wrong."
+                    })
+                    return
+
+                time_consumed = float('{:.3f}'.format(time.time() - start_time))
+                state['row'] = analytics_row(
+                    prompt,
+                    decoded_token['user_id'],
+                    result['gpt_response'],
+                    time_consumed,
+                    result['from_cache']
+                )
+                yield sse_event("metadata", {
+                    'status': status.HTTP_200_OK,
+                    **result_payload(prompt, result['gpt_response'], result['from_cache'])
+                })
+
+            return StreamingResponse(
+                events(),
+                media_type  = "text/event-stream",
+                headers     = {'Cache-Control': "no-cache", 'X-Accel-Buffering': "no"},
+                background  = BackgroundTask(save_streamed_analytics, state)
+            )
+
+    except Exception as exception:
+        logger.error("Error: querygpt/stream encountered an error")
+        logger.error(exception)
+
+    return JSONResponse({
+        'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
+        'type'      : "string",
+        'message'   : "Could not send prompt to GPT. Something went wrong."
+    })
+
+
+# Batch evaluation settings
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 16))
+BATCH_MAX_TASKS = int(os.getenv('BATCH_MAX_TASKS', 500))
+
+
+# Helper function to resolve the tasks of a batch
+async def resolve_batch_tasks(query: BatchQuery, max_tasks: int = BATCH_MAX_TASKS) -> tuple[list[GaiaTask], list[str]]:
+    '''Tasks to evaluate, and the requested task_ids that do not exist'''
+
+    if query.task_ids:
+        tasks, missing = [], []
+        for task_id in dict.fromkeys(query.task_ids):
+            task = await async_lookup_task(task_id)
+            if task is None:
+                missing.append(task_id)
             else:
+                tasks.append(task)
+        return tasks, missing
 
-                # Let GPT know the previous response was incorrect
-                rectification = rectification_helper()
-                restriction = generate_restriction(prompt['message']['final_answer'])
-                full_question = f"{rectification} Question: {prompt['message']['question']} Steps: {query.updated_steps} {restriction}".strip()
+    if not prompt_catalog.loaded:
+        await run_in_threadpool(prompt_catalog.refresh)
 
-            # Prepare the message to send to GPT-4o
-            messages = [
-                {"role": "system", "content": "You are a helpful assistant that obeys the instructions given and provides the correct answers for any questions provided."},
-                {"role": "user", "content": full_question}
-            ]
+    tasks = prompt_catalog.query(
+        dataset_type    = query.dataset_type,
+        level           = query.level,
+        limit           = query.limit or max_tasks + 1
+    )
+    return tasks, []
 
 
-            # Prepare file parsing if available
-            file_name = prompt['message']['file_name']
-            file_content = None
-            content_available = False
+# Helper function to run a batch and stream its results
+async def run_batch(tasks: list[GaiaTask], missing: list[str], service: str, user_id: int, concurrency: int):
+    '''Evaluate tasks concurrently, yielding one NDJSON line per task as it completes.
 
-            # Download the files if they are not already available
-            if not os.path.exists(os.getenv('DOWNLOAD_DIR')):
-                content_available = download_files_from_gcs()
+    Each prompt is charged to the user's token bucket, tasks over the
+    quota answer 429. The analytics rows are queued for the write-behind
+    writer together once the batch ends, or the client goes away. The
+    last line is a summary.
+    '''
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(task: GaiaTask) -> tuple[Optional[dict[str, Any]], dict[str, Any]]:
+        async with semaphore:
+            try:
+                row, result = await evaluate(task, service, user_id)
+                result.pop('file_content', None)
+                return row, {'status': status.HTTP_200_OK, **result}
+
+            except RateLimited as limited:
+                retry_after = math.ceil(limited.retry_after)
+                logger.info(f"INTERNAL - querygpt/batch rate limited {task.task_id} for {retry_after}s")
+                return None, {
+                    'status'        : status.HTTP_429_TOO_MANY_REQUESTS,
+                    'task_id'       : task.task_id,
+                    'retry_after'   : retry_after,
+                    'message'       : f"Too many prompt tokens sent. Please retry in {retry_after} seconds."
+                }
+
+            except Exception as exception:
+                logger.error(f"Error: querygpt/batch could not evaluate {task.task_id}")
+                logger.error(exception)
+                return None, {
+                    'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    'task_id'   : task.task_id,
+                    'message'   : "Could not send prompt to GPT. Something went wrong."
+                }
+
+    summary = {'total': len(tasks) + len(missing), 'succeeded': 0, 'failed': 0, 'correct': 0, 'not_found': len(missing), 'rate_limited': 0}
+    running = [asyncio.create_task(run_one(task)) for task in tasks]
+    rows: list[dict[str, Any]] = []
+
+    try:
+        for task_id in missing:
+            yield json.dumps({'status': status.HTTP_404_NOT_FOUND, 'task_id': task_id, 'message': "Task not found"}) + "\n"
+
+        for next_done in asyncio.as_completed(running):
+            row, result = await next_done
+
+            if result['status'] == status.HTTP_429_TOO_MANY_REQUESTS:
+                summary['rate_limited'] += 1
+            elif row is None:
+                summary['failed'] += 1
             else:
-                content_available = True
-
-            if content_available:
-                if file_name is not None: 
-
-                    file_path = os.path.join(os.getcwd(), os.getenv('DOWNLOAD_DIR'), file_name)
-
-                    if file_name.lower().endswith(('.png', '.jpg')):
-
-                        # Encode the image to Base64
-                        with open(file_path, "rb") as image_file:
-                            file_content = base64.b64encode(image_file.read()).decode('utf-8')
-                        
-                        messages.append({
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": "Here's the image related to the question:"},
-                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{file_content}"}}
-                            ]
-                        })
-
-                    elif file_name.lower().endswith(('.mp3')):
-
-                        audio_file= open(file_path, "rb")
-                        try:
-                            
-                            logger.info("WHISPER - Sending a audio transcription request")
-                            file_content = openai_client.audio.transcriptions.create(
-                                model = "whisper-1", 
-                                file = audio_file,
-                                response_format = "text"
-                            )
-
-                            if file_content is not None:
-                                messages.append({
-                                    "role": "user",
-                                    "content": f"Here's the transcription of the audio file related to the question: \n {file_content}"
-                                })
-                        
-                        except Exception as exception:
-                            logger.error("Error: WHISPER - querygpt() encountered an error")
-
-
-                    elif file_name.lower().endswith(('.pdf', '.txt', '.xlsx', '.csv', '.jsonld', '.docx', '.py')):
-                        
-                        # Parse the files
-                        file_content = extract_file_content(
-                            file_path, 
-                            extraction_service,
-                            prompt['message']['task_id']
-                        )
-
-                        if file_content is not None:
-                            messages.append({
-                                "role": "user",
-                                "content": f"Here's the content of the file related to the question: \n\n {file_content}"
-                            })
-
-            # Calculate the tokens and cost
-            token_count = 0
-
-
-            for msg in messages:
-                if isinstance(msg['content'], str):
-                    token_count += count_tokens(msg['content'])
-                else:
-                    token_count += count_tokens(msg['content'][0]['text'])
-                    token_count += count_tokens(file_content) if file_content is not None else 0
-
-            file_token_count = count_tokens(file_content) if file_content is not None else 0
-            cost = token_count * 0.000005
-            cost = float('{:.4f}'.format(cost))
-
-            # Record the time
-            start_time = time.time()
-
-            # Send question to GPT
-            logger.info("GPT - Sending a ChatCompletion request")
-            response = openai_client.chat.completions.create(
-                model = "gpt-4o",
-                temperature = 1,
-                messages = messages
-            )
+                summary['succeeded'] += 1
+                summary['correct'] += int(result['correct'])
+                rows.append(row)
+
+            yield json.dumps(result, default=json_serial) + "\n"
 
-            logger.info("GPT - ChatCompletion request complete")
+        yield json.dumps({'status': status.HTTP_200_OK, 'summary': summary}) + "\n"
 
-            time_consumed = time.time() - start_time
-            time_consumed = float('{:.3f}'.format(time_consumed))
-            gpt_response = response.choices[0].message.content
+    finally:
 
-            # Get the user_id from the token
-            decoded_token = decode_jwt_token(token)
+        # Stop the remaining tasks if the client went away, keep what was answered
+        for job in running:
+            job.cancel()
 
-            # Save to analytics table
-            response_data = {
-                "user_id"                   : decoded_token['user_id'],
-                "task_id"                   : prompt['message']['task_id'],
-                "gpt_response"              : gpt_response,
-                "tokens_per_text_prompt"    : token_count,
-                "tokens_per_attachment"     : file_token_count,
-                'total_cost'                : cost,
-                'time_consumed'             : time_consumed,
-                'extraction_service'        : extraction_service if file_name is not None and file_name.endswith('.pdf') else None
+        await async_insert_analytics(rows)
+
+
+# Route for evaluating many tasks at once
+@app.post("/querygpt/batch",
+    responses       = {
+        400: {"description": "Neither task_ids nor a filter was given"},
+        401: {"description": "Invalid or expired token"},
+        403: {"description": "Insufficient permissions"},
+        200: {"description": "Streams one NDJSON line per task as it completes, then a summary line"}
+    }
+)
+async def query_gpt_batch(
+    query: BatchQuery,
+    decoded_token: dict[str, Any] = Depends(verified_claims)
+) -> Response:
+    '''Evaluate a list of task_ids, or every task matching a dataset_type/level filter'''
+
+    logger.info("POST - /querygpt/batch request received")
+
+    if not query.task_ids and query.dataset_type is None and query.level is None:
+        return JSONResponse(
+            status_code = status.HTTP_400_BAD_REQUEST,
+            content     = {
+                'status'    : status.HTTP_400_BAD_REQUEST,
+                'type'      : "string",
+                'message'   : "Provide task_ids, or a dataset_type and/or level filter"
             }
+        )
 
-            if (query.updated_steps is not None) or (query.updated_steps != ''):
-                response_data["updated_steps"] = query.updated_steps
+    try:
+        tasks, missing = await resolve_batch_tasks(query)
 
-            if update_analytics(response_data):
-                logger.info("INTERNAL - analytics data saved to database")
-            else:
-                logger.error("INTERNAL - Failed to save analytics data to database")
-
-            json_response = {
-                "status"                : status.HTTP_200_OK,
-                "task_id"               : prompt['message']['task_id'],
-                "question"              : full_question,
-                "level"                 : prompt['message']['level'],
-                "final_answer"          : prompt['message']['final_answer'],
-                "file_name"             : prompt['message']['file_name'],
-                "file_content"          : file_content,
-                "token_count"           : token_count,
-                "file_tokens"           : file_token_count,
-                "total_cost"            : cost,
-                "gpt_response"          : gpt_response,
-                'extraction_service'    : extraction_service if file_name is not None and file_name.endswith('.pdf') else None
+    except DatabaseUnavailable:
+        return JSONResponse(
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+            content     = {
+                'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type'      : "string",
+                'message'   : "Database is unavailable"
+            }
+        )
+
+    if len(tasks) + len(missing) > BATCH_MAX_TASKS:
+        return JSONResponse(
+            status_code = status.HTTP_400_BAD_REQUEST,
+            content     = {
+                'status'    : status.HTTP_400_BAD_REQUEST,
+                'type'      : "string",
+                'message'   : f"A batch can hold at most {BATCH_MAX_TASKS} tasks"
             }
+        )
+
+    concurrency = min(query.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+
+    return StreamingResponse(
+        run_batch(tasks, missing, extraction_service_name(query.service), decoded_token['user_id'], concurrency),
+        media_type = "application/x-ndjson"
+    )
+
+
+# Largest job accepted by /jobs
+JOB_MAX_TASKS = int(os.getenv('JOB_MAX_TASKS', 5000))
+
+
+# Route for submitting an evaluation job
+@app.post("/jobs",
+    responses       = {
+        400: {"description": "Neither task_ids nor a filter was given"},
+        401: {"description": "Invalid or expired token"},
+        403: {"description": "Insufficient permissions"},
+        200: {"description": "Returns the job_id of the queued job"}
+    }
+)
+async def submit_job(
+    query: JobRequest,
+    decoded_token: dict[str, Any] = Depends(verified_claims)
+) -> JSONResponse:
+    '''Queue an evaluation job, processed in the background by the workers (worker.py)'''
 
-            # Get the annotation and append it to the json response
-            logger.info(f"INTERNAL - Fetching annotation for task_id {prompt['message']['task_id']}")
-            annotation = getannotation(prompt['message']['task_id'])
-            annotation = json.loads(annotation.body)
+    logger.info("POST - /jobs request received")
 
-            if annotation["status"] == status.HTTP_200_OK:
-                json_response["annotation_steps"] = annotation["message"]
+    if not query.task_ids and query.dataset_type is None and query.level is None:
+        return JSONResponse(
+            status_code = status.HTTP_400_BAD_REQUEST,
+            content     = {
+                'status'    : status.HTTP_400_BAD_REQUEST,
+                'type'      : "string",
+                'message'   : "Provide task_ids, or a dataset_type and/or level filter"
+            }
+        )
 
-            return JSONResponse(content=json_response)
+    try:
+        tasks, missing = await resolve_batch_tasks(query, JOB_MAX_TASKS)
+
+        if not tasks or len(tasks) > JOB_MAX_TASKS:
+            return JSONResponse(
+                status_code = status.HTTP_400_BAD_REQUEST,
+                content     = {
+                    'status'    : status.HTTP_400_BAD_REQUEST,
+                    'type'      : "string",
+                    'message'   : f"A job must hold between 1 and {JOB_MAX_TASKS} existing tasks"
+                }
+            )
+
+        job_id = await run_in_threadpool(
+            create_job,
+            decoded_token['user_id'],
+            [task.task_id for task in tasks],
+            extraction_service_name(query.service),
+            query.model or GPT_MODEL
+        )
+
+        return JSONResponse({
+            'status'    : status.HTTP_200_OK,
+            'type'      : "json",
+            'message'   : {
+                'job_id'        : job_id,
+                'total_tasks'   : len(tasks),
+                'not_found'     : missing
+            }
+        })
+
+    except DatabaseUnavailable:
+        return JSONResponse(
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+            content     = {
+                'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type'      : "string",
+                'message'   : "Database is unavailable"
+            }
+        )
 
     except Exception as exception:
-        logger.error("Error: querygpt() encountered an error")
+        logger.error("Error: submit_job() encountered an error")
         logger.error(exception)
 
     return JSONResponse({
         'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
         'type'      : "string",
-        'message'   : "Could not send prompt to GPT. Something went wrong."
+        'message'   : "Could not submit the job. Something went wrong."
+    })
+
+
+# Helper function to load a job owned by the caller
+def owned_job(job_id: int, user_id: int) -> Optional[dict[str, Any]]:
+    job = get_job(job_id)
+    if job is None or job['user_id'] != user_id:
+        return None
+    return job
+
+
+# Route for polling an evaluation job
+@app.get("/jobs/{job_id}",
+    responses       = {
+        401: {"description": "Invalid or expired token"},
+        404: {"description": "Job not found"},
+        200: {"description": "Returns the job status, its progress and per-task results"}
+    }
+)
+def poll_job(
+    job_id: int,
+    decoded_token: dict[str, Any] = Depends(verified_claims)
+) -> Response:
+    '''Report the progress of one of the caller's jobs'''
+
+    logger.info(f"GET - /jobs/{job_id} request received")
+
+    try:
+        job = owned_job(job_id, decoded_token['user_id'])
+
+    except DatabaseUnavailable:
+        return JSONResponse(
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+            content     = {
+                'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type'      : "string",
+                'message'   : "Database is unavailable"
+            }
+        )
+
+    if job is None:
+        return JSONResponse(
+            status_code = status.HTTP_404_NOT_FOUND,
+            content     = {
+                'status'    : status.HTTP_404_NOT_FOUND,
+                'type'      : "string",
+                'message'   : f"Job {job_id} not found"
+            }
+        )
+
+    return Response(
+        content     = json.dumps({
+            'status'    : status.HTTP_200_OK,
+            'type'      : "json",
+            'message'   : job
+        }, default=json_serial),
+        media_type  = "application/json"
+    )
+
+
+# Route for cancelling an evaluation job
+@app.delete("/jobs/{job_id}",
+    responses       = {
+        401: {"description": "Invalid or expired token"},
+        404: {"description": "Job not found"},
+        200: {"description": "Cancels the job, tasks already running are allowed to finish"}
+    }
+)
+def delete_job(
+    job_id: int,
+    decoded_token: dict[str, Any] = Depends(verified_claims)
+) -> JSONResponse:
+    '''Cancel one of the caller's jobs'''
+
+    logger.info(f"DELETE - /jobs/{job_id} request received")
+
+    try:
+        if owned_job(job_id, decoded_token['user_id']) is None:
+            return JSONResponse(
+                status_code = status.HTTP_404_NOT_FOUND,
+                content     = {
+                    'status'    : status.HTTP_404_NOT_FOUND,
+                    'type'      : "string",
+                    'message'   : f"Job {job_id} not found"
+                }
+            )
+
+        cancelled = cancel_job(job_id)
+
+    except DatabaseUnavailable:
+        return JSONResponse(
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+            content     = {
+                'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type'      : "string",
+                'message'   : "Database is unavailable"
+            }
+        )
+
+    return JSONResponse({
+        'status'    : status.HTTP_200_OK,
+        'type'      : "string",
+        'message'   : f"Job {job_id} cancelled" if cancelled else f"Job {job_id} had already finished"
     })
 
 
@@ -1035,30 +1491,31 @@ async def query_gpt(
         403: {"description": "Insufficient permissions"},
         200: {"description": "Records the user's feedback for GPT's performance for task_id"}
 })
-def feedback(
+async def feedback(
     data: Feedback,
-    token: str = Depends(verify_token)
-) -> dict[str, Any]:
+    decoded_token: dict[str, Any] = Depends(verified_claims)
+) -> JSONResponse:
     '''Save the user's feedback for GPT's response for the task_id'''
 
     logger.info(f"POST - /feedback/{data.task_id} request received")
 
-    conn = create_connection()
+    # The answer being rated may still be queued
+    await run_in_threadpool(analytics_writer.flush)
 
-    if conn is None:
-        return JSONResponse({
-            'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
-            'type'      : "string",
-            'message'   : "Database not found :("
-        })
+    async with async_connection() as conn:
+
+        if conn is None:
+            return JSONResponse({
+                'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type'      : "string",
+                'message'   : "Database not found :("
+            })
 
-    if conn and conn.is_connected():
-        with conn.cursor(dictionary = True) as cursor:
+        async with conn.cursor(DictCursor) as cursor:
             try:
 
                 # Update the analytics and save the feedback
 
-                decoded_token = decode_jwt_token(token)
                 logger.info("SQL - Running an UPDATE statement")
 
                 query = """
@@ -1069,8 +1526,8 @@ def feedback(
                 WHERE a.user_id = %s AND a.task_id = %s
                 """
 
-                cursor.execute(query, (data.feedback, decoded_token['user_id'], data.task_id))
-                conn.commit()
+                await cursor.execute(query, (data.feedback, decoded_token['user_id'], data.task_id))
+                await conn.commit()
                 logger.info("SQL - UPDATE statement complete")
                 response = {
                     'status'    : status.HTTP_200_OK,
@@ -1086,66 +1543,145 @@ def feedback(
                     'type'      : "string",
                     'message'   : "Could not save feedback. Something went wrong."
                 }
-                
-            finally:
+
+    return JSONResponse(content=response)
+
+
+# Page sizes for /analytics
+ANALYTICS_PAGE_SIZE = int(os.getenv('ANALYTICS_PAGE_SIZE', 100))
+ANALYTICS_MAX_PAGE_SIZE = int(os.getenv('ANALYTICS_MAX_PAGE_SIZE', 1000))
+
+
+def build_analytics_query(filters: AnalyticsQuery, limit: Optional[int]) -> tuple[str, list[Any]]:
+    '''Build the keyset-paginated analytics query for the given filters'''
+
+    conditions = []
+    params: list[Any] = []
+
+    if filters.after_id is not None:
+        conditions.append("atx.id > %s")
+        params.append(filters.after_id)
+    if filters.user_id is not None:
+        conditions.append("atx.user_id = %s")
+        params.append(filters.user_id)
+    if filters.task_id is not None:
+        conditions.append("atx.task_id = %s")
+        params.append(filters.task_id)
+    if filters.service is not None:
+        conditions.append("atx.extraction_service = %s")
+        params.append(filters.service)
+    if filters.start_date is not None:
+        conditions.append("atx.time_stamp >= %s")
+        params.append(filters.start_date)
+    if filters.end_date is not None:
+        conditions.append("atx.time_stamp < %s")
+        params.append(filters.end_date)
+    if filters.correct is True:
+        conditions.append("atx.marked_correct = 1")
+    elif filters.correct is False:
+        conditions.append("(atx.marked_correct IS NULL OR atx.marked_correct <> 1)")
+
+    query = """
+    SELECT atx.id, gfeat.*, atx.user_id, atx.updated_steps, atx.tokens_per_text_prompt, 
+           atx.tokens_per_attachment, atx.gpt_response, atx.total_cost, 
+           atx.time_consumed, atx.feedback, atx.time_stamp, atx.extraction_service,
+           atx.marked_correct, afeat.time_taken
+    FROM analytics AS atx
+    JOIN gaia_features AS gfeat ON gfeat.task_id = atx.task_id
+    JOIN gaia_annotations AS afeat ON afeat.task_id = atx.task_id
+    """
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY atx.id ASC"
+
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    return query, params
+
+
+async def stream_analytics(filters: AnalyticsQuery):
+    '''Yield analytics rows as NDJSON, reading them from a server-side cursor'''
+
+    query, params = build_analytics_query(filters, filters.limit)
+
+    async with async_connection() as conn:
+
+        if conn is None:
+            yield json.dumps({
+                'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type'      : "string",
+                'message'   : "Database not found :("
+            }) + "\n"
+            return
+
+        completed = False
+        cursor = await conn.cursor(SSDictCursor)
+        try:
+            await cursor.execute(query, params)
+
+            while True:
+                rows = await cursor.fetchmany(500)
+                if not rows:
+                    break
+                yield "".join(json.dumps(row, default=json_serial) + "\n" for row in rows)
+
+            await cursor.close()
+            completed = True
+
+        except Exception as exception:
+            logger.error("Error: stream_analytics() encountered an error")
+            logger.error(exception)
+
+        finally:
+            # Unread rows would have to be drained first, drop the connection instead
+            if not completed:
                 conn.close()
-                logger.info("Database - Connection to the database was closed")
-    
-        return JSONResponse(content=response)
 
 
 # Route for analytics
 @app.get("/analytics",
-    response_class  = JSONResponse,
     responses       = {
         401: {"description": "Invalid or expired token"},
         403: {"description": "Insufficient permissions"},
-        200: {"description": "Returns all available data about a task_id"}
+        200: {"description": "Returns a page of analytics rows, or every matching row as NDJSON"}
     }
 )
 async def get_analytics(
+    filters: AnalyticsQuery = Depends(),
     token: str = Depends(verify_token)
-) -> JSONResponse:
+) -> Response:
+    '''Fetch analytics rows filtered by user, task, service, date range and correctness'''
+
     logger.info("GET - /analytics request received")
-    conn = create_connection()
 
-    if conn is None:
-        return JSONResponse({
-            'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
-            'type'      : "string",
-            'message'   : "Database not found :("
-        })
+    # Stream every matching row without holding them in memory
+    if filters.format == AnalyticsFormat.NDJSON:
+        return StreamingResponse(stream_analytics(filters), media_type="application/x-ndjson")
 
-    if conn and conn.is_connected():
-        with conn.cursor(dictionary=True) as cursor:
+    limit = min(filters.limit or ANALYTICS_PAGE_SIZE, ANALYTICS_MAX_PAGE_SIZE)
+    query, params = build_analytics_query(filters, limit)
+
+    async with async_connection() as conn:
+
+        if conn is None:
+            return JSONResponse({
+                'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type'      : "string",
+                'message'   : "Database not found :("
+            })
+
+        async with conn.cursor(DictCursor) as cursor:
             try:
-                query = """
-                SELECT gfeat.*, atx.user_id, atx.updated_steps, atx.tokens_per_text_prompt, 
-                       atx.tokens_per_attachment, atx.gpt_response, atx.total_cost, 
-                       atx.time_consumed, atx.feedback, atx.time_stamp, afeat.time_taken
-                FROM analytics atx, gaia_features gfeat, gaia_annotations afeat
-                WHERE atx.task_id = gfeat.task_id AND atx.task_id = afeat.task_id
-                """
-                cursor.execute(query)
-                results = cursor.fetchall()
-
-                # Process the results to ensure they are JSON serializable
-                processed_results = []
-                for row in results:
-                    processed_row = {}
-                    for key, value in row.items():
-                        if isinstance(value, (int, float, str, type(None))):
-                            processed_row[key] = value
-                        elif isinstance(value, (datetime.date, datetime.datetime)):
-                            processed_row[key] = value.isoformat()
-                        else:
-                            processed_row[key] = str(value)
-                    processed_results.append(processed_row)
+                await cursor.execute(query, params)
+                results = await cursor.fetchall()
 
                 response = {
-                    'status'    : status.HTTP_200_OK,
-                    'type'      : "json",
-                    'message'   : processed_results
+                    'status'        : status.HTTP_200_OK,
+                    'type'          : "json",
+                    'message'       : results,
+                    'next_cursor'   : results[-1]['id'] if len(results) == limit else None
                 }
 
             except Exception as exception:
@@ -1154,14 +1690,10 @@ async def get_analytics(
                 response = {
                     'status'    : status.HTTP_500_INTERNAL_SERVER_ERROR,
                     'type'      : "string",
-                    'message'   : "Could not save feedback. Something went wrong."
+                    'message'   : "Could not fetch the analytics. Something went wrong."
                 }
-            
-            finally:
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
-        
-        return JSONResponse(content=response)
+
+    return Response(content=json.dumps(response, default=json_serial), media_type="application/json")
     
 
 # Route to manually mark GPT's response as correct
@@ -1180,17 +1712,20 @@ async def markcorrect(
     '''Manually mark GPT's response for a prompt as correct'''
 
     logger.info("POST - /markcorrect request received")
-    conn = create_connection()
 
-    if conn is None:
-        return JSONResponse({
-            'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
-            'type'      : "string",
-            'message'   : "Database not found :("
-        })
+    # The answer being marked may still be queued
+    await run_in_threadpool(analytics_writer.flush)
+
+    async with async_connection() as conn:
+
+        if conn is None:
+            return JSONResponse({
+                'status'    : status.HTTP_503_SERVICE_UNAVAILABLE,
+                'type'      : "string",
+                'message'   : "Database not found :("
+            })
 
-    if conn and conn.is_connected():
-        with conn.cursor(dictionary=True) as cursor:
+        async with conn.cursor(DictCursor) as cursor:
             try:
 
                 last_id_query = """
@@ -1200,8 +1735,8 @@ async def markcorrect(
                 """
                 logger.info("SQL - markcorrect() - Running a SELECT statement")
 
-                cursor.execute(last_id_query, (query.task_id,))
-                last_id = cursor.fetchone()
+                await cursor.execute(last_id_query, (query.task_id,))
+                last_id = await cursor.fetchone()
                 logger.info("SQL - markcorrect() - SELECT statement complete")
 
                 update_query = """
@@ -1211,8 +1746,8 @@ async def markcorrect(
                 """
                 logger.info("SQL - markcorrect() - Running an UPDATE statement")
 
-                cursor.execute(update_query, (last_id['id'],))
-                conn.commit()
+                await cursor.execute(update_query, (last_id['id'],))
+                await conn.commit()
                 logger.info("SQL - markcorrect() - UPDATE statement complete")
 
                 response = {
@@ -1229,11 +1764,7 @@ async def markcorrect(
                     'type'      : "string",
                     'message'   : "Could not mark the response as correct. Something went wrong."
                 }
-            
-            finally:
-                conn.close()
-                logger.info("Database - Connection to the database was closed")
 
-        return JSONResponse(content=response)
+    return JSONResponse(content=response)
 
 # ====================== Application service : End ======================
\ No newline at end of file
@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# Prefix of every exported metric
+METRIC_PREFIX = "llmcognition"
+
+# Latency buckets in seconds, from a cache hit to a slow GPT answer
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    '''Base class of the metrics: a name, a help text and labelled values'''
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = f"{METRIC_PREFIX}_{name}"
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: dict[str, Any]) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> dict[str, Any]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> Iterator[tuple[str, dict[str, Any], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    '''A value that only goes up'''
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[tuple[str, dict[str, Any], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, self._labels(key), value
+
+
+class Gauge(Counter):
+    '''A value that goes up and down'''
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    '''Distribution of observed values over fixed buckets'''
+
+    kind = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+        # labels -> (count per bucket, sum, count)
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        '''Observe the duration of the block, even when it raises'''
+
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, Any], float]]:
+        with self._lock:
+            values = [(key, list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()]
+
+        for key, bucket_counts, total, count in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, 'le': _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+registry: list[Metric] = []
+
+# Snapshot functions (pool, cache, catalog, ... stats) exported as gauges on each scrape
+collectors: dict[str, Callable[[], dict[str, Any]]] = {}
+
+
+def register_collector(prefix: str, collect: Callable[[], dict[str, Any]]) -> None:
+    collectors[prefix] = collect
+
+
+def _flatten(prefix: str, values: dict[str, Any]) -> Iterator[tuple[str, float]]:
+    '''Numeric values of a (nested) stats dict, strings are skipped'''
+
+    for key, value in values.items():
+        name = re.sub(r'[^a-zA-Z0-9_]', '_', f"{prefix}_{key}")
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (bool, int, float)):
+            yield name, float(value)
+
+
+def render_metrics() -> str:
+    '''Every metric in the Prometheus text exposition format'''
+
+    blocks = [metric.render() for metric in registry]
+
+    for prefix, collect in list(collectors.items()):
+        try:
+            for name, value in _flatten(f"{METRIC_PREFIX}_{prefix}", collect()):
+                blocks.append(f"# TYPE {name} gauge\n{name} {_format_value(value)}")
+        except Exception as exception:
+            logger.error(f"Error: metrics collector {prefix} failed")
+            logger.error(exception)
+
+    return "\n".join(blocks) + "\n"
+
+
+# ============================= Application metrics =============================
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests by route, method and status code", ("route", "method", "status")
+)
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("route", "method")
+)
+http_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests being processed by route", ("route",)
+)
+stage_seconds = Histogram(
+    "stage_duration_seconds", "Time spent in each stage of a request", ("stage",)
+)
+upstream_errors = Counter(
+    "upstream_errors_total", "OpenAI call errors by exception type", ("kind",)
+)
+upstream_retries = Counter(
+    "upstream_retries_total", "OpenAI calls retried after a transient error"
+)
+cpu_queue_depth = Gauge(
+    "cpu_queue_depth", "CPU-bound jobs waiting for a free executor worker"
+)
+cpu_in_flight = Gauge(
+    "cpu_in_flight", "CPU-bound jobs running on the executor"
+)
+cpu_queue_seconds = Histogram(
+    "cpu_queue_seconds", "Time CPU-bound jobs waited for an executor worker", ("stage",)
+)
+admission_queue_depth = Gauge(
+    "admission_queue_depth", "Requests waiting to be admitted by route class", ("route_class",)
+)
+admission_queue_seconds = Histogram(
+    "admission_queue_seconds", "Time requests waited to be admitted by route class", ("route_class",)
+)
+admission_rejected = Counter(
+    "admission_rejected_total", "Requests shed with HTTP 503 by route class and reason", ("route_class", "reason")
+)
+
+
+def span(stage: str):
+    '''Time one stage of a request (db, prompt, gcs, parse, tokenize, gpt, analytics, ...)'''
+
+    return stage_seconds.time(stage = stage)
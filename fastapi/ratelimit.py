@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from dotenv import load_dotenv
+from typing import Any
+from starlette.concurrency import run_in_threadpool
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# Prompt tokens a user may send per minute, and the burst allowed on top (0 disables the limit)
+RATE_LIMIT_TOKENS_PER_MINUTE = float(os.getenv('RATE_LIMIT_TOKENS_PER_MINUTE', 60000))
+RATE_LIMIT_BURST_TOKENS = float(os.getenv('RATE_LIMIT_BURST_TOKENS', 120000))
+
+# Where the buckets and usage counters are saved, and how often
+RATE_LIMIT_STATE_FILE = os.getenv('RATE_LIMIT_STATE_FILE', "rate_limits.json")
+RATE_LIMIT_PERSIST_SECONDS = float(os.getenv('RATE_LIMIT_PERSIST_SECONDS', 60))
+
+
+class RateLimited(Exception):
+    '''Raised when a user has run out of prompt tokens'''
+
+    def __init__(self, user_id: Any, retry_after: float) -> None:
+        super().__init__(f"User {user_id} rate limited for {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    '''Per-user token buckets weighted by prompt tokens.
+
+    Each user's bucket holds up to capacity tokens and refills at rate
+    tokens per second. A request is charged its prompt token count, so
+    a large attachment costs more than a short question. A prompt larger
+    than the whole bucket is allowed once the bucket is full, otherwise
+    it could never be sent.
+
+    Buckets live in the memory of one process: with several API workers
+    (or a job worker) each process enforces the limit on its own, and
+    each needs its own state_file. An empty state_file disables saving.
+    '''
+
+    def __init__(self, tokens_per_minute: float, capacity: float, state_file: str) -> None:
+        self.rate = tokens_per_minute / 60
+        self.capacity = capacity
+        self.state_file = state_file
+        self._lock = threading.Lock()
+
+        # user_id -> [tokens left, last refill as a UNIX timestamp]
+        self._buckets: dict[str, list[float]] = {}
+
+        # user_id -> {'requests', 'tokens', 'limited'}
+        self.usage: dict[str, dict[str, int]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 and self.capacity > 0
+
+    def _refill(self, user_id: str, now: float) -> list[float]:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [self.capacity, now]
+        else:
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def acquire(self, user_id: Any, tokens: int) -> float:
+        '''Charge a request to a user, returns 0 if it is allowed or the seconds to wait'''
+
+        if not self.enabled:
+            return 0
+
+        user_id = str(user_id)
+        cost = min(float(tokens), self.capacity)
+
+        with self._lock:
+            bucket = self._refill(user_id, time.time())
+            usage = self.usage.setdefault(user_id, {'requests': 0, 'tokens': 0, 'limited': 0})
+
+            if bucket[0] < cost:
+                usage['limited'] += 1
+                return (cost - bucket[0]) / self.rate
+
+            bucket[0] -= cost
+            usage['requests'] += 1
+            usage['tokens'] += int(tokens)
+            return 0
+
+    def charge(self, user_id: Any, tokens: int) -> None:
+        '''Like acquire(), but raises RateLimited instead of returning a wait'''
+
+        retry_after = self.acquire(user_id, tokens)
+        if retry_after > 0:
+            raise RateLimited(user_id, retry_after)
+
+    def load(self) -> None:
+        '''Restore the buckets and usage saved by a previous run'''
+
+        if not self.state_file:
+            return
+
+        try:
+            with open(self.state_file, 'r') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        with self._lock:
+            self._buckets = {user_id: list(bucket) for user_id, bucket in state.get('buckets', {}).items()}
+            self.usage = state.get('usage', {})
+        logger.info(f"INTERNAL - Rate limits restored for {len(self._buckets)} user(s)")
+
+    def save(self) -> None:
+        '''Write the buckets and usage atomically'''
+
+        if not self.state_file:
+            return
+
+        with self._lock:
+            snapshot = {
+                'buckets'   : {user_id: list(bucket) for user_id, bucket in self._buckets.items()},
+                'usage'     : {user_id: dict(usage) for user_id, usage in self.usage.items()}
+            }
+
+        temp_path = f"{self.state_file}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w') as file:
+                json.dump(snapshot, file)
+            os.replace(temp_path, self.state_file)
+        except OSError as exception:
+            logger.error("Error: TokenBucketLimiter could not save its state")
+            logger.error(exception)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                'users'     : len(self._buckets),
+                'requests'  : sum(usage['requests'] for usage in self.usage.values()),
+                'tokens'    : sum(usage['tokens'] for usage in self.usage.values()),
+                'limited'   : sum(usage['limited'] for usage in self.usage.values())
+            }
+
+
+rate_limiter = TokenBucketLimiter(RATE_LIMIT_TOKENS_PER_MINUTE, RATE_LIMIT_BURST_TOKENS, RATE_LIMIT_STATE_FILE)
+
+
+async def persist_rate_limits_periodically() -> None:
+    '''Background task saving the buckets every RATE_LIMIT_PERSIST_SECONDS'''
+
+    while True:
+        await asyncio.sleep(RATE_LIMIT_PERSIST_SECONDS)
+        await run_in_threadpool(rate_limiter.save)
@@ -0,0 +1,161 @@
+import os
+import logging
+from aiomysql import DictCursor
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from typing import Optional, Any
+
+# Custom libraries
+from database import get_connection, async_connection
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+
+class DatabaseUnavailable(Exception):
+    '''Raised when no database connection could be obtained'''
+
+
+class GaiaTask(BaseModel):
+    '''A GAIA prompt (gaia_features) joined with its annotation (gaia_annotations)'''
+
+    task_id: str
+    dataset_type: Optional[str] = None
+    question: Optional[str] = None
+    level: Optional[int] = None
+    final_answer: Optional[str] = None
+    file_name: Optional[str] = None
+    steps: Optional[str] = None
+
+    @property
+    def annotation_steps(self) -> Optional[str]:
+        '''Annotation steps with the final answer masked out'''
+
+        if self.steps is None:
+            return None
+        if not self.final_answer:
+            return self.steps
+        return self.steps.replace(self.final_answer, '_')
+
+    def prompt(self) -> dict[str, Any]:
+        '''The fields returned by /loadprompt'''
+
+        return {
+            'task_id'       : self.task_id,
+            'question'      : self.question,
+            'level'         : self.level,
+            'final_answer'  : self.final_answer,
+            'file_name'     : self.file_name
+        }
+
+
+# Question, level, final answer, file name and steps in a single query
+TASK_COLUMNS = """
+    gfeat.task_id, gfeat.dataset_type, gfeat.question, gfeat.level,
+    gfeat.final_answer, gfeat.file_name, gann.steps AS steps
+"""
+
+TASK_QUERY = f"""
+SELECT {TASK_COLUMNS}
+FROM gaia_features AS gfeat
+LEFT JOIN gaia_annotations AS gann ON gann.task_id = gfeat.task_id
+WHERE gfeat.task_id = %s
+"""
+
+ALL_TASKS_QUERY = f"""
+SELECT {TASK_COLUMNS}
+FROM gaia_features AS gfeat
+LEFT JOIN gaia_annotations AS gann ON gann.task_id = gfeat.task_id
+"""
+
+LIST_TASKS_QUERY = f"""
+SELECT {TASK_COLUMNS}
+FROM gaia_features AS gfeat
+LEFT JOIN gaia_annotations AS gann ON gann.task_id = gfeat.task_id
+WHERE gfeat.dataset_type = %s AND gfeat.file_name LIKE %s
+LIMIT %s
+"""
+
+
+def get_task(task_id: str) -> Optional[GaiaTask]:
+    '''Load a task and its annotation, None if the task_id does not exist'''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor(dictionary = True) as cursor:
+            logger.info("SQL - get_task() - Running a SELECT statement")
+            cursor.execute(TASK_QUERY, (task_id,))
+            record = cursor.fetchone()
+            logger.info("SQL - get_task() - SELECT statement complete")
+
+    return None if record is None else GaiaTask(**record)
+
+
+def list_tasks(dataset_type: str, count: int, extension: str = ".pdf") -> list[GaiaTask]:
+    '''List up to count tasks of a dataset type whose attachment has the given extension'''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor(dictionary = True) as cursor:
+            logger.info("SQL - list_tasks() - Running a SELECT statement")
+            cursor.execute(LIST_TASKS_QUERY, (dataset_type, f"%{extension}", count))
+            records = cursor.fetchall()
+            logger.info("SQL - list_tasks() - SELECT statement complete")
+
+    return [GaiaTask(**record) for record in records]
+
+
+def load_all_tasks() -> list[GaiaTask]:
+    '''Load every task with its annotation (used to fill the in-memory catalog)'''
+
+    with get_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        with conn.cursor(dictionary = True) as cursor:
+            logger.info("SQL - load_all_tasks() - Running a SELECT statement")
+            cursor.execute(ALL_TASKS_QUERY)
+            records = cursor.fetchall()
+            logger.info("SQL - load_all_tasks() - SELECT statement complete")
+
+    return [GaiaTask(**record) for record in records]
+
+
+async def fetch_task(task_id: str) -> Optional[GaiaTask]:
+    '''Async variant of get_task() for the async routes'''
+
+    async with async_connection() as conn:
+        if conn is None:
+            raise DatabaseUnavailable()
+
+        async with conn.cursor(DictCursor) as cursor:
+            logger.info("SQL - fetch_task() - Running a SELECT statement")
+            await cursor.execute(TASK_QUERY, (task_id,))
+            record = await cursor.fetchone()
+            logger.info("SQL - fetch_task() - SELECT statement complete")
+
+    return None if record is None else GaiaTask(**record)
@@ -0,0 +1,74 @@
+import os
+import sys
+import socket
+import tempfile
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+
+# The app modules are imported flat, as in the Docker image
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('FASTAPI_LOG_FILE', os.path.join(tempfile.gettempdir(), "fastapi_tests.log"))
+os.environ.setdefault('OPENAI_API', "test")
+os.environ.setdefault('FAKE_OPENAI_LATENCY', "0.05")
+
+import fake_openai
+import gpt_client
+from openai import AsyncOpenAI
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def fake_server():
+    '''The fake OpenAI server running in a background thread'''
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(fake_openai.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("The fake OpenAI server did not start")
+        time.sleep(0.01)
+
+    yield f"http://127.0.0.1:{port}"
+
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def upstream(fake_server, monkeypatch):
+    '''gpt_client pointed at a freshly reset fake server, with short backoffs'''
+
+    httpx.post(f"{fake_server}/fake/reset")
+
+    monkeypatch.setattr(gpt_client, "openai_client", AsyncOpenAI(api_key="test", base_url=f"{fake_server}/v1", max_retries=0))
+    monkeypatch.setattr(gpt_client, "limiter", gpt_client.UpstreamLimiter(gpt_client.MAX_CONCURRENCY))
+    monkeypatch.setattr(gpt_client, "MAX_RETRIES", 3)
+    monkeypatch.setattr(gpt_client, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(gpt_client, "BACKOFF_MAX", 1)
+
+    class Upstream:
+        url = fake_server
+
+        @staticmethod
+        def fail(*statuses: int, retry_after=None) -> None:
+            httpx.post(f"{fake_server}/fake/failures", json={'statuses': list(statuses), 'retry_after': retry_after})
+
+        @staticmethod
+        def stats() -> dict:
+            return httpx.get(f"{fake_server}/fake/stats").json()
+
+    return Upstream
@@ -0,0 +1,133 @@
+import time
+import asyncio
+
+import openai
+import pytest
+
+import gpt_client
+
+MESSAGES = [{'role': "user", 'content': "What is the answer?"}]
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    '''Backoff delays picked by gpt_client, in order'''
+
+    picked = []
+
+    def recording_backoff_delay(attempt, exception):
+        delay = backoff_delay(attempt, exception)
+        picked.append((attempt, delay))
+        return delay
+
+    backoff_delay = gpt_client.backoff_delay
+    monkeypatch.setattr(gpt_client, "backoff_delay", recording_backoff_delay)
+    return picked
+
+
+def completion_text(response) -> str:
+    return response.choices[0].message.content
+
+
+@pytest.mark.parametrize("status_code", [429, 500, 503])
+def test_transient_errors_are_retried_with_jitter(upstream, delays, status_code):
+    upstream.fail(status_code, status_code)
+
+    response = asyncio.run(gpt_client.chat_completion(model="gpt-4o", messages=MESSAGES))
+
+    assert completion_text(response) == "42"
+    assert upstream.stats()['requests'] == 3
+    assert gpt_client.limiter.retries == 2
+    assert [attempt for attempt, _ in delays] == [1, 2]
+    for attempt, delay in delays:
+        assert 0 <= delay <= gpt_client.BACKOFF_BASE * 2 ** (attempt - 1)
+
+
+def test_retries_stop_after_max_retries(upstream, delays):
+    upstream.fail(*[503] * (gpt_client.MAX_RETRIES + 1))
+
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(gpt_client.chat_completion(model="gpt-4o", messages=MESSAGES))
+
+    assert upstream.stats()['requests'] == gpt_client.MAX_RETRIES + 1
+    assert gpt_client.limiter.retries == gpt_client.MAX_RETRIES
+    assert gpt_client.limiter.errors == {'InternalServerError': gpt_client.MAX_RETRIES + 1}
+
+
+def test_retry_after_header_is_honoured(upstream, delays):
+    upstream.fail(429, retry_after=0.2)
+
+    asyncio.run(gpt_client.chat_completion(model="gpt-4o", messages=MESSAGES))
+
+    assert delays == [(1, 0.2)]
+
+
+@pytest.mark.parametrize("status_code, error", [
+    (400, openai.BadRequestError),
+    (401, openai.AuthenticationError),
+    (404, openai.NotFoundError)
+])
+def test_client_errors_are_not_retried(upstream, delays, status_code, error):
+    upstream.fail(status_code)
+
+    with pytest.raises(error):
+        asyncio.run(gpt_client.chat_completion(model="gpt-4o", messages=MESSAGES))
+
+    assert upstream.stats()['requests'] == 1
+    assert gpt_client.limiter.retries == 0
+    assert delays == []
+
+
+def test_concurrency_is_capped(upstream, monkeypatch):
+    monkeypatch.setattr(gpt_client, "limiter", gpt_client.UpstreamLimiter(2))
+
+    async def run():
+        return await asyncio.gather(*[
+            gpt_client.chat_completion(model="gpt-4o", messages=MESSAGES) for _ in range(6)
+        ])
+
+    responses = asyncio.run(run())
+
+    assert [completion_text(response) for response in responses] == ["42"] * 6
+    assert upstream.stats()['max_in_flight'] == 2
+    assert gpt_client.limiter.calls == 6
+    assert gpt_client.limiter.queue_time_max > 0
+
+
+def test_stream_is_retried(upstream, delays):
+    upstream.fail(429, 502)
+
+    async def run():
+        return "".join([text async for text in gpt_client.chat_completion_stream(model="gpt-4o", messages=MESSAGES)])
+
+    assert asyncio.run(run()) == "42"
+    assert upstream.stats()['requests'] == 3
+    assert [attempt for attempt, _ in delays] == [1, 2]
+
+
+def test_stream_releases_its_slot_while_backing_off(upstream, monkeypatch):
+    monkeypatch.setattr(gpt_client, "limiter", gpt_client.UpstreamLimiter(1))
+    upstream.fail(429, retry_after=0.5)
+
+    async def run():
+        finished = {}
+
+        async def stream():
+            async for _ in gpt_client.chat_completion_stream(model="gpt-4o", messages=MESSAGES):
+                pass
+            finished['stream'] = time.monotonic()
+
+        async def call():
+            await asyncio.sleep(0.15)
+            await gpt_client.chat_completion(model="gpt-4o", messages=MESSAGES)
+            finished['call'] = time.monotonic()
+
+        await asyncio.gather(stream(), call())
+        return finished
+
+    finished = asyncio.run(run())
+
+    # The other call used the only slot during the stream's backoff
+    assert finished['call'] < finished['stream']
+    assert gpt_client.limiter.in_flight == 0
+    assert upstream.stats()['max_in_flight'] == 1
@@ -0,0 +1,156 @@
+import os
+import socket
+import asyncio
+import logging
+from dotenv import load_dotenv
+from typing import Any
+from starlette.concurrency import run_in_threadpool
+
+# Custom libraries
+from analytics import insert_rows
+from catalog import prompt_catalog, lookup_task
+from evaluation import build_prompt, answer, is_correct
+from ratelimit import rate_limiter
+from jobs import claim_tasks, renew_leases, finish_task, saved_answer, JOB_LEASE_SECONDS
+
+# Load env variables
+load_dotenv()
+
+# ============================= Logger : Begin =============================
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Log to console (dev only)
+if os.getenv('APP_ENV') == "development":
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+# Also log to a file
+file_handler = logging.FileHandler(os.getenv('FASTAPI_LOG_FILE', "fastapi_errors.log"))
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# ============================= Logger : End ===============================
+
+# Tasks evaluated at the same time by one worker process
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 4))
+
+# Seconds to wait before polling again when there is nothing to do
+WORKER_POLL_SECONDS = float(os.getenv('WORKER_POLL_SECONDS', 5))
+
+# Unique name of this worker, used as the owner of its leases
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def run_task(claim: dict[str, Any]) -> None:
+    '''Evaluate one claimed task, save its analytics row and checkpoint it'''
+
+    job_id, task_id = claim['job_id'], claim['task_id']
+    correct, error = None, None
+
+    try:
+        task = await run_in_threadpool(lookup_task, task_id)
+        if task is None:
+            raise LookupError(f"Task {task_id} not found")
+
+        # A previous attempt may have saved its row and crashed before the checkpoint
+        gpt_response = None
+        if claim['attempts'] > 0:
+            gpt_response = await run_in_threadpool(saved_answer, job_id, task_id)
+
+        if gpt_response is not None:
+            logger.info(f"INTERNAL - {task_id} of job {job_id} was answered by an earlier attempt")
+            correct = is_correct(gpt_response, task.final_answer)
+
+        else:
+
+            prompt = await build_prompt(task, claim['service'], model = claim['model'])
+
+            # Wait for the user's token bucket rather than failing the attempt, the lease is kept renewed
+            retry_after = rate_limiter.acquire(claim['user_id'], prompt.token_count)
+            while retry_after > 0:
+                logger.info(f"INTERNAL - {task_id} of job {job_id} waits {retry_after:.1f}s for the rate limit")
+                await asyncio.sleep(retry_after)
+                retry_after = rate_limiter.acquire(claim['user_id'], prompt.token_count)
+
+            row, result = await answer(prompt, claim['user_id'])
+
+            # Written before the checkpoint, so a task is only DONE once its row is saved.
+            # The unique (job_id, task_id) key turns a second write of the row into a no-op
+            row['job_id'] = job_id
+            await run_in_threadpool(insert_rows, [row])
+            correct = result['correct']
+
+    except Exception as exception:
+        logger.error(f"Error: worker could not evaluate {task_id} for job {job_id}")
+        logger.error(exception)
+        error = str(exception) or type(exception).__name__
+
+    await run_in_threadpool(finish_task, job_id, task_id, WORKER_ID, claim['attempts'] + 1, correct, error)
+
+
+def task_finished(job: asyncio.Task) -> None:
+    '''Log a task that failed outside its own error handling (e.g. finish_task() raised)'''
+
+    if not job.cancelled() and job.exception() is not None:
+        logger.error("Error: worker task could not be checkpointed, its lease will expire and it will be retried")
+        logger.error(job.exception())
+
+
+async def renew_periodically() -> None:
+    '''Keep the leases of running tasks alive while they take long'''
+
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            await run_in_threadpool(renew_leases, WORKER_ID)
+        except Exception as exception:
+            logger.error("Error: worker could not renew its leases")
+            logger.error(exception)
+
+
+async def run_worker() -> None:
+    '''Claim and evaluate tasks until the process is stopped'''
+
+    logger.info(f"INTERNAL - Worker {WORKER_ID} started")
+    await run_in_threadpool(prompt_catalog.refresh)
+    renewer = asyncio.create_task(renew_periodically())
+    running: set[asyncio.Task] = set()
+
+    try:
+        while True:
+            free = WORKER_CONCURRENCY - len(running)
+            claimed = []
+
+            if free > 0:
+                try:
+                    claimed = await run_in_threadpool(claim_tasks, WORKER_ID, free)
+                except Exception as exception:
+                    logger.error("Error: worker could not claim tasks")
+                    logger.error(exception)
+
+            for claim in claimed:
+                job = asyncio.create_task(run_task(claim))
+                running.add(job)
+                job.add_done_callback(running.discard)
+                job.add_done_callback(task_finished)
+
+            # Claim again at once while the queue fills every free slot, otherwise
+            # wait for a slot to free up or poll again later
+            if running and len(claimed) < free:
+                await asyncio.wait(running, timeout = WORKER_POLL_SECONDS, return_when = asyncio.FIRST_COMPLETED)
+            elif running:
+                await asyncio.wait(running, return_when = asyncio.FIRST_COMPLETED)
+            elif not claimed:
+                await asyncio.sleep(WORKER_POLL_SECONDS)
+
+    finally:
+        renewer.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())
@@ -13,6 +13,9 @@ def display_search_engine():
      # Back button to return to home (login) page
     if st.button("Logout"):
         if 'token' in st.session_state:
+            # Revoke the token on the server before forgetting it
+            headers = {"Authorization": f"Bearer {st.session_state['token']}"}
+            requests.post('http://'+ os.getenv("HOSTNAME") +':8000/logout', headers=headers)
             del st.session_state['token']
         st.session_state['logged_in'] = False
         st.session_state['page'] = 'overview'
@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import json
 from http import HTTPStatus
 import os
 from overview import display_overview_page
@@ -29,6 +30,45 @@ def query_gpt(task_id, updated_steps=None):
         return {'status': response.status_code, 'message': 'Error fetching GPT response.'}
 
 
+# Function to stream the GPT model response as it is generated
+def stream_gpt(task_id, updated_steps=None):
+    data = { 
+        'task_id': task_id,
+        'service': st.session_state['service'],
+        'updated_steps': updated_steps
+    }
+
+    auth_token = st.session_state['token']
+    headers = {
+            "Authorization": f"Bearer {auth_token}",
+            "Content-Type": "application/json"
+        }
+
+    # The final metadata event (or the error) is kept for the caller
+    st.session_state['gpt_metadata'] = {'status': HTTPStatus.INTERNAL_SERVER_ERROR, 'message': 'Error fetching GPT response.'}
+
+    with requests.post('http://'+ os.getenv("HOSTNAME") +':8000/querygpt/stream', json=data, headers=headers, stream=True) as response:
+        if response.status_code != HTTPStatus.OK:
+            st.session_state['gpt_metadata'] = {'status': response.status_code, 'message': 'Error fetching GPT response.'}
+            return
+
+        # A plain JSON body means the request failed before streaming started
+        if not response.headers.get('content-type', '').startswith('text/event-stream'):
+            st.session_state['gpt_metadata'] = response.json()
+            return
+
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('event:'):
+                event = line[len('event:'):].strip()
+            elif line.startswith('data:'):
+                payload = json.loads(line[len('data:'):].strip())
+                if event == 'token':
+                    yield payload['text']
+                else:
+                    st.session_state['gpt_metadata'] = payload
+
+
 # Function to record user's feedback
 def save_feedback(task_id, feedback):
     data = { 
@@ -57,6 +97,9 @@ def display_validation_page():
 
     if st.button("Logout", key="logout_button"):
         if 'token' in st.session_state:
+            # Revoke the token on the server before forgetting it
+            headers = {"Authorization": f"Bearer {st.session_state['token']}"}
+            requests.post('http://'+ os.getenv("HOSTNAME") +':8000/logout', headers=headers)
             del st.session_state['token']
         st.session_state['logged_in'] = False
         st.session_state['page'] = 'overview'
@@ -86,8 +129,9 @@ def display_validation_page():
     # Check if task_id is available in session state
     if 'action' in st.session_state:
         if st.session_state['action'] == True:
-            # Get GPT response from the FastAPI server
-            response = query_gpt(task_id)
+            # Show GPT's response as it streams in from the FastAPI server
+            st.write_stream(stream_gpt(task_id))
+            response = st.session_state['gpt_metadata']
                 
             if response['status'] == HTTPStatus.OK:
                 final_answer = response.get('final_answer', final_answer)